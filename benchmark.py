@@ -0,0 +1,425 @@
+"""
+Benchmark da auditoria de frete.
+
+Mede o tempo de abertura do programa, gera LPU e relatórios sintéticos
+(10 mil, 100 mil e 1 milhão de linhas por padrão), mede tempo e pico de
+memória de cada etapa de ProcessadorAuditoria.processar_relatorio (pelas
+métricas da própria auditoria) e da exportação, e confere que a auditoria
+em lote dá exatamente o mesmo resultado que a referência linha a linha
+(tests.referencia, que busca os preços direto na planilha da LPU) sobre o
+relatório como lido.
+
+    python benchmark.py
+    python benchmark.py --linhas 10000 100000 --json resultado.json
+    python benchmark.py --base resultado.json   # sai com código 1 se ficou mais lento
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from main import (
+    ContextoLPU, ExportadorRelatorio, LeitorArquivo, MetricasAuditoria, ProcessadorAuditoria,
+    RegistroLayouts, PESO_MAXIMO_TABELA
+)
+from tests.referencia import AuditorReferencia, COLUNAS_AUDITORIA
+
+# ================================================================
+# CONFIGURAÇÕES
+# ================================================================
+LINHAS_PADRAO = [10_000, 100_000, 1_000_000]
+AMOSTRA_REFERENCIA = 10_000  # Linhas conferidas contra a referência linha a linha (lenta)
+TOLERANCIA_REGRESSAO = 0.25  # Etapa 25% mais lenta que a base conta como regressão
+SEMENTE = 42
+REPETICOES_INICIALIZACAO = 5  # Vale o menor tempo (interpretador novo a cada vez)
+
+# Cenários de abertura, cada um num interpretador novo: o que a interface
+# espera antes de mostrar a janela, o caminho do CLI e a pilha de dados
+# completa (carregada em segundo plano pela interface)
+CENARIOS_INICIALIZACAO = {
+    'import_main': "import main",
+    'cli': "import sys, main; main.criar_parser().parse_args(['audit', '--lpu', 'x', 'y', '--out', 'z']); "
+           "sys.exit(int(any(m in sys.modules for m in ('tkinter', 'pandas', 'numpy'))))",
+    'pilha_dados': "import main; main.precarregar_dependencias()",
+}
+
+# Colunas da LPU: capitais (algumas acentuadas, como nas planilhas reais),
+# um polo do interior e o redespacho
+COLUNAS_LPU = [
+    "SP CAPITAL", "RIO DE JANEIRO", "BELO HORIZONTE", "CURITIBA", "PORTO ALEGRE",
+    "FLORIANÓPOLIS", "SALVADOR", "RECIFE", "FORTALEZA", "GOIÂNIA", "BRASÍLIA",
+    "MANAUS", "CAMPINAS", "REDESPACHO INTERIOR"
+]
+
+CIDADES_HUB = [("SAO PAULO", "SP"), ("SÃO PAULO", "SP"), ("BARUERI", "SP"),
+               ("OSASCO", "SP"), ("GUARULHOS", "SP"), ("CAJAMAR", "SP")]
+CIDADES_CAPITAL = [("RIO DE JANEIRO", "RJ"), ("BELO HORIZONTE", "MG"), ("CURITIBA", "PR"),
+                   ("PORTO ALEGRE", "RS"), ("FLORIANÓPOLIS", "SC"), ("SALVADOR", "BA"),
+                   ("RECIFE", "PE"), ("FORTALEZA", "CE"), ("GOIÂNIA", "GO"), ("BRASILIA", "DF"),
+                   ("MANAUS", "AM"), ("CAMPINAS", "SP")]
+CIDADES_INTERIOR = [("SOROCABA", "SP"), ("RIBEIRÃO PRETO", "SP"), ("NITERÓI", "RJ"),
+                    ("UBERLANDIA", "MG"), ("LONDRINA", "PR"), ("CAXIAS DO SUL", "RS"),
+                    ("JOINVILLE", "SC"), ("FEIRA DE SANTANA", "BA"), ("CARUARU", "PE"),
+                    ("ANAPOLIS", "GO"), ("PALMAS", "TO"), ("CIDADE SEM UF", "")]
+
+# ================================================================
+# GERAÇÃO DE DADOS
+# ================================================================
+
+class GeradorDados:
+    """LPU e relatórios de transportadora sintéticos, no formato das planilhas reais."""
+    
+    @staticmethod
+    def gerar_lpu(caminho: str, semente: int = SEMENTE):
+        """Tabela de 1 a PESO_MAXIMO_TABELA kg, com título acima e KG ADICIONAL no fim."""
+        rng = np.random.default_rng(semente)
+        n_cols = len(COLUNAS_LPU)
+        base = rng.uniform(8, 40, n_cols)
+        por_kg = rng.uniform(0.8, 3.5, n_cols)
+        
+        linhas = [["TABELA DE FRETE - LPU"] + [None] * n_cols, [None] * (n_cols + 1),
+                  ["PESO (KG)"] + COLUNAS_LPU]
+        for peso in range(1, PESO_MAXIMO_TABELA + 1):
+            precos = np.round(base + peso * por_kg, 2)
+            # Metade das colunas como texto em Real, como vem das planilhas
+            linhas.append([peso] + [GeradorDados._moeda(v) if j % 2 else float(v)
+                                    for j, v in enumerate(precos)])
+        linhas.append(["KG ADICIONAL"] + [f"{v:.2f}".replace('.', ',') for v in np.round(por_kg * 1.1, 2)])
+        
+        GeradorDados._gravar(pd.DataFrame(linhas), caminho)
+    
+    @staticmethod
+    def gerar_relatorio(caminho: str, n_linhas: int, uf_separada: bool = True, semente: int = SEMENTE):
+        """
+        Relatório de CT-es com cidade e UF em colunas separadas ou juntas
+        ("CIDADE - UF" / "CIDADE/UF"), valores em Real, pesos acima de
+        PESO_MAXIMO_TABELA kg e células vazias ou inválidas.
+        """
+        rng = np.random.default_rng(semente)
+        
+        # Origem quase sempre no hub; destino mistura hub, capital e interior
+        origem = GeradorDados._sortear_cidades(rng, n_linhas, [0.85, 0.10, 0.05])
+        destino = GeradorDados._sortear_cidades(rng, n_linhas, [0.15, 0.45, 0.40])
+        
+        # Pesos: ~15% acima de PESO_MAXIMO_TABELA kg
+        peso_real = np.round(rng.exponential(14, n_linhas) + 0.1, 2)
+        peso_cubado = np.round(peso_real * rng.uniform(0.5, 1.8, n_linhas), 2)
+        peso_taxado = np.maximum(peso_real, peso_cubado)
+        erro_peso = rng.random(n_linhas) < 0.08
+        peso_taxado[erro_peso] = np.round(peso_taxado[erro_peso] * rng.uniform(1.2, 3, erro_peso.sum()), 2)
+        
+        frete = np.round(20 + peso_taxado * rng.uniform(1.5, 6, n_linhas), 2)
+        
+        colunas = {
+            "CTE": np.arange(100_000, 100_000 + n_linhas),
+            "EMISSAO": pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, n_linhas), unit='D'),
+            "REMETENTE": "CD BARUERI",
+        }
+        if uf_separada:
+            colunas.update({"CIDADE ORIGEM": origem[0], "UF ORIGEM": origem[1],
+                            "DESTINATARIO": "CLIENTE", "CIDADE DESTINO": destino[0], "UF DESTINO": destino[1]})
+        else:
+            colunas.update({"CIDADE ORIGEM": GeradorDados._juntar_uf(origem, " - "),
+                            "DESTINATARIO": "CLIENTE",
+                            "CIDADE DESTINO": GeradorDados._juntar_uf(destino, "/")})
+        colunas.update({
+            "PESO REAL": GeradorDados._sujar(rng, GeradorDados._texto_decimal(rng, peso_real), 0.03),
+            "PESO CUBADO": GeradorDados._sujar(rng, peso_cubado.astype(object), 0.05),
+            "PESO TAXADO": GeradorDados._sujar(rng, peso_taxado.astype(object), 0.02),
+            "FRETE TOTAL": GeradorDados._sujar(rng, GeradorDados._texto_moeda(rng, frete), 0.02),
+        })
+        df = pd.DataFrame(colunas)
+        df["EMISSAO"] = df["EMISSAO"].dt.strftime("%d/%m/%Y")
+        
+        # Título e linha em branco acima do cabeçalho, como nos relatórios exportados
+        topo = pd.DataFrame([["RELATÓRIO DE FRETES - TRANSPORTADORA"] + [None] * (df.shape[1] - 1),
+                             [None] * df.shape[1], list(df.columns)])
+        df.columns = range(df.shape[1])
+        GeradorDados._gravar(pd.concat([topo, df], ignore_index=True), caminho)
+    
+    @staticmethod
+    def _sortear_cidades(rng, n: int, pesos: list) -> tuple:
+        """(cidades, ufs) sorteadas entre hub, capitais e interior nas proporções `pesos`."""
+        grupos = [CIDADES_HUB, CIDADES_CAPITAL, CIDADES_INTERIOR]
+        todas = [c for g in grupos for c in g]
+        probs = np.concatenate([np.full(len(g), p / len(g)) for g, p in zip(grupos, pesos)])
+        idx = rng.choice(len(todas), n, p=probs)
+        cidades = np.array([c for c, _ in todas], dtype=object)[idx]
+        ufs = np.array([u for _, u in todas], dtype=object)[idx]
+        return cidades, ufs
+    
+    @staticmethod
+    def _juntar_uf(cidades_ufs: tuple, separador: str) -> np.ndarray:
+        cidades, ufs = cidades_ufs
+        juntas = pd.Series(cidades) + separador + pd.Series(ufs)
+        return np.where(ufs == "", cidades, juntas.to_numpy(dtype=object))
+    
+    @staticmethod
+    def _moeda(valor: float) -> str:
+        """1234.5 → 'R$ 1.234,50'."""
+        return "R$ " + f"{valor:,.2f}".translate(str.maketrans(",.", ".,"))
+    
+    @staticmethod
+    def _texto_moeda(rng, valores: np.ndarray) -> np.ndarray:
+        """Mistura número, 'R$ 1.234,56' e '1234,56', como nas exportações dos ERPs."""
+        saida = valores.astype(object)
+        sorteio = rng.random(len(valores))
+        em_real = sorteio < 0.5
+        saida[em_real] = pd.Series(valores[em_real]).map(GeradorDados._moeda).to_numpy(dtype=object)
+        decimal = (sorteio >= 0.5) & (sorteio < 0.7)
+        saida[decimal] = pd.Series(valores[decimal]).map("{:.2f}".format).str.replace('.', ',').to_numpy(dtype=object)
+        return saida
+    
+    @staticmethod
+    def _texto_decimal(rng, valores: np.ndarray) -> np.ndarray:
+        """Parte dos valores com vírgula decimal."""
+        saida = valores.astype(object)
+        decimal = rng.random(len(valores)) < 0.3
+        saida[decimal] = pd.Series(valores[decimal]).map("{:.2f}".format).str.replace('.', ',').to_numpy(dtype=object)
+        return saida
+    
+    @staticmethod
+    def _sujar(rng, valores: np.ndarray, fracao: float) -> np.ndarray:
+        """Troca uma `fracao` das células por vazio ou texto inválido."""
+        sorteio = rng.random(len(valores))
+        valores[sorteio < fracao / 2] = None
+        valores[(sorteio >= fracao / 2) & (sorteio < fracao)] = "N/D"
+        return valores
+    
+    @staticmethod
+    def _gravar(df: pd.DataFrame, caminho: str):
+        if caminho.lower().endswith('.csv'):
+            df.to_csv(caminho, header=False, index=False, sep=';', encoding='latin1')
+        else:
+            df.to_excel(caminho, header=False, index=False)
+
+# ================================================================
+# MEDIÇÃO
+# ================================================================
+
+class Medidor:
+    """
+    Tempo e pico de memória de cada etapa.
+    
+    O tracemalloc deixa o código bem mais lento, então o tempo vem de uma
+    execução sem ele e o pico de memória de uma segunda execução da etapa.
+    """
+    
+    def __init__(self, medir_memoria: bool = True):
+        self.medir_memoria = medir_memoria
+        self.etapas = {}
+        # Memória ocupada pela tabela auditada (planilha + resultado)
+        self.tabela_mb = None
+    
+    def medir(self, etapa: str, funcao, *args, memoria: bool = True, **kwargs):
+        inicio = time.perf_counter()
+        resultado = funcao(*args, **kwargs)
+        segundos = time.perf_counter() - inicio
+        
+        pico = None
+        if self.medir_memoria and memoria:
+            tracemalloc.start()
+            try:
+                funcao(*args, **kwargs)
+                pico = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            finally:
+                tracemalloc.stop()
+        
+        self.etapas[etapa] = {'segundos': round(segundos, 4),
+                              'pico_mb': round(pico, 1) if pico is not None else None}
+        return resultado
+    
+    def medir_etapas(self, funcao, *args, **kwargs):
+        """
+        Mede uma função que recebe `metricas` (MetricasAuditoria): o tempo de
+        cada etapa vem das próprias métricas e o pico de memória, de um gancho
+        que zera o pico do tracemalloc no início de cada etapa.
+        """
+        metricas = MetricasAuditoria()
+        resultado = funcao(*args, metricas=metricas, **kwargs)
+        for etapa, m in metricas.etapas.items():
+            self.etapas[etapa] = {'segundos': round(m['segundos'], 4), 'pico_mb': None}
+        
+        if self.medir_memoria:
+            inicio_etapa = {}
+            
+            def gancho(evento):
+                if evento['tipo'] == 'inicio':
+                    inicio_etapa[evento['etapa']] = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                elif evento['tipo'] == 'etapa':
+                    pico = (tracemalloc.get_traced_memory()[1] - inicio_etapa[evento['etapa']]) / 1024 ** 2
+                    anterior = self.etapas[evento['etapa']]['pico_mb'] or 0.0
+                    self.etapas[evento['etapa']]['pico_mb'] = round(max(anterior, pico), 1)
+            
+            tracemalloc.start()
+            try:
+                funcao(*args, metricas=MetricasAuditoria([gancho]), **kwargs)
+            finally:
+                tracemalloc.stop()
+        return resultado
+
+class Benchmark:
+    """Roda o pipeline etapa por etapa sobre os dados gerados."""
+    
+    @staticmethod
+    def executar(linhas: list, pasta: str, formato: str = 'csv', amostra: int = AMOSTRA_REFERENCIA,
+                 medir_memoria: bool = True, formato_saida: str = 'xlsx') -> list:
+        caminho_lpu = os.path.join(pasta, 'lpu.xlsx')
+        GeradorDados.gerar_lpu(caminho_lpu)
+        # Sem registro de layouts: cada execução detecta a estrutura, como num layout novo
+        RegistroLayouts.caminho = None
+        ctx = ProcessadorAuditoria._compilar_lpu(caminho_lpu)
+        
+        resultados = []
+        for n in linhas:
+            for uf_separada in (True, False):
+                layout = 'uf_separada' if uf_separada else 'cidade_uf'
+                caminho = os.path.join(pasta, f'relatorio_{n}_{layout}.{formato}')
+                if not os.path.exists(caminho):
+                    print(f"Gerando {os.path.basename(caminho)}...", flush=True)
+                    GeradorDados.gerar_relatorio(caminho, n, uf_separada)
+                
+                saida = os.path.join(pasta, f'saida_{n}_{layout}.{formato_saida}')
+                medidor = Medidor(medir_memoria)
+                identico = Benchmark._rodar(ctx, caminho_lpu, caminho, saida, medidor, amostra)
+                resultados.append({'linhas': n, 'layout': layout, 'formato': formato,
+                                   'identico_referencia': identico, 'tabela_mb': medidor.tabela_mb,
+                                   'etapas': medidor.etapas})
+                Benchmark._imprimir(resultados[-1])
+        return resultados
+    
+    @staticmethod
+    def _rodar(ctx: ContextoLPU, caminho_lpu: str, caminho: str, saida: str, medidor: Medidor,
+               amostra: int) -> bool:
+        """Executa ProcessadorAuditoria.processar_relatorio e a exportação, medindo cada etapa."""
+        styled = medidor.medir_etapas(ProcessadorAuditoria.processar_relatorio, ctx, caminho)[0]
+        # A tabela que processar_relatorio devolve (e que vai para a exportação)
+        medidor.tabela_mb = round(styled.data.memory_usage(deep=True).sum() / 1024 ** 2, 1)
+        medidor.medir('exportacao', ExportadorRelatorio.exportar, styled, saida)
+        
+        # Referência linha a linha sobre o relatório como lido (sem conversão nem
+        # categorias), com preços e colunas buscados na planilha da LPU, sem ctx
+        idx_header, nomes, colunas_detectadas, posicoes = ProcessadorAuditoria._estrutura_relatorio(caminho)
+        bruto = LeitorArquivo.carregar_dados(caminho, idx_header, posicoes)
+        bruto.columns = [nomes[i] for i in posicoes]
+        referencia = AuditorReferencia(caminho_lpu, colunas_detectadas)
+        sub = bruto.iloc[:amostra].reset_index(drop=True)
+        esperado = medidor.medir('referencia_linha', referencia.auditar, sub, memoria=False)
+        try:
+            pd.testing.assert_frame_equal(styled.data[COLUNAS_AUDITORIA].iloc[:len(sub)].astype(object),
+                                          esperado.astype(object), check_dtype=False)
+            return True
+        except AssertionError as e:
+            print(f"  ✗ Divergência contra a referência: {e}", flush=True)
+            return False
+    
+    @staticmethod
+    def medir_inicializacao(repeticoes: int = REPETICOES_INICIALIZACAO) -> dict:
+        """
+        Tempo de abertura de cada cenário de CENARIOS_INICIALIZACAO. O
+        cenário 'cli' falha se importar tkinter, pandas ou numpy.
+        """
+        pasta = os.path.dirname(os.path.abspath(__file__))
+        etapas = {}
+        leve = True
+        for nome, codigo in CENARIOS_INICIALIZACAO.items():
+            tempos = []
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                processo = subprocess.run([sys.executable, "-c", codigo], cwd=pasta)
+                tempos.append(time.perf_counter() - inicio)
+            if nome == 'cli' and processo.returncode != 0:
+                leve = False
+            etapas[nome] = {'segundos': round(min(tempos), 4), 'pico_mb': None}
+        
+        resultado = {'linhas': 0, 'layout': 'inicializacao', 'formato': '-',
+                     'identico_referencia': leve, 'etapas': etapas}
+        print(f"\nInicialização (menor de {repeticoes}) - "
+              f"{'CLI sem tkinter/pandas' if leve else 'CLI IMPORTOU tkinter/pandas'}")
+        for etapa, m in etapas.items():
+            print(f"  {etapa:<18}{m['segundos']:>10.3f}s")
+        return resultado
+    
+    @staticmethod
+    def _imprimir(resultado: dict):
+        print(f"\n{resultado['linhas']:,} linhas ({resultado['layout']}, {resultado['formato']}) - "
+              f"{'idêntico' if resultado['identico_referencia'] else 'DIVERGENTE'} à referência")
+        for etapa, m in resultado['etapas'].items():
+            memoria = f"{m['pico_mb']:>9.1f} MB" if m['pico_mb'] is not None else ""
+            print(f"  {etapa:<18}{m['segundos']:>10.3f}s{memoria}")
+        if resultado.get('tabela_mb') is not None:
+            print(f"  {'tabela auditada':<18}{resultado['tabela_mb']:>20.1f} MB")
+        sys.stdout.flush()
+    
+    @staticmethod
+    def comparar(resultados: list, base: list, tolerancia: float = TOLERANCIA_REGRESSAO) -> list:
+        """Etapas mais lentas que na base além da tolerância: [(linhas, layout, etapa, antes, agora)]."""
+        indice = {(r['linhas'], r['layout'], r['formato']): r['etapas'] for r in base}
+        regressoes = []
+        for r in resultados:
+            anteriores = indice.get((r['linhas'], r['layout'], r['formato']), {})
+            for etapa, m in r['etapas'].items():
+                antes = anteriores.get(etapa, {}).get('segundos')
+                if etapa != 'referencia_linha' and antes and m['segundos'] > antes * (1 + tolerancia):
+                    regressoes.append((r['linhas'], r['layout'], etapa, antes, m['segundos']))
+        return regressoes
+
+# ================================================================
+# MAIN
+# ================================================================
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark da auditoria de frete com dados sintéticos.")
+    parser.add_argument("--linhas", type=int, nargs="+", default=LINHAS_PADRAO,
+                        help="Tamanhos dos relatórios gerados")
+    parser.add_argument("--formato", choices=["csv", "xlsx"], default="csv",
+                        help="Formato dos relatórios gerados (xlsx é lento de gerar acima de 100 mil linhas)")
+    parser.add_argument("--saida", choices=list(ExportadorRelatorio.FORMATOS), default="xlsx",
+                        help="Formato da etapa de exportação")
+    parser.add_argument("--pasta", default=None,
+                        help="Pasta dos dados gerados (reaproveitados entre execuções); padrão: temporária")
+    parser.add_argument("--amostra", type=int, default=AMOSTRA_REFERENCIA,
+                        help="Linhas conferidas contra a referência linha a linha")
+    parser.add_argument("--sem-memoria", action="store_true",
+                        help="Só mede tempo (sem a segunda execução de cada etapa para medir memória)")
+    parser.add_argument("--json", default=None, help="Grava os resultados neste arquivo")
+    parser.add_argument("--base", default=None,
+                        help="JSON de uma execução anterior; sai com código 1 se alguma etapa ficou mais lenta")
+    return parser
+
+def main(argv=None) -> int:
+    args = criar_parser().parse_args(argv)
+    
+    resultados = [Benchmark.medir_inicializacao()]
+    if args.pasta:
+        os.makedirs(args.pasta, exist_ok=True)
+        resultados += Benchmark.executar(args.linhas, args.pasta, args.formato, args.amostra,
+                                         not args.sem_memoria, args.saida)
+    else:
+        with tempfile.TemporaryDirectory() as pasta:
+            resultados += Benchmark.executar(args.linhas, pasta, args.formato, args.amostra,
+                                             not args.sem_memoria, args.saida)
+    
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    
+    codigo = 0 if all(r['identico_referencia'] for r in resultados) else 1
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            regressoes = Benchmark.comparar(resultados, json.load(f))
+        for linhas, layout, etapa, antes, agora in regressoes:
+            print(f"✗ Regressão {linhas:,} linhas ({layout}) em {etapa}: {antes:.3f}s → {agora:.3f}s")
+        if regressoes:
+            codigo = 1
+    return codigo
+
+if __name__ == "__main__":
+    sys.exit(main())
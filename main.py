@@ -1,17 +1,70 @@
-import pandas as pd
-import numpy as np
+from __future__ import annotations
+
 import re
 import os
 import sys
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
 from dataclasses import dataclass
 from typing import Dict, Optional
+from functools import lru_cache
+from collections import Counter
 import threading
+import queue
+import gc
 import warnings
+import argparse
+import glob
+import csv
+import time
+import logging
+import importlib.util
+import hashlib
+import heapq
+import json
+import cProfile
+from contextlib import contextmanager
 
 warnings.simplefilter("ignore")
 
+class _ModuloTardio:
+    """
+    Importa o módulo só no primeiro uso e então ocupa o lugar dele neste
+    módulo (pd/np passam a ser os módulos de verdade). Assim a interface
+    abre sem esperar pandas e numpy.
+    """
+    
+    def __init__(self, nome: str, apelido: str):
+        self._nome = nome
+        self._apelido = apelido
+    
+    def __getattr__(self, atributo):
+        modulo = importlib.import_module(self._nome)
+        globals()[self._apelido] = modulo
+        return getattr(modulo, atributo)
+
+pd = _ModuloTardio('pandas', 'pd')
+np = _ModuloTardio('numpy', 'np')
+
+def precarregar_dependencias():
+    """
+    Importa a pilha de dados (pandas, numpy, Styler/Jinja2, openpyxl) de uma
+    vez; a interface chama em segundo plano enquanto o usuário escolhe os
+    arquivos. Os imports explícitos também mantêm esses pacotes visíveis
+    para o PyInstaller.
+    """
+    import numpy
+    import pandas
+    import pandas.io.formats.style
+    import openpyxl
+    globals().update(np=numpy, pd=pandas)
+
+def _importar_tkinter():
+    """tkinter só é importado pela interface gráfica (o CLI não precisa dele)."""
+    global tk, filedialog, messagebox, ttk
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+log = logging.getLogger("auditoria")
+
 try:
     sys.stdout.reconfigure(encoding='utf-8')
 except:
@@ -22,6 +75,46 @@ except:
 # ================================================================
 MARGEM_TOLERANCIA = 15.00
 LIMITE_PERCENTUAL_CRITICO = 0.10
+PESO_MAXIMO_TABELA = 30  # Acima disso a LPU cobra por kg adicional
+TAMANHO_CACHE_LOCALIZACAO = 100_000  # Textos de cidade/UF normalizados mantidos em memória
+TAMANHO_BLOCO_PADRAO = 100_000  # Linhas por bloco no modo em blocos (CSV grande)
+TAMANHO_PARTE_AUDITORIA = 50_000  # Linhas por parte da auditoria (progresso/cancelamento)
+INTERVALO_FILA_GUI_MS = 100  # Frequência com que a interface lê o progresso da auditoria
+LINHAS_BUSCA_CABECALHO = 30
+LINHAS_BUSCA_PESO_LPU = 20
+PALAVRAS_CABECALHO = ['PESO', 'CIDADE', 'FRETE', 'ORIGEM', 'DESTINO', 'REMETENTE', 'DESTINATARIO']
+TAMANHO_LOTE_CTE = 500  # XMLs de CT-e por tarefa na leitura em paralelo (ver LeitorCTe)
+VERSAO_DETECTOR = 1  # Incrementar sempre que DetectorEstrutura mudar o resultado
+FAIXAS_PESO = (5, 10, 20, 30, 50, 100)  # Limites (kg, inclusivos) das faixas de peso do resumo gerencial
+TOP_N_DIVERGENCIAS = 50  # CT-es mais cobrados acima da LPU listados no resumo gerencial
+
+# Cache em disco das LPUs compiladas (ver CacheLPU)
+PASTA_CACHE_LPU = os.path.join(
+    os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'auditoria_frete', 'lpu'
+)
+TAMANHO_MAXIMO_CACHE_LPU = 50 * 1024 * 1024  # bytes
+VERSAO_PARSER_LPU = 1  # Incrementar sempre que _carregar_lpu mudar o resultado
+
+# Resultados por linha das últimas auditorias (ver CacheAuditoria)
+PASTA_CACHE_AUDITORIA = os.path.join(os.path.dirname(PASTA_CACHE_LPU), 'auditorias')
+TAMANHO_MAXIMO_CACHE_AUDITORIA = 500 * 1024 * 1024  # bytes
+VERSAO_AUDITORIA = 1  # Incrementar sempre que a regra de auditoria mudar o resultado
+
+# Layouts de relatório já vistos e mapeamentos fixados (ver RegistroLayouts)
+CAMINHO_LAYOUTS = os.path.join(os.path.dirname(PASTA_CACHE_LPU), 'layouts.json')
+ESPERA_TRAVA_LAYOUTS = 10  # segundos; trava mais antiga que isso é de um processo que morreu
+
+# Banco com os resultados de todas as auditorias (ver HistoricoAuditoria)
+CAMINHO_HISTORICO = os.path.join(os.path.dirname(PASTA_CACHE_LPU), 'historico.sqlite')
+
+# Serviço local de auditoria (ver ServicoAuditoria)
+PORTA_SERVICO = 8765
+TAMANHO_MAXIMO_UPLOAD = 200 * 1024 * 1024  # bytes por relatório enviado
+
+# Monitoramento da pasta de entrada (ver MonitorPasta)
+INTERVALO_MONITOR_S = 2  # Segundos entre as varreduras da pasta
+ESPERA_ARQUIVO_ESTAVEL_S = 5  # Sem mudar de tamanho por esse tempo = cópia terminada
 
 HUB_CENTRAL = {
     "SAO PAULO","SÃO PAULO","BARUERI","SANTANA DE PARNAIBA","SANTANA DE PARNAÍBA",
@@ -61,6 +154,82 @@ def safe_float(valor):
     except: 
         return 0.0
 
+PADRAO_NUMERO = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:E[+-]?\d+)?'
+
+def converter_numeros(valores) -> tuple:
+    """
+    Versão vetorizada de safe_float para uma coluna inteira.
+    
+    Retorna (numeros, falhas): array float64 com o mesmo valor que safe_float
+    daria para cada célula e máscara das células preenchidas que não puderam
+    ser convertidas (e por isso valem 0.0).
+    """
+    serie = valores if isinstance(valores, pd.Series) else pd.Series(valores)
+    
+    # Caminho rápido: coluna já numérica
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        numeros = serie.to_numpy(dtype=float, na_value=np.nan)
+        return np.where(np.isnan(numeros), 0.0, numeros), np.zeros(len(numeros), dtype=bool)
+    
+    # Demais casos: converte só os valores distintos
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    unicos = np.asarray(unicos, dtype=object)
+    numeros_unicos = np.zeros(len(unicos))
+    falhas_unicas = np.zeros(len(unicos), dtype=bool)
+    
+    eh_texto = np.fromiter((isinstance(v, str) for v in unicos), dtype=bool, count=len(unicos))
+    
+    # Valores que não são texto: números do Excel convertem; demais objetos
+    # (Decimal de um banco, por exemplo) passam por float(), e datas e o que
+    # não converte valem 0.0 e contam como falha, como em safe_float
+    outros = np.flatnonzero(~eh_texto)
+    if len(outros):
+        eh_numero = np.fromiter((isinstance(v, (int, float, bool, np.number)) for v in unicos[outros]),
+                                dtype=bool, count=len(outros))
+        for i in outros[~eh_numero]:
+            try:
+                numeros_unicos[i] = float(unicos[i])
+            except (TypeError, ValueError):
+                falhas_unicas[i] = True
+            else:
+                if np.isnan(numeros_unicos[i]):
+                    numeros_unicos[i], falhas_unicas[i] = 0.0, True
+        numericos = outros[eh_numero]
+        if len(numericos):
+            convertidos = pd.to_numeric(pd.Series(unicos[numericos]), errors='coerce').to_numpy(dtype=float)
+            falhas_unicas[numericos] = np.isnan(convertidos)
+            numeros_unicos[numericos] = np.where(np.isnan(convertidos), 0.0, convertidos)
+    
+    # Texto: "R$ 1.234,56", "1234,56", "12.5", vazio ou lixo
+    textos = np.flatnonzero(eh_texto)
+    if len(textos):
+        original = pd.Series(unicos[textos], dtype=object)
+        vazio = (original.str.strip() == "").to_numpy()
+        limpo = original.str.upper().str.replace("R$", "", regex=False).str.strip()
+        milhar = limpo.str.contains(".", regex=False) & limpo.str.contains(",", regex=False)
+        limpo = limpo.where(~milhar, limpo.str.replace(".", "", regex=False))
+        limpo = limpo.str.replace(",", ".", regex=False)
+        
+        simples = limpo.str.fullmatch(PADRAO_NUMERO).to_numpy(dtype=bool)
+        numeros_texto = np.zeros(len(textos))
+        falhas_texto = np.zeros(len(textos), dtype=bool)
+        numeros_texto[simples] = limpo[simples].to_numpy(dtype=object).astype(float)
+        
+        # O que a regex não cobre ("INF", "1_000"...) ou é lixo vai para float()
+        for i in np.flatnonzero(~simples & ~vazio):
+            try:
+                numeros_texto[i] = float(limpo.iat[i])
+            except ValueError:
+                falhas_texto[i] = True
+        
+        numeros_unicos[textos] = numeros_texto
+        falhas_unicas[textos] = falhas_texto
+    
+    # Código -1 (célula vazia) cai na posição extra, que vale 0.0 e não é falha
+    numeros = np.append(numeros_unicos, 0.0)[codigos]
+    falhas = np.append(falhas_unicas, False)[codigos]
+    return numeros, falhas
+
 def limpar_texto(texto) -> str:
     if isinstance(texto, pd.Series):
         texto = texto.iloc[0] if not texto.empty else ""
@@ -74,6 +243,61 @@ def formatar_moeda(valor):
         return "-"
     return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
+def nome_relatorio(caminho: str, aba: Optional[str] = None) -> str:
+    """Nome do relatório nas saídas: o do arquivo, mais a aba quando cada aba é um relatório."""
+    # normpath: uma pasta de XMLs com barra no fim teria basename vazio
+    nome = os.path.basename(os.path.normpath(caminho))
+    return f"{nome} [{aba}]" if aba is not None else nome
+
+def arredondar(valores, casas: int = 2) -> np.ndarray:
+    """Arredonda um array com o mesmo resultado do round() nativo do Python.
+    
+    np.round multiplica por 10**casas antes de arredondar, o que pode
+    divergir do round() em valores muito próximos de meio centavo. Esses
+    casos (raros) são refeitos com round().
+    """
+    valores = np.asarray(valores, dtype=float)
+    resultado = np.round(valores, casas)
+    escalado = valores * 10 ** casas
+    duvidosos = np.flatnonzero(np.abs(np.abs(escalado - np.trunc(escalado)) - 0.5) < 1e-6)
+    for i in duvidosos:
+        resultado[i] = round(float(valores[i]), casas)
+    return resultado
+
+def fatorar_pares(a, b) -> tuple:
+    """Fatoriza pares (a[i], b[i]).
+    
+    Retorna (codigos, pares_unicos), onde pares_unicos[codigos[i]] == (a[i], b[i]).
+    """
+    cod_a, unicos_a = _fatorar(a)
+    cod_b, unicos_b = _fatorar(b)
+    largura = max(len(unicos_b), 1)
+    codigos, unicos = pd.factorize(cod_a.astype(np.int64) * largura + cod_b)
+    pares = [(unicos_a[u // largura], unicos_b[u % largura]) for u in unicos]
+    return codigos, pares
+
+def _fatorar(valores) -> tuple:
+    """Códigos e valores distintos; Categoricals já vêm fatorados."""
+    if isinstance(valores, pd.Categorical):
+        return valores.codes, np.asarray(valores.categories, dtype=object)
+    return pd.factorize(np.asarray(valores, dtype=object), use_na_sentinel=False)
+
+def _fatorar_coluna(serie: pd.Series, como_texto: bool = False) -> tuple:
+    """
+    pd.factorize da coluna com as vazias como valor (e, com como_texto, de
+    serie.astype(str)), sem passar linha a linha se ela já é categórica.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Código -1 (vazia) cai no NaN acrescentado ao fim
+        valores = np.append(np.asarray(serie.cat.categories, dtype=object), np.nan)
+        if como_texto:
+            valores = pd.Series(valores, dtype=object).astype(str).to_numpy(dtype=object)
+        codigos, unicos = pd.factorize(valores, use_na_sentinel=False)
+        return codigos[serie.cat.codes], unicos
+    if como_texto:
+        serie = serie.astype(str)
+    return pd.factorize(serie, use_na_sentinel=False)
+
 # ================================================================
 # LEITOR INTELIGENTE DE ARQUIVOS
 # ================================================================
@@ -81,14 +305,20 @@ def formatar_moeda(valor):
 class LeitorArquivo:
     """Lê arquivos Excel/CSV de forma inteligente."""
     
+    # Engine das planilhas Excel: 'openpyxl' (padrão) ou 'calamine' (bem mais
+    # rápida, requer o pacote python-calamine)
+    engine_excel = 'openpyxl'
+    
     @staticmethod
-    def carregar(caminho: str) -> pd.DataFrame:
-        """Carrega arquivo detectando engine e formato."""
+    def carregar(caminho: str, linhas_pular: int = 0, max_linhas: Optional[int] = None,
+                 aba: Optional[str] = None) -> pd.DataFrame:
+        """Carrega arquivo detectando engine e formato (no Excel, a aba informada ou a primeira)."""
         ext = caminho.lower().split('.')[-1]
         
         if ext in ['xls', 'xlsx', 'xlsm']:
-            engine = 'xlrd' if ext == 'xls' else 'openpyxl'
-            return pd.read_excel(caminho, header=None, engine=engine)
+            return pd.read_excel(caminho, header=None, engine=LeitorArquivo._engine(ext),
+                                 sheet_name=0 if aba is None else aba,
+                                 skiprows=linhas_pular, nrows=max_linhas)
         elif ext == 'csv':
             try:
                 return pd.read_csv(caminho, header=None, sep=None, engine='python', encoding='latin1')
@@ -97,22 +327,149 @@ class LeitorArquivo:
         else:
             raise Exception(f"Formato não suportado: {ext}")
     
+    @staticmethod
+    def carregar_tabela(caminho: str, localizar_cabecalho, linhas_sondagem: int) -> pd.DataFrame:
+        """
+        Carrega o arquivo a partir da linha de cabeçalho (que fica na linha 0).
+        
+        Excel é lido em duas fases: primeiro só as `linhas_sondagem` linhas
+        iniciais, para localizar_cabecalho(df) achar o cabeçalho; depois só o
+        intervalo de dados. Outros formatos são lidos inteiros.
+        """
+        inicio = time.perf_counter()
+        ext = caminho.lower().split('.')[-1]
+        
+        if ext in ['xls', 'xlsx', 'xlsm']:
+            sondagem = LeitorArquivo.carregar(caminho, max_linhas=linhas_sondagem)
+            idx_header = localizar_cabecalho(sondagem)
+            meio = time.perf_counter()
+            df = LeitorArquivo.carregar(caminho, linhas_pular=idx_header)
+            log.info("Carga %s: sondagem %.2fs, dados %.2fs (%d linhas, engine %s)",
+                     os.path.basename(caminho), meio - inicio, time.perf_counter() - meio,
+                     len(df), LeitorArquivo._engine(ext))
+            return df
+        
+        df = LeitorArquivo.carregar(caminho)
+        idx_header = localizar_cabecalho(df)
+        log.info("Carga %s: %.2fs (%d linhas)", os.path.basename(caminho),
+                 time.perf_counter() - inicio, len(df))
+        return df.iloc[idx_header:].reset_index(drop=True)
+    
+    @staticmethod
+    def abas(caminho: str) -> list:
+        """Nomes das abas de uma planilha Excel, na ordem da pasta de trabalho ([] nos demais formatos)."""
+        ext = caminho.lower().split('.')[-1]
+        
+        if ext in ['xlsx', 'xlsm']:
+            # Só o índice da pasta de trabalho, sem abrir as abas nem as strings compartilhadas
+            import zipfile
+            import xml.etree.ElementTree as ET
+            with zipfile.ZipFile(caminho) as zf, zf.open('xl/workbook.xml') as f:
+                return [elem.get('name') for _, elem in ET.iterparse(f)
+                        if elem.tag.rpartition('}')[2] == 'sheet']
+        elif ext == 'xls':
+            with pd.ExcelFile(caminho, engine=LeitorArquivo._engine(ext)) as arquivo:
+                return list(arquivo.sheet_names)
+        return []
+    
+    @staticmethod
+    def _engine(ext: str) -> str:
+        if LeitorArquivo.engine_excel == 'calamine':
+            if importlib.util.find_spec('python_calamine') is None:
+                raise Exception("Engine calamine requer o pacote python-calamine (pip install python-calamine)")
+            return 'calamine'
+        return 'xlrd' if ext == 'xls' else 'openpyxl'
+    
+    @staticmethod
+    def abrir_csv_em_blocos(caminho: str, tamanho_bloco: int, colunas: Optional[list] = None):
+        """
+        Abre CSV para leitura incremental (iteração bloco a bloco).
+        
+        Usa o mesmo separador e encoding que carregar() usaria, mas com o
+        parser C e todas as células como texto, como na leitura completa.
+        `colunas` restringe a leitura a essas posições.
+        """
+        sep, encoding = LeitorArquivo._detectar_formato_csv(caminho)
+        return pd.read_csv(caminho, header=None, sep=sep, encoding=encoding,
+                           dtype=str, usecols=colunas, chunksize=tamanho_bloco)
+    
+    @staticmethod
+    def sondar(caminho: str, n_linhas: int, aba: Optional[str] = None) -> pd.DataFrame:
+        """Primeiras n_linhas do arquivo, sem cabeçalho (para localizar o cabeçalho)."""
+        if caminho.lower().endswith('.csv'):
+            sep, encoding = LeitorArquivo._detectar_formato_csv(caminho)
+            return pd.read_csv(caminho, header=None, sep=sep, encoding=encoding,
+                               dtype=str, nrows=n_linhas)
+        return LeitorArquivo.carregar(caminho, max_linhas=n_linhas, aba=aba)
+    
+    @staticmethod
+    def carregar_dados(caminho: str, idx_header: int, colunas: list, aba: Optional[str] = None) -> pd.DataFrame:
+        """
+        Carrega só as linhas de dados (após o cabeçalho) e só as colunas nas
+        posições `colunas`. Tipos explícitos: texto no CSV e o valor bruto da
+        célula no Excel, como na leitura completa da planilha.
+        """
+        ext = caminho.lower().split('.')[-1]
+        
+        if ext in ['xls', 'xlsx', 'xlsm']:
+            return pd.read_excel(caminho, header=None, engine=LeitorArquivo._engine(ext),
+                                 sheet_name=0 if aba is None else aba,
+                                 skiprows=idx_header + 1, usecols=colunas, dtype=object)
+        elif ext == 'csv':
+            sep, encoding = LeitorArquivo._detectar_formato_csv(caminho)
+            df = pd.read_csv(caminho, header=None, sep=sep, encoding=encoding,
+                             dtype=str, usecols=colunas)
+            return df.iloc[idx_header + 1:]
+        else:
+            raise Exception(f"Formato não suportado: {ext}")
+    
+    @staticmethod
+    def _detectar_formato_csv(caminho: str) -> tuple:
+        """Separador e encoding: sniff da primeira linha em latin1, senão ';' em utf-8."""
+        try:
+            with open(caminho, encoding='latin1', newline='') as f:
+                primeira_linha = f.readline()
+            return csv.Sniffer().sniff(primeira_linha).delimiter, 'latin1'
+        except csv.Error:
+            return ';', 'utf-8'
+    
     @staticmethod
     def encontrar_cabecalho(df: pd.DataFrame, palavras_chave: list) -> int:
         """Encontra linha do cabeçalho baseado em palavras-chave."""
-        for i in range(min(30, len(df))):
+        for i in range(min(LINHAS_BUSCA_CABECALHO, len(df))):
             row_str = " ".join([str(x).upper() for x in df.iloc[i].values])
             score = sum(1 for palavra in palavras_chave if palavra in row_str)
             if score >= 3:  # Precisa de pelo menos 3 matches
                 return i
         return 0
     
+    @staticmethod
+    def encontrar_linha_peso(df: pd.DataFrame) -> int:
+        """Encontra o cabeçalho da LPU: primeira linha com "PESO" na coluna A."""
+        for i in range(min(LINHAS_BUSCA_PESO_LPU, len(df))):
+            if "PESO" in str(df.iloc[i, 0]).upper():
+                return i
+        return 0
+    
     @staticmethod
     def deduplica_colunas(df: pd.DataFrame) -> pd.DataFrame:
         """Remove colunas duplicadas adicionando sufixos."""
+        cols = LeitorArquivo.nomes_colunas(df.columns)
+        
+        df = df.iloc[:, :len(cols)]
+        df.columns = cols
+        return df.loc[:, ~df.columns.str.startswith('UNNAMED')]
+    
+    @staticmethod
+    def nomes_colunas(cabecalho) -> list:
+        """
+        Nomes das colunas como deduplica_colunas os atribui: maiúsculos, sem
+        'UNNAMED' e com sufixo _DUPn nas repetições. O i-ésimo nome vai para
+        a i-ésima coluna da planilha.
+        """
         cols = []
         seen = {}
-        for c in df.columns:
+        for c in cabecalho:
             c_str = str(c).upper().strip()
             if 'UNNAMED' in c_str:
                 continue
@@ -122,10 +479,188 @@ class LeitorArquivo:
             else:
                 seen[c_str] = 0
                 cols.append(c_str)
+        return cols
+
+# ================================================================
+# LEITOR DE CT-e (XML)
+# ================================================================
+
+def _ler_lote_cte(origem: Optional[str], nomes: list) -> tuple:
+    """
+    Lê os CT-es dos XMLs `nomes`: caminhos de arquivo ou, com origem,
+    membros desse zip (lidos direto do zip, sem extrair). Retorna
+    (registros, invalidos): uma tupla por CT-e, na ordem de
+    LeitorCTe.COLUNAS, e os XMLs que não puderam ser lidos.
+    """
+    import zipfile
+    from xml.etree.ElementTree import ParseError
+    
+    registros, invalidos = [], []
+    arquivo_zip = zipfile.ZipFile(origem) if origem else None
+    try:
+        for nome in nomes:
+            try:
+                with (arquivo_zip.open(nome) if arquivo_zip else open(nome, 'rb')) as f:
+                    registros.extend(LeitorCTe.ler_xml(f, os.path.basename(nome)))
+            except (ParseError, OSError, zipfile.BadZipFile) as e:
+                invalidos.append(f"{os.path.basename(nome)}: {e}")
+    finally:
+        if arquivo_zip:
+            arquivo_zip.close()
+    return registros, invalidos
+
+class LeitorCTe:
+    """
+    Monta o relatório direto dos XMLs de CT-e (um .xml, um .zip com os XMLs
+    ou uma pasta com XMLs e zips), no lugar da planilha exportada do portal
+    da transportadora.
+    
+    Cada XML é lido com iterparse (só os grupos ide, emit, vPrest e infQ),
+    em lotes distribuídos entre processos. O resultado tem as colunas e o
+    mapeamento que DetectorEstrutura daria para uma planilha equivalente.
+    """
+    
+    # Processos da leitura (None = um por CPU). Dentro de um worker da
+    # auditoria em lote a leitura é sempre sequencial
+    processos: Optional[int] = None
+    
+    # Coluna do relatório e o campo que ela representa (None = só coluna extra)
+    COLUNAS = [
+        ('cte', 'CTE'),
+        (None, 'CHAVE'),
+        ('emissao', 'EMISSAO'),
+        ('transportadora', 'TRANSPORTADORA'),
+        ('origem_cidade', 'CIDADE ORIGEM'),
+        ('origem_uf', 'UF ORIGEM'),
+        ('destino_cidade', 'CIDADE DESTINO'),
+        ('destino_uf', 'UF DESTINO'),
+        ('peso_real', 'PESO REAL'),
+        ('peso_cubado', 'PESO CUBADO'),
+        ('peso_taxado', 'PESO TAXADO'),
+        ('frete_total', 'FRETE TOTAL'),
+        (None, 'ARQUIVO'),
+    ]
+    
+    # tpMed do infQ -> peso; vale o primeiro termo encontrado (sem termo: peso real)
+    TIPOS_PESO = [('CUB', 'peso_cubado'), ('TAX', 'peso_taxado'), ('BASE', 'peso_taxado'),
+                  ('CALC', 'peso_taxado')]
+    
+    # cUnid do infQ: 01 = KG, 02 = TON (demais unidades não são peso)
+    FATOR_UNIDADE = {'01': 1.0, '02': 1000.0}
+    
+    @staticmethod
+    def aceita(caminho: str) -> bool:
+        return os.path.isdir(caminho) or caminho.lower().endswith(('.xml', '.zip'))
+    
+    @staticmethod
+    def carregar(caminho: str, metricas: Optional[MetricasAuditoria] = None) -> tuple:
+        """Lê todos os CT-es de caminho. Retorna (df, colunas_detectadas)."""
+        lotes = [(origem, nomes[i:i + TAMANHO_LOTE_CTE])
+                 for origem, nomes in LeitorCTe.listar(caminho)
+                 for i in range(0, len(nomes), TAMANHO_LOTE_CTE)]
+        if not lotes:
+            raise Exception(f"Nenhum XML de CT-e em {nome_relatorio(caminho)}")
         
-        df = df.iloc[:, :len(cols)]
-        df.columns = cols
-        return df.loc[:, ~df.columns.str.startswith('UNNAMED')]
+        import multiprocessing
+        processos = LeitorCTe.processos or os.cpu_count() or 1
+        if multiprocessing.parent_process() is not None:
+            processos = 1
+        
+        if processos > 1 and len(lotes) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(processos, len(lotes))) as pool:
+                partes = list(pool.map(_ler_lote_cte, *zip(*lotes)))
+        else:
+            partes = [_ler_lote_cte(origem, nomes) for origem, nomes in lotes]
+        
+        registros = [r for parte, _ in partes for r in parte]
+        invalidos = [i for _, parte in partes for i in parte]
+        if invalidos:
+            log.warning("%d XML(s) inválido(s) em %s, ex.: %s",
+                        len(invalidos), nome_relatorio(caminho), invalidos[0])
+        if metricas is not None:
+            metricas.contadores['xml_invalidos'] = len(invalidos)
+        if not registros:
+            raise Exception(f"Nenhum CT-e encontrado em {nome_relatorio(caminho)}")
+        
+        df = pd.DataFrame.from_records(registros, columns=[nome for _, nome in LeitorCTe.COLUNAS])
+        df['EMISSAO'] = pd.to_datetime(df['EMISSAO'], format='%Y-%m-%d', errors='coerce')
+        colunas_detectadas = {campo: nome for campo, nome in LeitorCTe.COLUNAS if campo}
+        return df, colunas_detectadas
+    
+    @staticmethod
+    def listar(caminho: str) -> list:
+        """[(zip ou None, [XMLs])], em ordem de nome, de um .xml, .zip ou pasta."""
+        import zipfile
+        
+        if os.path.isdir(caminho):
+            arquivos = sorted(os.path.join(raiz, nome)
+                              for raiz, _, nomes in os.walk(caminho) for nome in nomes)
+        else:
+            arquivos = [caminho]
+        
+        grupos = []
+        soltos = [a for a in arquivos if a.lower().endswith('.xml')]
+        if soltos:
+            grupos.append((None, soltos))
+        for arquivo in arquivos:
+            if arquivo.lower().endswith('.zip'):
+                with zipfile.ZipFile(arquivo) as zf:
+                    nomes = sorted(n for n in zf.namelist() if n.lower().endswith('.xml'))
+                if nomes:
+                    grupos.append((arquivo, nomes))
+        return grupos
+    
+    @staticmethod
+    def ler_xml(arquivo, nome: str) -> list:
+        """Registros dos CT-es de um XML (normalmente um por arquivo)."""
+        import xml.etree.ElementTree as ET
+        
+        registros = []
+        atual = {}
+        for _, elem in ET.iterparse(arquivo, events=('end',)):
+            tag = elem.tag.rpartition('}')[2]
+            if tag in ('ide', 'emit', 'vPrest', 'infQ'):
+                filhos = {filho.tag.rpartition('}')[2]: (filho.text or '').strip() for filho in elem}
+                if tag == 'infQ':
+                    LeitorCTe._guardar_peso(atual, filhos)
+                elif tag == 'emit':
+                    atual['transportadora'] = filhos.get('xNome')
+                elif tag == 'vPrest':
+                    atual['frete'] = LeitorCTe._numero(filhos.get('vTPrest'))
+                else:
+                    atual.update(filhos)
+                elem.clear()
+            elif tag == 'infCte':
+                registros.append((
+                    atual.get('nCT'), elem.get('Id', '')[3:] or None,
+                    (atual.get('dhEmi') or atual.get('dEmi') or '')[:10] or None,
+                    atual.get('transportadora'),
+                    atual.get('xMunIni'), atual.get('UFIni'), atual.get('xMunFim'), atual.get('UFFim'),
+                    atual.get('peso_real', np.nan), atual.get('peso_cubado', np.nan),
+                    atual.get('peso_taxado', np.nan), atual.get('frete', np.nan), nome
+                ))
+                atual = {}
+                elem.clear()
+        return registros
+    
+    @staticmethod
+    def _guardar_peso(atual: dict, filhos: dict):
+        """Guarda o peso de um infQ em kg (só o primeiro de cada tipo)."""
+        fator = LeitorCTe.FATOR_UNIDADE.get(filhos.get('cUnid'))
+        if fator is None:
+            return
+        tipo = limpar_texto(filhos.get('tpMed'))
+        campo = next((c for termo, c in LeitorCTe.TIPOS_PESO if termo in tipo), 'peso_real')
+        if campo not in atual:
+            atual[campo] = LeitorCTe._numero(filhos.get('qCarga')) * fator
+    
+    @staticmethod
+    def _numero(texto) -> float:
+        try:
+            return float(texto)
+        except (TypeError, ValueError):
+            return np.nan
 
 # ================================================================
 # EXTRATOR DE LOCALIZAÇÃO
@@ -211,6 +746,63 @@ class ExtratorLocalizacao:
                 resultado['destino_uf'] = uf
         
         return resultado
+    
+    @staticmethod
+    def processar_lote(df: pd.DataFrame, colunas_detectadas: dict) -> dict:
+        """
+        Versão em lote de processar_linha: devolve as mesmas chaves, mas cada
+        valor é um pd.Categorical com uma posição por linha do DataFrame.
+        
+        Cada valor distinto da coluna é normalizado uma única vez, e o
+        resultado fica num cache LRU compartilhado entre auditorias.
+        """
+        vazio = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int64), categories=[''])
+        resultado = {
+            'origem_cidade': vazio,
+            'origem_uf': vazio,
+            'destino_cidade': vazio,
+            'destino_uf': vazio
+        }
+        
+        for lado in ('origem', 'destino'):
+            if f'{lado}_cidade' not in colunas_detectadas:
+                continue
+            codigos, unicos = _fatorar_coluna(df[colunas_detectadas[f'{lado}_cidade']], como_texto=True)
+            
+            # Se tem coluna UF separada, usa ela
+            if f'{lado}_uf' in colunas_detectadas:
+                cidades = [_normalizar_texto(c) for c in unicos]
+                cod_uf, unicos_uf = _fatorar_coluna(df[colunas_detectadas[f'{lado}_uf']])
+                ufs = [_normalizar_texto(u) for u in unicos_uf]
+                resultado[f'{lado}_uf'] = ExtratorLocalizacao._categorizar(cod_uf, ufs)
+            else:
+                # Extrai cidade e UF do mesmo campo
+                pares = [_normalizar_cidade_uf(c) for c in unicos]
+                cidades = [c for c, _ in pares]
+                resultado[f'{lado}_uf'] = ExtratorLocalizacao._categorizar(codigos, [u for _, u in pares])
+            
+            resultado[f'{lado}_cidade'] = ExtratorLocalizacao._categorizar(codigos, cidades)
+        
+        return resultado
+    
+    @staticmethod
+    def _categorizar(codigos, normalizados: list) -> pd.Categorical:
+        """
+        Monta o Categorical por linha a partir dos códigos da coluna original
+        e do valor normalizado de cada código (textos diferentes podem
+        normalizar para o mesmo valor).
+        """
+        cod_norm, categorias = pd.factorize(np.asarray(normalizados, dtype=object))
+        return pd.Categorical.from_codes(cod_norm[codigos], categories=categorias)
+
+# Caches compartilhados entre auditorias do mesmo processo
+@lru_cache(maxsize=TAMANHO_CACHE_LOCALIZACAO, typed=True)
+def _normalizar_texto(texto) -> str:
+    return limpar_texto(texto)
+
+@lru_cache(maxsize=TAMANHO_CACHE_LOCALIZACAO)
+def _normalizar_cidade_uf(texto: str) -> tuple:
+    return ExtratorLocalizacao.extrair_cidade_uf(texto)
 
 # ================================================================
 # DETECTOR DE ESTRUTURA
@@ -219,6 +811,11 @@ class ExtratorLocalizacao:
 class DetectorEstrutura:
     """Detecta automaticamente a estrutura das colunas da planilha."""
     
+    # Identificam o CT-e mas não entram na auditoria (ver HistoricoAuditoria)
+    CAMPOS_IDENTIFICACAO = ('cte', 'transportadora', 'emissao')
+    CAMPOS = ('peso_real', 'peso_cubado', 'peso_taxado', 'frete_total', 'origem_cidade', 'origem_uf',
+              'destino_cidade', 'destino_uf') + CAMPOS_IDENTIFICACAO
+    
     @staticmethod
     def detectar(colunas: list) -> dict:
         """
@@ -236,6 +833,7 @@ class DetectorEstrutura:
         cols_usadas = set()
         
         colunas_limpas = [(i, c, limpar_texto(c)) for i, c in enumerate(colunas)]
+        posicao = {c: i for i, c, _ in reversed(colunas_limpas)}
         
         # Detecta PESOS
         for campo, palavras in [
@@ -254,7 +852,7 @@ class DetectorEstrutura:
         col_origem = DetectorEstrutura._buscar_coluna(colunas_limpas, palavras_origem, cols_usadas)
         
         if col_origem:
-            idx_origem = next(i for i, c, _ in colunas_limpas if c == col_origem)
+            idx_origem = posicao[col_origem]
             cols_usadas.add(col_origem)
             
             # Procura CIDADE depois de ORIGEM/REMETENTE
@@ -264,9 +862,8 @@ class DetectorEstrutura:
                 cols_usadas.add(col_cidade_origem)
                 
                 # Procura UF depois da CIDADE
-                col_uf_origem = DetectorEstrutura._buscar_proxima(colunas_limpas, 
-                    next(i for i, c, _ in colunas_limpas if c == col_cidade_origem),
-                    ['UF', 'ESTADO'], cols_usadas)
+                col_uf_origem = DetectorEstrutura._buscar_proxima(colunas_limpas, posicao[col_cidade_origem],
+                                                                  ['UF', 'ESTADO'], cols_usadas)
                 if col_uf_origem:
                     mapa['origem_uf'] = col_uf_origem
                     cols_usadas.add(col_uf_origem)
@@ -276,7 +873,7 @@ class DetectorEstrutura:
         col_destino = DetectorEstrutura._buscar_coluna(colunas_limpas, palavras_destino, cols_usadas)
         
         if col_destino:
-            idx_destino = next(i for i, c, _ in colunas_limpas if c == col_destino)
+            idx_destino = posicao[col_destino]
             cols_usadas.add(col_destino)
             
             # Procura CIDADE depois de DESTINO/DESTINATÁRIO
@@ -286,13 +883,23 @@ class DetectorEstrutura:
                 cols_usadas.add(col_cidade_destino)
                 
                 # Procura UF depois da CIDADE
-                col_uf_destino = DetectorEstrutura._buscar_proxima(colunas_limpas,
-                    next(i for i, c, _ in colunas_limpas if c == col_cidade_destino),
-                    ['UF', 'ESTADO'], cols_usadas)
+                col_uf_destino = DetectorEstrutura._buscar_proxima(colunas_limpas, posicao[col_cidade_destino],
+                                                                   ['UF', 'ESTADO'], cols_usadas)
                 if col_uf_destino:
                     mapa['destino_uf'] = col_uf_destino
                     cols_usadas.add(col_uf_destino)
         
+        # Identificação do CT-e (não muda a auditoria; vai para o histórico)
+        for campo, palavras in [
+            ('cte', ['NUMERO CTE', 'CTE', 'CT-E', 'CONHECIMENTO']),
+            ('transportadora', ['TRANSPORTADORA', 'TRANSPORTADOR']),
+            ('emissao', ['DATA EMISSAO', 'EMISSAO', 'DATA'])
+        ]:
+            col = DetectorEstrutura._buscar_coluna(colunas_limpas, palavras, cols_usadas)
+            if col:
+                mapa[campo] = col
+                cols_usadas.add(col)
+        
         return mapa
     
     @staticmethod
@@ -317,6 +924,177 @@ class DetectorEstrutura:
                     return col_original
         return None
 
+# ================================================================
+# LAYOUTS CONHECIDOS
+# ================================================================
+
+class RegistroLayouts:
+    """
+    Layouts de relatório já vistos, para que a busca do cabeçalho e o
+    DetectorEstrutura só rodem para layouts novos.
+    
+    Um layout é identificado pela impressão digital da linha de cabeçalho
+    (nomes das colunas mais a posição da linha no arquivo) e guarda o
+    mapeamento de colunas. O mapeamento detectado automaticamente é
+    aprendido na primeira auditoria e descartado quando VERSAO_DETECTOR
+    muda; um mapeamento fixado por um analista (comando layout) sempre vale.
+    
+    Cada alteração relê o arquivo sob uma trava (layouts.json.lock) que vale
+    também entre processos (workers, serviço, comando layout): uma auditoria
+    não desfaz um layout fixado ao mesmo tempo, e um layout já registrado
+    não regrava o arquivo.
+    """
+    
+    # Arquivo JSON do registro (None desliga o registro)
+    caminho: Optional[str] = CAMINHO_LAYOUTS
+    
+    _lock = threading.Lock()
+    _layouts: dict = {}
+    _assinatura = None
+    
+    @staticmethod
+    def impressao(idx_header: int, nomes: list) -> str:
+        texto = '\x1f'.join([str(idx_header)] + [str(n) for n in nomes])
+        return hashlib.sha1(texto.encode('utf-8')).hexdigest()[:16]
+    
+    @staticmethod
+    def reconhecer(sondagem: pd.DataFrame) -> Optional[tuple]:
+        """(idx_header, nomes, colunas_detectadas) do layout da sondagem, ou None se for novo."""
+        layouts = RegistroLayouts.carregar()
+        for idx in sorted({layout['cabecalho'] for layout in layouts.values()}):
+            if idx >= len(sondagem):
+                break
+            nomes = LeitorArquivo.nomes_colunas(sondagem.iloc[idx].values)
+            layout = layouts.get(RegistroLayouts.impressao(idx, nomes))
+            if layout and (layout['fixado'] or layout['versao'] == VERSAO_DETECTOR):
+                return idx, nomes, dict(layout['mapa'])
+        return None
+    
+    @staticmethod
+    def aprender(idx_header: int, nomes: list, colunas_detectadas: dict):
+        """Guarda o mapeamento detectado automaticamente (um layout fixado não é alterado)."""
+        if RegistroLayouts.caminho is None or not colunas_detectadas:
+            return
+        chave = RegistroLayouts.impressao(idx_header, nomes)
+        try:
+            with RegistroLayouts._travar() as layouts:
+                atual = layouts.get(chave)
+                if atual and (atual['fixado'] or (atual['versao'] == VERSAO_DETECTOR
+                                                  and atual['mapa'] == colunas_detectadas)):
+                    return
+                layouts[chave] = RegistroLayouts._entrada(idx_header, nomes, colunas_detectadas, False, None)
+                RegistroLayouts._gravar(layouts)
+        except OSError as e:
+            # O registro é só um atalho: a auditoria segue sem ele
+            log.warning("Não foi possível registrar o layout: %s", e)
+    
+    @staticmethod
+    def fixar(idx_header: int, nomes: list, colunas_detectadas: dict,
+              transportadora: Optional[str] = None) -> str:
+        """Fixa o mapeamento de um layout (corrigido por um analista). Retorna a impressão."""
+        if not colunas_detectadas:
+            raise ValueError("Nenhuma coluna mapeada")
+        desconhecidas = set(colunas_detectadas.values()) - set(nomes)
+        if desconhecidas:
+            raise ValueError(f"Coluna(s) fora do cabeçalho: {', '.join(sorted(desconhecidas))}")
+        repetidas = [col for col, n in Counter(colunas_detectadas.values()).items() if n > 1]
+        if repetidas:
+            raise ValueError(f"Coluna(s) mapeada(s) para mais de um campo: {', '.join(sorted(repetidas))}")
+        chave = RegistroLayouts.impressao(idx_header, nomes)
+        with RegistroLayouts._travar() as layouts:
+            layouts[chave] = RegistroLayouts._entrada(idx_header, nomes, colunas_detectadas, True, transportadora)
+            RegistroLayouts._gravar(layouts)
+        return chave
+    
+    @staticmethod
+    def esquecer(chave: str) -> bool:
+        with RegistroLayouts._travar() as layouts:
+            if layouts.pop(chave, None) is None:
+                return False
+            RegistroLayouts._gravar(layouts)
+        return True
+    
+    @staticmethod
+    def carregar() -> dict:
+        """Layouts do arquivo, relido só quando ele muda: {impressao: layout}."""
+        caminho = RegistroLayouts.caminho
+        try:
+            info = os.stat(caminho) if caminho else None
+        except OSError:
+            info = None
+        assinatura = (caminho, info.st_mtime_ns, info.st_size) if info else None
+        if assinatura != RegistroLayouts._assinatura:
+            layouts = {}
+            if assinatura:
+                try:
+                    with open(caminho, encoding='utf-8') as f:
+                        layouts = json.load(f)
+                except (OSError, ValueError) as e:
+                    log.warning("Registro de layouts inválido (%s), ignorando: %s", caminho, e)
+            RegistroLayouts._layouts, RegistroLayouts._assinatura = layouts, assinatura
+        return RegistroLayouts._layouts
+    
+    @staticmethod
+    @contextmanager
+    def _travar():
+        """Trava o arquivo entre threads e processos e dá os layouts relidos dele."""
+        trava = RegistroLayouts.caminho + '.lock'
+        with RegistroLayouts._lock:
+            os.makedirs(os.path.dirname(trava) or '.', exist_ok=True)
+            limite = time.monotonic() + ESPERA_TRAVA_LAYOUTS
+            while True:
+                try:
+                    os.close(os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(trava) > ESPERA_TRAVA_LAYOUTS:
+                            os.remove(trava)
+                            continue
+                    except OSError:
+                        continue  # Liberada nesse meio-tempo
+                    if time.monotonic() > limite:
+                        raise TimeoutError(f"Registro de layouts travado por outro processo ({trava})")
+                    time.sleep(0.05)
+            try:
+                # Relê o arquivo: outro processo pode tê-lo alterado sem mudar mtime/tamanho visíveis
+                RegistroLayouts._assinatura = None
+                yield dict(RegistroLayouts.carregar())
+            finally:
+                try:
+                    os.remove(trava)
+                except OSError:
+                    pass
+    
+    @staticmethod
+    def _entrada(idx_header: int, nomes: list, colunas_detectadas: dict, fixado: bool,
+                 transportadora: Optional[str]) -> dict:
+        return {
+            'cabecalho': idx_header,
+            'colunas': list(nomes),
+            'mapa': dict(colunas_detectadas),
+            'fixado': fixado,
+            'transportadora': transportadora,
+            'versao': VERSAO_DETECTOR,
+            'atualizado_em': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    @staticmethod
+    def _gravar(layouts: dict):
+        caminho = RegistroLayouts.caminho
+        try:
+            os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+            temporario = caminho + f'.{os.getpid()}.tmp'
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump(layouts, f, ensure_ascii=False, indent=1)
+            os.replace(temporario, caminho)
+        except OSError as e:
+            log.warning("Não foi possível gravar o registro de layouts: %s", e)
+            return
+        RegistroLayouts._layouts = layouts
+        info = os.stat(caminho)
+        RegistroLayouts._assinatura = (caminho, info.st_mtime_ns, info.st_size)
+
 # ================================================================
 # CALCULADORA DE PESO
 # ================================================================
@@ -352,24 +1130,133 @@ class CalculadoraPeso:
             int(np.ceil(peso_cobrado)),
             tem_erro_peso
         )
+    
+    @staticmethod
+    def processar_lote(peso_real, peso_cubado, peso_taxado) -> tuple:
+        """
+        Versão vetorizada de processar para arrays de pesos já convertidos
+        em float. Retorna arrays (peso_correto, peso_cobrado, tem_erro_peso).
+        """
+        real = np.asarray(peso_real, dtype=float)
+        cubado = np.asarray(peso_cubado, dtype=float)
+        taxado = np.asarray(peso_taxado, dtype=float)
+        
+        peso_correto = np.where((real > 0) | (cubado > 0), np.maximum(real, cubado), 1.0)
+        peso_cobrado = np.where(taxado > 0, taxado, peso_correto)
+        tem_erro_peso = np.abs(peso_cobrado - peso_correto) > 0.5
+        
+        return (
+            np.ceil(peso_correto).astype(np.int64),
+            np.ceil(peso_cobrado).astype(np.int64),
+            tem_erro_peso
+        )
 
 # ================================================================
 # AUDITOR DE FRETE
 # ================================================================
 
+class IndiceCidades:
+    """
+    Resolve cidade → coluna da LPU sem varrer as colunas a cada consulta.
+    
+    Os nomes das colunas são normalizados uma vez, a coluna de cada capital
+    é resolvida uma vez por UF e cada par (cidade, uf) consultado fica
+    memorizado, até TAMANHO_CACHE_LOCALIZACAO pares (o índice vive tanto
+    quanto a LPU carregada no serviço; os pares mais antigos saem primeiro).
+    Um dict simples, e não lru_cache, para o índice continuar serializável
+    para os workers.
+    """
+    
+    def __init__(self, colunas: list, col_redespacho: str):
+        self.colunas_limpas = [(col, limpar_texto(col)) for col in colunas]
+        self.col_redespacho = col_redespacho
+        self.col_sp = next((c for c in colunas if "SP" in c and "CAPITAL" in c), colunas[0])
+        self.coluna_capital = {
+            uf: self._buscar(capital) for uf, capital in MAPA_UF_CAPITAL.items()
+        }
+        self._cache: Dict[tuple, tuple] = {}
+    
+    @classmethod
+    def restaurar(cls, colunas_limpas: list, col_redespacho: str, col_sp: str,
+                  coluna_capital: dict) -> 'IndiceCidades':
+        """Recria o índice a partir de dados já calculados (ver CacheLPU)."""
+        indice = cls.__new__(cls)
+        indice.colunas_limpas = colunas_limpas
+        indice.col_redespacho = col_redespacho
+        indice.col_sp = col_sp
+        indice.coluna_capital = coluna_capital
+        indice._cache = {}
+        return indice
+    
+    def resolver(self, cidade, uf) -> tuple:
+        """Mesmo retorno de AuditorFrete._encontrar_coluna_destino: (coluna, eh_interior)."""
+        chave = (cidade, uf)
+        resultado = self._cache.get(chave)
+        if resultado is None:
+            resultado = self._resolver(cidade, uf)
+            if len(self._cache) >= TAMANHO_CACHE_LOCALIZACAO:
+                del self._cache[next(iter(self._cache))]
+            self._cache[chave] = resultado
+        return resultado
+    
+    def _resolver(self, cidade, uf) -> tuple:
+        # Busca direta - se encontra exatamente, é polo/capital
+        col = self._buscar(limpar_texto(cidade))
+        if col:
+            return (col, False)
+        
+        # Busca por capital - se encontra a capital, a cidade é interior
+        col = self.coluna_capital.get(uf)
+        if col:
+            return (col, True)
+        
+        # Fallback: redespacho (não soma interior novamente, já que é redespacho)
+        return (self.col_redespacho, False)
+    
+    def eh_redespacho(self, cidade, uf) -> bool:
+        """True se (cidade, uf) não tem coluna própria nem capital e cai no redespacho."""
+        return self._buscar(limpar_texto(cidade)) is None and self.coluna_capital.get(uf) is None
+    
+    def _buscar(self, texto_limpo: str) -> Optional[str]:
+        """Primeira coluna cujo nome normalizado contém o texto."""
+        return next((col for col, col_limpo in self.colunas_limpas if texto_limpo in col_limpo), None)
+
 @dataclass
 class ContextoLPU:
-    df: pd.DataFrame
-    kg_adicional: Dict[str, float]
     col_redespacho: str
+    tabela: np.ndarray             # preço por [peso 0..30, coluna]; linha 0 não é usada
+    adicional: np.ndarray          # kg adicional por coluna
+    indice_colunas: Dict[str, int]
+    indice_cidades: IndiceCidades
+    
+    def preco(self, pesos, idx_colunas) -> np.ndarray:
+        """
+        Preço da LPU para arrays de pesos e posições de coluna.
+        
+        Acima de PESO_MAXIMO_TABELA kg soma o kg adicional da coluna.
+        """
+        p_int = np.maximum(1, np.ceil(pesos)).astype(np.int64)
+        p_tab = np.minimum(p_int, PESO_MAXIMO_TABELA)
+        base = self.tabela[p_tab, idx_colunas]
+        excedente = p_int - PESO_MAXIMO_TABELA
+        return np.where(excedente > 0, base + excedente * self.adicional[idx_colunas], base)
 
 class AuditorFrete:
     """Audita valores de frete baseado na tabela LPU."""
     
     def __init__(self, ctx: ContextoLPU, colunas_detectadas: dict):
         self.ctx = ctx
-        self.colunas = list(ctx.df.columns)
+        self.colunas = list(ctx.indice_colunas)
         self.colunas_detectadas = colunas_detectadas
+        
+        # Contadores das auditorias em lote (ver MetricasAuditoria)
+        self.pares_resolvidos = set()
+        self.linhas_redespacho = 0
+        
+        # Com registrar_colunas, cada auditar_lote acrescenta em colunas_usadas
+        # as colunas da LPU usadas por linha (ver CacheAuditoria)
+        self.registrar_colunas = False
+        self.colunas_usadas = []
     
     def auditar_linha(self, row: pd.Series) -> pd.Series:
         """Audita uma linha do relatório."""
@@ -416,76 +1303,173 @@ class AuditorFrete:
             sugestao
         ])
     
-    def _calcular_valor_rota(self, orig_cid, orig_uf, dest_cid, dest_uf, peso):
-        """Calcula valor do frete baseado na rota."""
-        custo = 0.0
-        
-        # Origem
-        if orig_cid and orig_cid not in HUB_CENTRAL:
-            col, eh_interior = self._encontrar_coluna_destino(orig_cid, orig_uf)
-            if col:
-                custo += self._calcular_valor(peso, col)
-                # Se é interior, soma a taxa de interior/redespacho
-                if eh_interior:
-                    custo += self._calcular_valor(peso, self.ctx.col_redespacho)
-        
-        # Destino
-        if dest_cid and dest_cid not in HUB_CENTRAL:
-            col, eh_interior = self._encontrar_coluna_destino(dest_cid, dest_uf)
-            if col:
-                custo += self._calcular_valor(peso, col)
-                # Se é interior, soma a taxa de interior/redespacho
-                if eh_interior:
-                    custo += self._calcular_valor(peso, self.ctx.col_redespacho)
-        
-        # Se ambos são hub (SP local)
-        if custo == 0:
-            col_sp = next((c for c in self.colunas if "SP" in c and "CAPITAL" in c), self.colunas[0])
-            custo = self._calcular_valor(peso, col_sp)
-        
-        return custo
-    
-    def _encontrar_coluna_destino(self, cidade, uf):
-        """Encontra coluna da tabela LPU para determinada cidade.
+    def auditar_lote(self, df: pd.DataFrame, numeros: Optional[dict] = None) -> pd.DataFrame:
+        """Audita todas as linhas do relatório de uma vez.
         
-        Retorna: (coluna, eh_interior)
-        - coluna: nome da coluna encontrada
-        - eh_interior: True se a cidade é do interior (não é capital/polo)
+        Produz o mesmo resultado de df.apply(auditar_linha, axis=1), já com
+        as colunas nomeadas, usando operações de coluna em vez de uma chamada
+        Python por linha. `numeros` são as colunas já convertidas por
+        _carregar_relatorio; campos ausentes são convertidos aqui.
         """
-        cidade_limpa = limpar_texto(cidade)
+        numeros = numeros or {}
         
-        # Busca direta - se encontra exatamente, é polo/capital
-        for col in self.colunas:
-            if cidade_limpa in limpar_texto(col):
-                return (col, False)
+        # 1. EXTRAI PESOS
+        peso_correto, peso_cobrado, erro_peso = CalculadoraPeso.processar_lote(
+            self._coluna_float(df, 'peso_real', numeros),
+            self._coluna_float(df, 'peso_cubado', numeros),
+            self._coluna_float(df, 'peso_taxado', numeros)
+        )
         
-        # Busca por capital - se encontra a capital, a cidade é interior
-        capital = MAPA_UF_CAPITAL.get(uf)
-        if capital:
-            for col in self.colunas:
-                if capital in limpar_texto(col):
-                    return (col, True)  # Retorna que é interior
+        # 2. EXTRAI LOCALIZAÇÕES
+        localizacao = ExtratorLocalizacao.processar_lote(df, self.colunas_detectadas)
         
-        # Fallback: redespacho (não soma interior novamente, já que é redespacho)
-        return (self.ctx.col_redespacho, False)
+        # 3. CALCULA VALOR ESPERADO
+        valor_lpu = self._calcular_valor_rota_lote(
+            localizacao['origem_cidade'], localizacao['origem_uf'],
+            localizacao['destino_cidade'], localizacao['destino_uf'],
+            peso_correto
+        )
+        
+        # 4. COMPARA COM VALOR COBRADO
+        valor_cobrado = self._coluna_float(df, 'frete_total', numeros)
+        diferenca = valor_cobrado - valor_lpu
+        
+        # 5. DETERMINA STATUS
+        status, sugestao = self._analisar_divergencia_lote(
+            diferenca, valor_lpu, erro_peso, peso_correto, peso_cobrado
+        )
+        
+        # Pesos em int32; STATUS e SUGESTAO categóricos (poucos textos distintos)
+        return pd.DataFrame({
+            'PESO_CORRETO': peso_correto.astype(np.int32),
+            'PESO_COBRADO': peso_cobrado.astype(np.int32),
+            'VALOR_LPU': arredondar(valor_lpu, 2),
+            'DIFERENCA': arredondar(diferenca, 2),
+            'STATUS': status,
+            'SUGESTAO': sugestao
+        }, index=df.index)
+    
+    def _coluna_float(self, df: pd.DataFrame, campo: str, numeros: dict) -> np.ndarray:
+        """Valores numéricos da coluna detectada para o campo (0.0 se ausente)."""
+        if campo in numeros:
+            return numeros[campo][0]
+        col = self.colunas_detectadas.get(campo)
+        if col is None or col not in df.columns:
+            return np.zeros(len(df))
+        return converter_numeros(df[col])[0]
+    
+    def _calcular_valor_rota_lote(self, orig_cid, orig_uf, dest_cid, dest_uf, peso):
+        """Versão em lote de _calcular_valor_rota."""
+        custo = np.zeros(len(peso))
+        idx_redespacho = self.ctx.indice_colunas[self.ctx.col_redespacho]
+        
+        resolvidas = []
+        
+        # Origem e destino, na mesma ordem de soma da versão por linha
+        for cidades, ufs in ((orig_cid, orig_uf), (dest_cid, dest_uf)):
+            idx_col, eh_interior = self._encontrar_colunas_lote(cidades, ufs)
+            custo += self._calcular_valor_lote(peso, idx_col)
+            # Se é interior, soma a taxa de interior/redespacho
+            custo += self._calcular_valor_lote(peso, np.where(eh_interior, idx_redespacho, -1))
+            resolvidas.append((idx_col, eh_interior))
+        
+        # Se ambos são hub (SP local)
+        sem_custo = custo == 0
+        if sem_custo.any():
+            idx_sp = np.full(int(sem_custo.sum()), self.ctx.indice_colunas[self.ctx.indice_cidades.col_sp])
+            custo[sem_custo] = self._calcular_valor_lote(peso[sem_custo], idx_sp)
+        
+        if self.registrar_colunas:
+            (col_origem, interior_origem), (col_destino, interior_destino) = resolvidas
+            self.colunas_usadas.append({
+                'col_origem': col_origem,
+                'col_destino': col_destino,
+                'usa_redespacho': interior_origem | interior_destino,
+                'usa_sp': sem_custo
+            })
+        
+        return custo
+    
+    def _encontrar_colunas_lote(self, cidades, ufs) -> tuple:
+        """
+        Resolve a coluna LPU de cada par (cidade, uf), uma vez por par distinto.
+        
+        Retorna (idx_coluna, eh_interior); idx_coluna é -1 quando a linha não
+        gera custo (cidade vazia, do hub central ou sem coluna).
+        """
+        codigos, pares = fatorar_pares(cidades, ufs)
+        idx_unicos = np.full(len(pares), -1, dtype=np.int64)
+        interior_unicos = np.zeros(len(pares), dtype=bool)
+        redespacho_unicos = np.zeros(len(pares), dtype=bool)
+        
+        for i, (cidade, uf) in enumerate(pares):
+            if not cidade or cidade in HUB_CENTRAL:
+                continue
+            col, eh_interior = self._encontrar_coluna_destino(cidade, uf)
+            self.pares_resolvidos.add((cidade, uf))
+            if col:
+                idx_unicos[i] = self.ctx.indice_colunas[col]
+                interior_unicos[i] = eh_interior
+                redespacho_unicos[i] = (col == self.ctx.col_redespacho and not eh_interior
+                                        and self.ctx.indice_cidades.eh_redespacho(cidade, uf))
+        
+        if redespacho_unicos.any():
+            linhas_por_par = np.bincount(codigos, minlength=len(pares))
+            self.linhas_redespacho += int(linhas_por_par[redespacho_unicos].sum())
+        
+        return idx_unicos[codigos], interior_unicos[codigos]
+    
+    def _calcular_valor_lote(self, peso, idx_coluna):
+        """Versão em lote de _calcular_valor; idx_coluna -1 vale 0.0."""
+        valores = np.zeros(len(peso))
+        validos = idx_coluna >= 0
+        if validos.any():
+            valores[validos] = self.ctx.preco(peso[validos], idx_coluna[validos])
+        return valores
+    
+    def _calcular_valor_rota(self, orig_cid, orig_uf, dest_cid, dest_uf, peso):
+        """Calcula valor do frete baseado na rota."""
+        custo = 0.0
+        
+        # Origem
+        if orig_cid and orig_cid not in HUB_CENTRAL:
+            col, eh_interior = self._encontrar_coluna_destino(orig_cid, orig_uf)
+            if col:
+                custo += self._calcular_valor(peso, col)
+                # Se é interior, soma a taxa de interior/redespacho
+                if eh_interior:
+                    custo += self._calcular_valor(peso, self.ctx.col_redespacho)
+        
+        # Destino
+        if dest_cid and dest_cid not in HUB_CENTRAL:
+            col, eh_interior = self._encontrar_coluna_destino(dest_cid, dest_uf)
+            if col:
+                custo += self._calcular_valor(peso, col)
+                # Se é interior, soma a taxa de interior/redespacho
+                if eh_interior:
+                    custo += self._calcular_valor(peso, self.ctx.col_redespacho)
+        
+        # Se ambos são hub (SP local)
+        if custo == 0:
+            custo = self._calcular_valor(peso, self.ctx.indice_cidades.col_sp)
+        
+        return custo
+    
+    def _encontrar_coluna_destino(self, cidade, uf):
+        """Encontra coluna da tabela LPU para determinada cidade.
+        
+        Retorna: (coluna, eh_interior)
+        - coluna: nome da coluna encontrada
+        - eh_interior: True se a cidade é do interior (não é capital/polo)
+        """
+        return self.ctx.indice_cidades.resolver(cidade, uf)
     
     def _calcular_valor(self, peso, coluna):
         """Calcula valor baseado em peso e coluna da LPU."""
         if not coluna:
             return 0.0
         
-        p_int = max(1, int(np.ceil(peso)))
-        p_tab = min(p_int, 30)
-        
-        base = 0.0
-        if p_tab in self.ctx.df.index:
-            base = safe_float(self.ctx.df.loc[p_tab, coluna])
-        
-        if p_int > 30:
-            adicional = self.ctx.kg_adicional.get(coluna, 0.0)
-            return base + (p_int - 30) * adicional
-        
-        return base
+        return float(self.ctx.preco(peso, self.ctx.indice_colunas[coluna]))
     
     def _analisar_divergencia(self, diff, valor_lpu, erro_peso, peso_certo, peso_cobrado):
         """Analisa divergência e retorna status e sugestão."""
@@ -510,6 +1494,868 @@ class AuditorFrete:
             return "PESO_INCORRETO", f"Peso incorreto: {peso_cobrado}kg vs {peso_certo}kg"
         
         return "OK", "-"
+    
+    def _analisar_divergencia_lote(self, diff, valor_lpu, erro_peso, peso_certo, peso_cobrado):
+        """
+        Versão em lote de _analisar_divergencia. Retorna Categoricals
+        (status, sugestao); cada SUGESTAO distinta é formatada uma única vez.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentual = np.abs(diff / valor_lpu)
+        dentro_margem = np.abs(diff) <= MARGEM_TOLERANCIA
+        
+        # Mesma ordem de decisão da versão por linha
+        condicoes = [
+            valor_lpu == 0,
+            dentro_margem & erro_peso,
+            dentro_margem,
+            percentual > LIMITE_PERCENTUAL_CRITICO,
+            erro_peso
+        ]
+        caso = np.select(condicoes, [0, 1, 2, 3, 4], default=5)
+        status = pd.Categorical.from_codes(
+            np.array([0, 1, 2, 3, 1, 2], dtype=np.int8)[caso],
+            categories=["ERRO_CALCULO", "PESO_INCORRETO", "OK", "DIVERGENCIA_CRITICA"])
+        
+        # A SUGESTAO só depende destes campos (zerados nos casos que não os usam)
+        usa_peso = np.isin(caso, (1, 3, 4))
+        critico = caso == 3
+        codigos = np.zeros(len(diff), dtype=np.int64)
+        for componente in (caso, np.where(usa_peso, peso_cobrado, 0), np.where(usa_peso, peso_certo, 0),
+                           np.where(critico, percentual, 0.0), critico & (diff > 0), critico & erro_peso):
+            cod, unicos = pd.factorize(componente)
+            codigos, _ = pd.factorize(codigos * len(unicos) + cod)
+        
+        # Códigos por ordem de aparição: a primeira linha de cada um representa o grupo
+        _, primeiras = np.unique(codigos, return_index=True)
+        textos = [self._texto_sugestao(caso[i], diff[i], percentual[i], erro_peso[i], peso_certo[i], peso_cobrado[i])
+                  for i in primeiras]
+        cod_textos, categorias = pd.factorize(np.asarray(textos, dtype=object))
+        sugestao = pd.Categorical.from_codes(cod_textos[codigos], categories=categorias)
+        
+        return status, sugestao
+    
+    @staticmethod
+    def _texto_sugestao(caso, diff, percentual, erro_peso, peso_certo, peso_cobrado) -> str:
+        """SUGESTAO de uma linha, pelo caso de _analisar_divergencia_lote."""
+        if caso == 0:
+            return "Não foi possível calcular valor da rota"
+        if caso == 1:
+            return f"Cobrado {peso_cobrado}kg ao invés de {peso_certo}kg"
+        if caso == 3:
+            tipo = "mais" if diff > 0 else "menos"
+            msg = f"Pago a {tipo}: {percentual:.0%}"
+            if erro_peso:
+                msg += f" | Peso errado: {peso_cobrado}kg vs {peso_certo}kg"
+            return msg
+        if caso == 4:
+            return f"Peso incorreto: {peso_cobrado}kg vs {peso_certo}kg"
+        return "-"
+
+# ================================================================
+# CACHE DA LPU COMPILADA
+# ================================================================
+
+class CacheLPU:
+    """
+    Guarda em disco (.npz, sem pickle) a LPU já compilada, para que a mesma
+    tabela não seja lida e interpretada de novo a cada auditoria.
+    
+    A chave é o hash do conteúdo do arquivo + VERSAO_PARSER_LPU + engine do
+    Excel; o cache é limitado a TAMANHO_MAXIMO_CACHE_LPU, descartando as
+    entradas usadas há mais tempo.
+    """
+    
+    @staticmethod
+    def chave(caminho: str) -> str:
+        h = hashlib.sha256()
+        with open(caminho, 'rb') as f:
+            for parte in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(parte)
+        h.update(f"|v{VERSAO_PARSER_LPU}|{LeitorArquivo.engine_excel}".encode())
+        return h.hexdigest()[:40]
+    
+    @staticmethod
+    def carregar(caminho: str, pasta: str = PASTA_CACHE_LPU) -> Optional[ContextoLPU]:
+        """ContextoLPU do cache, ou None se não houver entrada válida."""
+        arquivo = os.path.join(pasta, CacheLPU.chave(caminho) + '.npz')
+        if not os.path.exists(arquivo):
+            return None
+        try:
+            with np.load(arquivo, allow_pickle=False) as dados:
+                ctx = CacheLPU._montar(dados)
+            os.utime(arquivo)  # Marca como usado recentemente (descarte por LRU)
+            return ctx
+        except Exception as e:
+            log.warning("Cache da LPU inválido (%s), recompilando: %s", os.path.basename(arquivo), e)
+            return None
+    
+    @staticmethod
+    def salvar(caminho: str, ctx: ContextoLPU, pasta: str = PASTA_CACHE_LPU):
+        """Grava o ContextoLPU compilado e aplica o limite de tamanho do cache."""
+        try:
+            os.makedirs(pasta, exist_ok=True)
+            arquivo = os.path.join(pasta, CacheLPU.chave(caminho) + '.npz')
+            indice = ctx.indice_cidades
+            ufs = list(indice.coluna_capital)
+            temporario = arquivo + f'.{os.getpid()}.tmp'
+            with open(temporario, 'wb') as f:
+                np.savez(
+                    f,
+                    colunas=np.array(list(ctx.indice_colunas), dtype=str),
+                    tabela=ctx.tabela,
+                    adicional=ctx.adicional,
+                    col_redespacho=np.array(ctx.col_redespacho, dtype=str),
+                    colunas_limpas=np.array([limpo for _, limpo in indice.colunas_limpas], dtype=str),
+                    col_sp=np.array(indice.col_sp, dtype=str),
+                    ufs_capital=np.array(ufs, dtype=str),
+                    colunas_capital=np.array([indice.coluna_capital[uf] or '' for uf in ufs], dtype=str)
+                )
+            os.replace(temporario, arquivo)
+            CacheLPU._limitar_tamanho(pasta)
+        except OSError as e:
+            log.warning("Não foi possível gravar o cache da LPU: %s", e)
+    
+    @staticmethod
+    def _montar(dados) -> ContextoLPU:
+        colunas = dados['colunas'].tolist()
+        tabela = dados['tabela']
+        adicional = dados['adicional']
+        col_red = str(dados['col_redespacho'])
+        
+        indice_cidades = IndiceCidades.restaurar(
+            list(zip(colunas, dados['colunas_limpas'].tolist())),
+            col_red,
+            str(dados['col_sp']),
+            {uf: (col or None) for uf, col in zip(dados['ufs_capital'].tolist(),
+                                                   dados['colunas_capital'].tolist())}
+        )
+        
+        indice_colunas = {c: i for i, c in enumerate(colunas)}
+        
+        return ContextoLPU(col_red, tabela, adicional, indice_colunas, indice_cidades)
+    
+    @staticmethod
+    def _limitar_tamanho(pasta: str, limite: int = TAMANHO_MAXIMO_CACHE_LPU):
+        entradas = []
+        for nome in os.listdir(pasta):
+            if nome.endswith('.npz'):
+                info = os.stat(os.path.join(pasta, nome))
+                entradas.append((info.st_mtime, info.st_size, nome))
+        
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, nome in sorted(entradas):
+            if total <= limite:
+                break
+            try:
+                os.remove(os.path.join(pasta, nome))
+                total -= tamanho
+            except OSError:
+                pass
+
+# ================================================================
+# AUDITORIA INCREMENTAL
+# ================================================================
+
+class CacheAuditoria:
+    """
+    Guarda em disco (.npz, sem pickle) o resultado por linha da última
+    auditoria de cada relatório, para que um relatório reenviado só audite
+    as linhas novas ou alteradas.
+    
+    Cada linha é identificada pela impressão digital (hash) dos campos que a
+    auditoria usa: pesos e frete já convertidos e as colunas de origem e
+    destino. Junto vão as colunas da LPU que a linha usou: com uma LPU
+    revisada, só as linhas que usam colunas com preço alterado são
+    recalculadas (todas, se os nomes das colunas mudarem, pois a resolução
+    das cidades depende deles).
+    
+    A chave é o caminho absoluto do relatório (+ aba) + VERSAO_AUDITORIA:
+    relatórios de mesmo nome em pastas diferentes (uma por transportadora)
+    não se misturam. O cache é limitado a TAMANHO_MAXIMO_CACHE_AUDITORIA,
+    descartando as entradas mais antigas.
+    """
+    
+    CAMPOS_NUMERICOS = ('peso_real', 'peso_cubado', 'peso_taxado', 'frete_total')
+    CAMPOS_LOCALIZACAO = ('origem_cidade', 'origem_uf', 'destino_cidade', 'destino_uf')
+    COLUNAS_NUMERICAS = (('PESO_CORRETO', 'peso_correto'), ('PESO_COBRADO', 'peso_cobrado'),
+                         ('VALOR_LPU', 'valor_lpu'), ('DIFERENCA', 'diferenca'))
+    COLUNAS_TEXTO = (('STATUS', 'status'), ('SUGESTAO', 'sugestao'))
+    
+    @staticmethod
+    def chave(caminho_relatorio: str, aba: Optional[str] = None) -> str:
+        caminho = os.path.normcase(os.path.abspath(caminho_relatorio))
+        return hashlib.sha256(f"{caminho}|{aba}|v{VERSAO_AUDITORIA}".encode()).hexdigest()[:40]
+    
+    @staticmethod
+    def impressoes(df: pd.DataFrame, colunas_detectadas: dict, numeros: dict) -> np.ndarray:
+        """Hash (uint64) por linha dos campos de que o resultado da auditoria depende."""
+        campos = {}
+        for campo in CacheAuditoria.CAMPOS_NUMERICOS:
+            campos[campo] = numeros[campo][0] if campo in numeros else np.zeros(len(df))
+        for campo in CacheAuditoria.CAMPOS_LOCALIZACAO:
+            col = colunas_detectadas.get(campo)
+            campos[campo] = df[col].to_numpy(dtype=object) if col in df.columns else ''
+        return pd.util.hash_pandas_object(pd.DataFrame(campos), index=False).to_numpy()
+    
+    @staticmethod
+    def carregar(chave: str, pasta: str = PASTA_CACHE_AUDITORIA) -> Optional[dict]:
+        """Arrays da auditoria anterior, ou None se não houver entrada válida."""
+        arquivo = os.path.join(pasta, chave + '.npz')
+        if not os.path.exists(arquivo):
+            return None
+        try:
+            with np.load(arquivo, allow_pickle=False) as dados:
+                anterior = {nome: dados[nome] for nome in dados.files}
+            os.utime(arquivo)
+            return anterior
+        except Exception as e:
+            log.warning("Cache da auditoria inválido (%s), auditando tudo: %s", os.path.basename(arquivo), e)
+            return None
+    
+    @staticmethod
+    def posicoes_anteriores(anterior: Optional[dict], ctx: ContextoLPU, impressoes: np.ndarray) -> np.ndarray:
+        """
+        Posição de cada linha na auditoria anterior, ou -1 se a linha é nova,
+        mudou ou usa uma coluna da LPU cujo preço mudou.
+        """
+        if anterior is None or anterior['colunas'].tolist() != list(ctx.indice_colunas):
+            return np.full(len(impressoes), -1, dtype=np.int64)
+        
+        posicoes = pd.Index(anterior['impressoes']).get_indexer(impressoes)
+        
+        alteradas = (anterior['tabela'] != ctx.tabela).any(axis=0) | (anterior['adicional'] != ctx.adicional)
+        if alteradas.any():
+            achadas = np.flatnonzero(posicoes >= 0)
+            p = posicoes[achadas]
+            afetadas = (anterior['usa_redespacho'][p] & alteradas[ctx.indice_colunas[ctx.col_redespacho]]
+                        | anterior['usa_sp'][p] & alteradas[ctx.indice_colunas[ctx.indice_cidades.col_sp]])
+            for nome in ('col_origem', 'col_destino'):
+                idx = anterior[nome][p]
+                afetadas |= (idx >= 0) & alteradas[np.maximum(idx, 0)]
+            posicoes[achadas[afetadas]] = -1
+        
+        return posicoes
+    
+    @staticmethod
+    def combinar(indice: pd.Index, anterior: Optional[dict], posicoes: np.ndarray,
+                 novo: Optional[pd.DataFrame], colunas_novas: list) -> tuple:
+        """
+        Junta, na ordem do relatório, o resultado reaproveitado (posicoes >= 0)
+        e o recalculado (`novo`, nas demais linhas). Retorna (resultado,
+        colunas_usadas por linha).
+        """
+        n = len(posicoes)
+        reusar = np.flatnonzero(posicoes >= 0)
+        p = posicoes[reusar]
+        recalcular = np.flatnonzero(posicoes < 0)
+        
+        saida = {}
+        for coluna, nome in CacheAuditoria.COLUNAS_NUMERICAS:
+            # Mesmos tipos de AuditorFrete.auditar_lote
+            valores = np.zeros(n, dtype=np.int32 if coluna.startswith('PESO') else float)
+            if len(reusar):
+                valores[reusar] = anterior[nome][p]
+            if len(recalcular):
+                valores[recalcular] = novo[coluna].to_numpy()
+            saida[coluna] = valores
+        for coluna, nome in CacheAuditoria.COLUNAS_TEXTO:
+            # Categórico: códigos dos textos guardados e dos recalculados numa só lista de categorias
+            guardados = anterior[nome + '_textos'].astype(object) if len(reusar) else np.array([], dtype=object)
+            recalculados = pd.Categorical(novo[coluna]) if len(recalcular) else pd.Categorical([])
+            categorias = pd.Index(guardados).append(recalculados.categories.astype(object)).unique()
+            codigos = np.full(n, -1, dtype=np.int64)
+            if len(reusar):
+                codigos[reusar] = categorias.get_indexer(guardados)[anterior[nome][p]]
+            if len(recalcular):
+                codigos[recalcular] = categorias.get_indexer(recalculados.categories)[recalculados.codes]
+            saida[coluna] = pd.Categorical.from_codes(codigos, categories=categorias)
+        
+        usadas = {}
+        for nome, vazio in (('col_origem', -1), ('col_destino', -1), ('usa_redespacho', False), ('usa_sp', False)):
+            valores = np.full(n, vazio, dtype=np.int64 if nome.startswith('col') else bool)
+            if len(reusar):
+                valores[reusar] = anterior[nome][p]
+            if len(recalcular):
+                valores[recalcular] = np.concatenate([c[nome] for c in colunas_novas])
+            usadas[nome] = valores
+        
+        return pd.DataFrame(saida, index=indice), usadas
+    
+    @staticmethod
+    def salvar(chave: str, ctx: ContextoLPU, impressoes: np.ndarray, resultado: pd.DataFrame,
+               colunas_usadas: dict, pasta: str = PASTA_CACHE_AUDITORIA):
+        """Grava o resultado por linha (uma entrada por impressão digital)."""
+        try:
+            os.makedirs(pasta, exist_ok=True)
+            arquivo = os.path.join(pasta, chave + '.npz')
+            _, primeiras = np.unique(impressoes, return_index=True)
+            
+            arrays = {
+                'impressoes': impressoes[primeiras],
+                'colunas': np.array(list(ctx.indice_colunas), dtype=str),
+                'tabela': ctx.tabela,
+                'adicional': ctx.adicional
+            }
+            for coluna, nome in CacheAuditoria.COLUNAS_NUMERICAS:
+                arrays[nome] = resultado[coluna].to_numpy(dtype=float)[primeiras]
+            for coluna, nome in CacheAuditoria.COLUNAS_TEXTO:
+                codigos, textos = pd.factorize(resultado[coluna])
+                arrays[nome] = codigos.astype(np.int32)[primeiras]
+                arrays[nome + '_textos'] = np.array(list(textos), dtype=str)
+            for nome, valores in colunas_usadas.items():
+                arrays[nome] = valores[primeiras]
+            
+            temporario = arquivo + f'.{os.getpid()}.tmp'
+            with open(temporario, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temporario, arquivo)
+            CacheLPU._limitar_tamanho(pasta, TAMANHO_MAXIMO_CACHE_AUDITORIA)
+        except OSError as e:
+            log.warning("Não foi possível gravar o cache da auditoria: %s", e)
+
+# ================================================================
+# HISTÓRICO DE RESULTADOS
+# ================================================================
+
+class HistoricoAuditoria:
+    """
+    Resultados por CT-e de todas as auditorias num banco SQLite local, com
+    índices por CT-e, transportadora, rota, data e STATUS e um resumo mensal
+    pré-agregado (resumo_mensal) atualizado a cada auditoria registrada.
+    
+    Reauditar um relatório com o mesmo conteúdo (mesmo que com outra LPU ou
+    outro nome de arquivo) substitui as linhas da auditoria anterior dele,
+    para o mesmo CT-e não ser somado duas vezes; um relatório novo com o nome
+    de um antigo (ex.: o relatorio.xlsx de cada semana) não substitui nada.
+    Guarda só o caminho do banco (pode ir para os workers); cada operação
+    abre a sua conexão.
+    """
+    
+    DIMENSOES_RESUMO = ('mes', 'transportadora', 'origem_uf', 'destino_uf', 'status')
+    DIMENSOES = DIMENSOES_RESUMO + ('data', 'cte', 'origem_cidade', 'destino_cidade')
+    # Campos que vêm do relatório (não da LPU): a assinatura de uma auditoria
+    CAMPOS_RELATORIO = ('cte', 'transportadora', 'data', 'mes', 'origem_cidade', 'origem_uf',
+                        'destino_cidade', 'destino_uf', 'peso_correto', 'valor_pago')
+    COLUNAS_MOEDA = ['total_pago', 'total_lpu', 'diferenca', 'sobrecobranca']
+    
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS auditorias (
+            id INTEGER PRIMARY KEY,
+            relatorio TEXT NOT NULL,
+            assinatura TEXT NOT NULL UNIQUE,  -- hash dos CAMPOS_RELATORIO das linhas
+            lpu TEXT NOT NULL,
+            auditado_em TEXT NOT NULL,
+            linhas INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS resultados (
+            auditoria_id INTEGER NOT NULL REFERENCES auditorias(id),
+            cte TEXT NOT NULL,
+            transportadora TEXT NOT NULL,
+            data TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            origem_cidade TEXT NOT NULL,
+            origem_uf TEXT NOT NULL,
+            destino_cidade TEXT NOT NULL,
+            destino_uf TEXT NOT NULL,
+            peso_correto REAL NOT NULL,
+            valor_pago REAL NOT NULL,
+            valor_lpu REAL NOT NULL,
+            diferenca REAL NOT NULL,
+            status TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_resultados_auditoria ON resultados (auditoria_id);
+        CREATE INDEX IF NOT EXISTS ix_resultados_cte ON resultados (cte);
+        CREATE INDEX IF NOT EXISTS ix_resultados_transportadora ON resultados (transportadora, data);
+        CREATE INDEX IF NOT EXISTS ix_resultados_rota ON resultados (origem_uf, destino_uf, destino_cidade);
+        CREATE INDEX IF NOT EXISTS ix_resultados_data ON resultados (data);
+        CREATE INDEX IF NOT EXISTS ix_resultados_status ON resultados (status, data);
+        CREATE TABLE IF NOT EXISTS resumo_mensal (
+            mes TEXT NOT NULL,
+            transportadora TEXT NOT NULL,
+            origem_uf TEXT NOT NULL,
+            destino_uf TEXT NOT NULL,
+            status TEXT NOT NULL,
+            linhas INTEGER NOT NULL,
+            total_pago REAL NOT NULL,
+            total_lpu REAL NOT NULL,
+            diferenca REAL NOT NULL,
+            sobrecobranca REAL NOT NULL,
+            PRIMARY KEY (mes, transportadora, origem_uf, destino_uf, status)
+        ) WITHOUT ROWID;
+    """
+    
+    def __init__(self, caminho: str = CAMINHO_HISTORICO, transportadora: Optional[str] = None, lpu: str = ''):
+        self.caminho = caminho
+        self.transportadora = transportadora  # Usada quando o relatório não tem coluna de transportadora
+        self.lpu = lpu
+    
+    @contextmanager
+    def _conexao(self):
+        """Conexão numa transação (commit ao sair sem erro)."""
+        import sqlite3
+        pasta = os.path.dirname(self.caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        # timeout: workers paralelos esperam a vez de gravar em vez de falhar
+        con = sqlite3.connect(self.caminho, timeout=60)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA cache_size=-262144")  # 256 MB: índices de cargas grandes cabem na memória
+            con.executescript(self.ESQUEMA)
+            with con:
+                self._migrar(con)
+                yield con
+        finally:
+            con.close()
+    
+    def registrar(self, caminho_relatorio: str, df: pd.DataFrame, colunas_detectadas: dict,
+                  numeros: dict, aba: Optional[str] = None) -> int:
+        """
+        Grava as linhas auditadas (df com as colunas do AuditorFrete) e
+        atualiza o resumo mensal. Retorna o id da auditoria.
+        """
+        n = len(df)
+        rotas = ExtratorLocalizacao.processar_lote(df, colunas_detectadas)
+        datas = self._datas(df, colunas_detectadas.get('emissao'))
+        transportadoras = self._textos(df, colunas_detectadas.get('transportadora'),
+                                       limpar_texto(self.transportadora or ''))
+        valor_pago = numeros['frete_total'][0] if 'frete_total' in numeros else np.zeros(n)
+        campos = pd.DataFrame(dict(zip(self.CAMPOS_RELATORIO, (
+            self._textos(df, colunas_detectadas.get('cte')), transportadoras,
+            datas, [d[:7] for d in datas],
+            rotas['origem_cidade'], rotas['origem_uf'], rotas['destino_cidade'], rotas['destino_uf'],
+            df['PESO_CORRETO'].to_numpy(dtype=float), valor_pago
+        ))))
+        assinatura = self._assinatura(campos)
+        linhas = zip(
+            *(campos[c].tolist() for c in self.CAMPOS_RELATORIO),
+            df['VALOR_LPU'].to_numpy(dtype=float).tolist(), df['DIFERENCA'].to_numpy(dtype=float).tolist(),
+            df['STATUS'].astype(str).tolist()
+        )
+        
+        with self._conexao() as con:
+            # Gravação exclusiva desde a consulta: dois workers com o mesmo relatório não se cruzam
+            con.execute("BEGIN IMMEDIATE")
+            anterior = con.execute("SELECT id FROM auditorias WHERE assinatura = ?", (assinatura,)).fetchone()
+            if anterior:
+                self._atualizar_resumo(con, anterior[0], -1)
+                con.execute("DELETE FROM resultados WHERE auditoria_id = ?", anterior)
+                con.execute("DELETE FROM auditorias WHERE id = ?", anterior)
+            
+            auditoria_id = con.execute(
+                "INSERT INTO auditorias (relatorio, assinatura, lpu, auditado_em, linhas) VALUES (?, ?, ?, ?, ?)",
+                (nome_relatorio(caminho_relatorio, aba), assinatura, self.lpu,
+                 time.strftime('%Y-%m-%d %H:%M:%S'), n)).lastrowid
+            con.executemany(f"INSERT INTO resultados VALUES ({auditoria_id}, {', '.join('?' * 13)})", linhas)
+            self._atualizar_resumo(con, auditoria_id, 1)
+            con.execute("DELETE FROM resumo_mensal WHERE linhas = 0")
+        return auditoria_id
+    
+    @staticmethod
+    def _assinatura(campos: pd.DataFrame) -> str:
+        """Hash das linhas de uma auditoria (CAMPOS_RELATORIO, na ordem do relatório)."""
+        hashes = pd.util.hash_pandas_object(campos[list(HistoricoAuditoria.CAMPOS_RELATORIO)], index=False)
+        return hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()[:40]
+    
+    @staticmethod
+    def _migrar(con):
+        """
+        Bancos antigos identificavam a auditoria pelo nome do relatório (UNIQUE)
+        e pelo intervalo de rowid das linhas: recria a tabela de auditorias com
+        a assinatura de cada uma, calculada das linhas já gravadas.
+        """
+        def migrado():
+            return 'assinatura' in [linha[1] for linha in con.execute("PRAGMA table_info(auditorias)")]
+        
+        if migrado():
+            return
+        con.execute("BEGIN IMMEDIATE")
+        if migrado():  # Outro processo migrou enquanto este esperava
+            con.commit()
+            return
+        con.execute("""
+            CREATE TABLE auditorias_nova (
+                id INTEGER PRIMARY KEY,
+                relatorio TEXT NOT NULL,
+                assinatura TEXT NOT NULL UNIQUE,
+                lpu TEXT NOT NULL,
+                auditado_em TEXT NOT NULL,
+                linhas INTEGER NOT NULL
+            )""")
+        for auditoria_id, relatorio, lpu, auditado_em, linhas in con.execute(
+                "SELECT id, relatorio, lpu, auditado_em, linhas FROM auditorias").fetchall():
+            campos = pd.read_sql_query(
+                f"SELECT {', '.join(HistoricoAuditoria.CAMPOS_RELATORIO)} FROM resultados "
+                "WHERE auditoria_id = ? ORDER BY rowid", con, params=[auditoria_id])
+            con.execute("INSERT INTO auditorias_nova VALUES (?, ?, ?, ?, ?, ?)",
+                        (auditoria_id, relatorio, HistoricoAuditoria._assinatura(campos), lpu, auditado_em, linhas))
+        con.execute("DROP TABLE auditorias")
+        con.execute("ALTER TABLE auditorias_nova RENAME TO auditorias")
+        con.commit()
+    
+    @staticmethod
+    def _atualizar_resumo(con, auditoria_id: int, sinal: int):
+        """Soma (sinal=1) ou subtrai (sinal=-1) as linhas de uma auditoria do resumo mensal."""
+        con.execute(f"""
+            INSERT INTO resumo_mensal
+            SELECT mes, transportadora, origem_uf, destino_uf, status,
+                   {sinal} * COUNT(*), {sinal} * SUM(valor_pago), {sinal} * SUM(valor_lpu),
+                   {sinal} * SUM(diferenca), {sinal} * SUM(MAX(diferenca, 0))
+            FROM resultados WHERE auditoria_id = ?
+            GROUP BY mes, transportadora, origem_uf, destino_uf, status
+            ON CONFLICT DO UPDATE SET
+                linhas = linhas + excluded.linhas,
+                total_pago = total_pago + excluded.total_pago,
+                total_lpu = total_lpu + excluded.total_lpu,
+                diferenca = diferenca + excluded.diferenca,
+                sobrecobranca = sobrecobranca + excluded.sobrecobranca
+        """, (auditoria_id,))
+    
+    @staticmethod
+    def _textos(df: pd.DataFrame, col: Optional[str], padrao: str = '') -> list:
+        """Coluna como texto normalizado ('' nas vazias); números inteiros sem o '.0' do Excel."""
+        if col is None or col not in df.columns:
+            return [padrao] * len(df)
+        serie = df[col]
+        if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+            serie = serie.astype('Int64')
+        textos = serie.astype(str).str.upper().str.strip()
+        return textos.where(serie.notna(), padrao).tolist()
+    
+    @staticmethod
+    def _datas(df: pd.DataFrame, col: Optional[str]) -> list:
+        """Data de emissão como 'AAAA-MM-DD' ('' quando ausente ou inválida)."""
+        if col is None or col not in df.columns:
+            return [''] * len(df)
+        datas = df[col]
+        if not pd.api.types.is_datetime64_any_dtype(datas):
+            datas = pd.to_datetime(datas, dayfirst=True, errors='coerce')
+        return datas.dt.strftime('%Y-%m-%d').fillna('').tolist()
+    
+    def consultar(self, agrupar_por: tuple = ('mes',), inicio: Optional[str] = None,
+                  fim: Optional[str] = None, **filtros) -> pd.DataFrame:
+        """
+        Linhas, total pago, total LPU, diferença e sobrecobrança (soma das
+        diferenças positivas) agrupados pelas dimensões pedidas. inicio/fim
+        são 'AAAA-MM' ou 'AAAA-MM-DD' (inclusivos) e filtros são igualdades
+        por dimensão (ex.: status='DIVERGENCIA_CRITICA'). Usa o resumo mensal
+        sempre que as dimensões e o período permitem.
+        """
+        agrupar_por = list(agrupar_por)
+        invalidas = [d for d in agrupar_por + list(filtros) if d not in self.DIMENSOES]
+        if invalidas:
+            raise ValueError(f"Dimensões inválidas: {', '.join(invalidas)} (use {', '.join(self.DIMENSOES)})")
+        
+        por_mes = all(p is None or len(p) == 7 for p in (inicio, fim))
+        if por_mes and set(agrupar_por) | set(filtros) <= set(self.DIMENSOES_RESUMO):
+            tabela, campo_periodo = 'resumo_mensal', 'mes'
+            medidas = ("SUM(linhas) AS linhas, SUM(total_pago) AS total_pago, SUM(total_lpu) AS total_lpu, "
+                       "SUM(diferenca) AS diferenca, SUM(sobrecobranca) AS sobrecobranca")
+        else:
+            tabela, campo_periodo = 'resultados', 'mes' if por_mes else 'data'
+            medidas = ("COUNT(*) AS linhas, SUM(valor_pago) AS total_pago, SUM(valor_lpu) AS total_lpu, "
+                       "SUM(diferenca) AS diferenca, SUM(MAX(diferenca, 0)) AS sobrecobranca")
+        
+        condicoes, parametros = [], []
+        for dimensao, valor in filtros.items():
+            condicoes.append(f"{dimensao} = ?")
+            parametros.append(str(valor) if dimensao in ('mes', 'data') else limpar_texto(valor))
+        if inicio:
+            condicoes.append(f"{campo_periodo} >= ?")
+            parametros.append(inicio if campo_periodo == 'mes' or len(inicio) > 7 else inicio + '-01')
+        if fim:
+            condicoes.append(f"{campo_periodo} <= ?")
+            parametros.append(fim if campo_periodo == 'mes' or len(fim) > 7 else fim + '-31')
+        
+        grupos = ', '.join(agrupar_por)
+        sql = (f"SELECT {grupos + ', ' if grupos else ''}{medidas} FROM {tabela}"
+               + (f" WHERE {' AND '.join(condicoes)}" if condicoes else '')
+               + (f" GROUP BY {grupos} ORDER BY {grupos}" if grupos else ''))
+        with self._conexao() as con:
+            resultado = pd.read_sql_query(sql, con, params=parametros)
+        resultado[self.COLUNAS_MOEDA] = resultado[self.COLUNAS_MOEDA].round(2)
+        resultado.attrs['colunas_moeda'] = self.COLUNAS_MOEDA
+        return resultado
+    
+    def buscar_cte(self, numero) -> pd.DataFrame:
+        """Todas as auditorias de um CT-e (pelo índice de CT-e)."""
+        with self._conexao() as con:
+            return pd.read_sql_query(
+                "SELECT a.relatorio, a.lpu, a.auditado_em, r.* FROM resultados r "
+                "JOIN auditorias a ON a.id = r.auditoria_id WHERE r.cte = ? ORDER BY a.auditado_em",
+                con, params=[HistoricoAuditoria._textos(pd.DataFrame({'c': [numero]}), 'c')[0]])
+
+# ================================================================
+# RESUMO GERENCIAL
+# ================================================================
+
+class ResumoGerencial:
+    """
+    Totais da auditoria por UF de destino, coluna da LPU, STATUS e faixa de
+    peso, mais os CT-es mais cobrados acima da LPU.
+    
+    Cada trecho auditado (o relatório inteiro ou um bloco) entra com
+    acumular: um único groupby pelas quatro dimensões juntas, somado ao que
+    já foi acumulado; os totais de cada dimensão saem desse agrupamento.
+    Os piores CT-es ficam num heap limitado a top_n. Resumos de relatórios
+    diferentes se juntam com mesclar.
+    """
+    
+    DIMENSOES = [
+        ('UF_DESTINO', 'Por UF destino'),
+        ('COLUNA_LPU', 'Por coluna LPU'),
+        ('STATUS', 'Por STATUS'),
+        ('FAIXA_PESO', 'Por faixa de peso')
+    ]
+    METRICAS = ['LINHAS', 'TOTAL_PAGO', 'TOTAL_LPU', 'DIFERENCA', 'SOBRECOBRANCA']
+    SEM_COLUNA = 'SEM COLUNA'  # Nem origem nem destino com coluna na LPU
+    
+    def __init__(self, top_n: int = TOP_N_DIVERGENCIAS):
+        self.top_n = top_n
+        self.grupos: Optional[pd.DataFrame] = None
+        self._piores = []  # heap de (diferenca, -sequencia, registro)
+        self._sequencia = 0
+    
+    @staticmethod
+    def faixas() -> list:
+        """Rótulos das faixas de FAIXAS_PESO (pesos inteiros, limites inclusivos)."""
+        rotulos = [f"até {FAIXAS_PESO[0]} kg"]
+        rotulos += [f"{a + 1}-{b} kg" for a, b in zip(FAIXAS_PESO, FAIXAS_PESO[1:])]
+        return rotulos + [f"acima de {FAIXAS_PESO[-1]} kg"]
+    
+    def acumular(self, ctx: ContextoLPU, relatorio: str, df: pd.DataFrame, colunas_detectadas: dict,
+                 numeros: dict, colunas_usadas: list, primeira_linha: int = 1, aba: Optional[str] = None):
+        """
+        Soma um trecho auditado: df com as colunas do AuditorFrete e
+        colunas_usadas registradas pelo auditor (registrar_colunas) para as
+        mesmas linhas. primeira_linha numera as linhas do trecho no relatório
+        (ou na aba).
+        """
+        n = len(df)
+        if n == 0:
+            return
+        rotas = ExtratorLocalizacao.processar_lote(df, colunas_detectadas)
+        pago = numeros['frete_total'][0] if 'frete_total' in numeros else np.zeros(n)
+        lpu = df['VALOR_LPU'].to_numpy(dtype=float)
+        diferenca = df['DIFERENCA'].to_numpy(dtype=float)
+        peso = df['PESO_CORRETO'].to_numpy()
+        sobrecobranca = np.where(diferenca > 0, diferenca, 0.0)  # Também tira os NaN do top_n
+        
+        # Coluna da LPU que precificou a linha: a do destino; se o destino é
+        # hub, a da origem; a de SP entre hubs. -1 (nem origem nem destino
+        # resolvidos) cai na última categoria
+        nomes_lpu = list(ctx.indice_colunas) + [ResumoGerencial.SEM_COLUNA]
+        col_origem = np.concatenate([c['col_origem'] for c in colunas_usadas])
+        col_destino = np.concatenate([c['col_destino'] for c in colunas_usadas])
+        usa_sp = np.concatenate([c['usa_sp'] for c in colunas_usadas])
+        col_preco = np.where(col_destino >= 0, col_destino, col_origem)
+        col_preco = np.where(usa_sp, ctx.indice_colunas[ctx.indice_cidades.col_sp], col_preco)
+        coluna = pd.Categorical.from_codes(np.where(col_preco < 0, len(nomes_lpu) - 1, col_preco),
+                                           categories=nomes_lpu)
+        faixa = pd.Categorical.from_codes(np.searchsorted(FAIXAS_PESO, peso, side='left'),
+                                          categories=ResumoGerencial.faixas())
+        
+        quadro = pd.DataFrame({
+            'UF_DESTINO': rotas['destino_uf'],
+            'COLUNA_LPU': coluna,
+            'STATUS': pd.Categorical(df['STATUS']),
+            'FAIXA_PESO': faixa,
+            'LINHAS': np.ones(n, dtype=np.int64),
+            'TOTAL_PAGO': pago,
+            'TOTAL_LPU': lpu,
+            'DIFERENCA': diferenca,
+            'SOBRECOBRANCA': sobrecobranca
+        })
+        dimensoes = [d for d, _ in ResumoGerencial.DIMENSOES]
+        grupos = quadro.groupby(dimensoes, observed=True, sort=False)[ResumoGerencial.METRICAS].sum().reset_index()
+        grupos[dimensoes] = grupos[dimensoes].astype(str)
+        self._somar_grupos(grupos)
+        
+        # Candidatos ao top_n do trecho (com os empates no limite), em ordem de
+        # linha; o heap decide contra os já acumulados
+        limite = np.partition(sobrecobranca, n - self.top_n)[n - self.top_n] if self.top_n < n else 0.0
+        candidatos = np.flatnonzero((sobrecobranca >= limite) & (sobrecobranca > 0))
+        if not len(candidatos):
+            return
+        ctes = HistoricoAuditoria._textos(df.iloc[candidatos], colunas_detectadas.get('cte'))
+        status = df['STATUS'].astype(str).to_numpy()
+        arquivo = nome_relatorio(relatorio, aba)
+        for cte, i in zip(ctes, candidatos):
+            self._inserir(float(diferenca[i]), {
+                'ARQUIVO': arquivo,
+                'LINHA': primeira_linha + int(i),
+                'CTE': cte,
+                'ORIGEM': f"{rotas['origem_cidade'][i]}/{rotas['origem_uf'][i]}",
+                'DESTINO': f"{rotas['destino_cidade'][i]}/{rotas['destino_uf'][i]}",
+                'COLUNA_LPU': coluna[i],
+                'PESO_CORRETO': int(peso[i]),
+                'VALOR_PAGO': float(pago[i]),
+                'VALOR_LPU': float(lpu[i]),
+                'DIFERENCA': float(diferenca[i]),
+                'STATUS': status[i]
+            })
+    
+    def mesclar(self, outro: 'ResumoGerencial'):
+        """Soma outro resumo (de outro relatório) a este."""
+        if outro.grupos is not None:
+            self._somar_grupos(outro.grupos)
+        for diferenca, _, registro in sorted(outro._piores, reverse=True):
+            self._inserir(diferenca, registro)
+    
+    def tabelas(self) -> dict:
+        """{nome da aba: DataFrame}: uma tabela por dimensão e a dos piores CT-es."""
+        moeda = ['TOTAL_PAGO', 'TOTAL_LPU', 'DIFERENCA', 'SOBRECOBRANCA']
+        tabelas = {}
+        for dimensao, titulo in ResumoGerencial.DIMENSOES:
+            if self.grupos is None:
+                tabela = pd.DataFrame(columns=[dimensao] + ResumoGerencial.METRICAS)
+            else:
+                tabela = self.grupos.groupby(dimensao, sort=False)[ResumoGerencial.METRICAS].sum().reset_index()
+            if dimensao == 'FAIXA_PESO':
+                ordem = {rotulo: i for i, rotulo in enumerate(ResumoGerencial.faixas())}
+                tabela = tabela.sort_values(dimensao, key=lambda s: s.map(ordem))
+            else:
+                tabela = tabela.sort_values('SOBRECOBRANCA', ascending=False, kind='stable')
+            tabela = tabela.reset_index(drop=True)
+            tabela.attrs['colunas_moeda'] = moeda
+            tabelas[titulo] = tabela
+        
+        piores = pd.DataFrame([registro for _, _, registro in sorted(self._piores, reverse=True)])
+        piores.attrs['colunas_moeda'] = ['VALOR_PAGO', 'VALOR_LPU', 'DIFERENCA']
+        tabelas['Maiores divergências'] = piores
+        return tabelas
+    
+    def _somar_grupos(self, grupos: pd.DataFrame):
+        if self.grupos is None:
+            self.grupos = grupos
+            return
+        dimensoes = [d for d, _ in ResumoGerencial.DIMENSOES]
+        self.grupos = (pd.concat([self.grupos, grupos], ignore_index=True)
+                       .groupby(dimensoes, sort=False)[ResumoGerencial.METRICAS].sum().reset_index())
+    
+    def _inserir(self, diferenca: float, registro: dict):
+        # Em empate, fica a linha que chegou primeiro
+        item = (diferenca, -self._sequencia, registro)
+        self._sequencia += 1
+        if len(self._piores) < self.top_n:
+            heapq.heappush(self._piores, item)
+        elif item[:2] > self._piores[0][:2]:
+            heapq.heapreplace(self._piores, item)
+
+# ================================================================
+# MÉTRICAS E PERFIL
+# ================================================================
+
+class AuditoriaCancelada(Exception):
+    """Auditoria interrompida a pedido do usuário (ver MetricasAuditoria.cancelamento)."""
+
+class MetricasAuditoria:
+    """
+    Tempo e volume de cada etapa de uma auditoria, mais contadores (linhas
+    auditadas, cidades distintas, linhas que caíram no redespacho, valores
+    que não puderam ser convertidos).
+    
+    Cada evento é repassado aos ganchos: funções que recebem um dict, com
+    tipo 'inicio' / 'etapa' (início e fim de cada etapa), 'progresso'
+    (linhas feitas / total) ou 'resumo' (ao fim da auditoria).
+    Ganchos em ganchos_padrao valem para todas as auditorias do processo.
+    
+    Se `cancelamento` (threading.Event) for sinalizado, a auditoria para com
+    AuditoriaCancelada no próximo início de etapa ou de parte.
+    """
+    
+    ganchos_padrao: list = []
+    
+    def __init__(self, ganchos=None, cancelamento: Optional[threading.Event] = None):
+        self.ganchos = list(MetricasAuditoria.ganchos_padrao) + list(ganchos or [])
+        self.cancelamento = cancelamento
+        self.etapas: Dict[str, dict] = {}
+        self.contadores: Dict[str, int] = {}
+        self.inicio = time.perf_counter()
+    
+    def verificar_cancelamento(self):
+        if self.cancelamento is not None and self.cancelamento.is_set():
+            raise AuditoriaCancelada("Auditoria cancelada")
+    
+    @contextmanager
+    def etapa(self, nome: str):
+        """
+        Mede o bloco `with`. O dict devolvido recebe o volume da etapa
+        (ex.: volume['linhas'] = len(df)); etapas repetidas (modo em
+        blocos) acumulam tempo e volume.
+        """
+        self.verificar_cancelamento()
+        self._emitir({'tipo': 'inicio', 'etapa': nome})
+        volume = {}
+        inicio = time.perf_counter()
+        yield volume
+        segundos = time.perf_counter() - inicio
+        
+        acumulado = self.etapas.setdefault(nome, {'segundos': 0.0})
+        acumulado['segundos'] += segundos
+        for chave, valor in volume.items():
+            acumulado[chave] = acumulado.get(chave, 0) + valor
+        self._emitir({'tipo': 'etapa', 'etapa': nome, 'segundos': segundos, **volume})
+    
+    def progresso(self, etapa: str, feitas: int, total: int):
+        """Informa o andamento de uma etapa feita em partes e checa o cancelamento."""
+        self._emitir({'tipo': 'progresso', 'etapa': etapa, 'feitas': feitas, 'total': total})
+        self.verificar_cancelamento()
+    
+    def registrar_auditoria(self, auditor: 'AuditorFrete', numeros: dict, linhas: int):
+        """Contadores de uma chamada a auditar_lote."""
+        self.contadores['linhas_auditadas'] = self.contadores.get('linhas_auditadas', 0) + linhas
+        self.contadores['cidades_distintas'] = len(auditor.pares_resolvidos)
+        self.contadores['linhas_redespacho'] = auditor.linhas_redespacho
+        for campo, (_, falhas) in numeros.items():
+            chave = f'invalidos_{campo}'
+            self.contadores[chave] = self.contadores.get(chave, 0) + int(falhas.sum())
+    
+    def resumo(self) -> dict:
+        return {
+            'segundos_total': time.perf_counter() - self.inicio,
+            'etapas': self.etapas,
+            'contadores': self.contadores
+        }
+    
+    def finalizar(self):
+        self._emitir({'tipo': 'resumo', **self.resumo()})
+    
+    def _emitir(self, evento: dict):
+        for gancho in self.ganchos:
+            try:
+                gancho(evento)
+            except Exception as e:
+                # Gancho com defeito não pode derrubar a auditoria
+                log.warning("Gancho de métricas %r falhou: %s", gancho, e)
+    
+    @staticmethod
+    @contextmanager
+    def perfil(pasta: Optional[str], caminho_relatorio: str, metricas: 'MetricasAuditoria'):
+        """
+        Com `pasta` informada, roda o bloco sob cProfile e grava nela
+        <relatorio>_<data>.prof (abre com pstats/snakeviz) e
+        <relatorio>_<data>.json com o resumo das métricas.
+        """
+        if not pasta:
+            yield
+            return
+        
+        os.makedirs(pasta, exist_ok=True)
+        base = os.path.join(pasta, "{}_{}".format(
+            os.path.splitext(nome_relatorio(caminho_relatorio))[0], time.strftime('%Y%m%d_%H%M%S')))
+        perfil = cProfile.Profile()
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+            perfil.dump_stats(base + '.prof')
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(metricas.resumo(), f, indent=2, ensure_ascii=False)
+            log.info("Perfil gravado em %s.prof / .json", base)
 
 # ================================================================
 # PROCESSADOR PRINCIPAL
@@ -518,42 +2364,397 @@ class AuditorFrete:
 class ProcessadorAuditoria:
     """Coordena todo o processo de auditoria."""
     
+    # Processos da auditoria das abas de uma planilha (None = um por CPU)
+    processos_abas: Optional[int] = None
+    
     @staticmethod
-    def processar(caminho_lpu: str, caminho_relatorio: str):
-        """Executa auditoria completa."""
-        # 1. CARREGA LPU
-        ctx_lpu = ProcessadorAuditoria._carregar_lpu(caminho_lpu)
+    def processar(caminho_lpu: str, caminho_relatorio: str, colunas_extras: Optional[list] = None,
+                  ganchos: Optional[list] = None, pasta_perfil: Optional[str] = None,
+                  cancelamento: Optional[threading.Event] = None, incremental: bool = False):
+        """
+        Executa auditoria completa.
+        
+        colunas_extras: colunas do relatório (além das detectadas) que devem
+        ser carregadas e ir para o relatório final, ex.: ['CTE', 'EMISSAO'].
+        ganchos: funções que recebem as métricas e o progresso de cada etapa
+        (ver MetricasAuditoria).
+        pasta_perfil: grava nessa pasta o cProfile e as métricas da execução.
+        cancelamento: Event que, sinalizado, interrompe a auditoria com
+        AuditoriaCancelada entre etapas ou partes.
+        incremental: reaproveita as linhas já auditadas na última execução
+        deste relatório (ver CacheAuditoria).
+        """
+        metricas = MetricasAuditoria(ganchos, cancelamento)
         
+        with MetricasAuditoria.perfil(pasta_perfil, caminho_relatorio, metricas):
+            # 1. CARREGA LPU
+            with metricas.etapa('carregar_lpu'):
+                ctx_lpu = ProcessadorAuditoria._carregar_lpu(caminho_lpu)
+            
+            relatorio = ProcessadorAuditoria.processar_relatorio(ctx_lpu, caminho_relatorio, colunas_extras,
+                                                                 metricas, incremental, gerencial=ResumoGerencial())
+            metricas.finalizar()
+        return relatorio
+    
+    @staticmethod
+    def processar_relatorio(ctx_lpu: ContextoLPU, caminho_relatorio: str, colunas_extras: Optional[list] = None,
+                            metricas: Optional[MetricasAuditoria] = None, incremental: bool = False,
+                            historico: Optional[HistoricoAuditoria] = None,
+                            gerencial: Optional[ResumoGerencial] = None, aba: Optional[str] = None):
+        """
+        Audita um relatório contra uma LPU já carregada. Com historico, grava
+        as linhas no histórico; com gerencial, acumula nele o resumo gerencial,
+        que também vai como abas extras do relatório (attrs['abas']).
+        Planilhas com várias abas vão para processar_abas (aba escolhe uma só).
+        Não finaliza as métricas: quem chama faz isso depois de exportar.
+        """
+        metricas = metricas or MetricasAuditoria()
+        
+        if aba is None:
+            abas = LeitorArquivo.abas(caminho_relatorio)
+            if len(abas) > 1:
+                return ProcessadorAuditoria.processar_abas(ctx_lpu, caminho_relatorio, abas, colunas_extras,
+                                                           metricas, incremental, historico, gerencial)
+        
+        df_final, colunas_detectadas, numeros = ProcessadorAuditoria._auditar_relatorio(
+            ctx_lpu, caminho_relatorio, colunas_extras, metricas, incremental, historico, gerencial, aba)
+        
+        relatorio = ProcessadorAuditoria._gerar_relatorio(df_final, colunas_detectadas, numeros,
+                                                          colunas_extras, metricas)
+        if gerencial is not None:
+            relatorio[0].data.attrs['abas'] = gerencial.tabelas()
+        return relatorio
+    
+    @staticmethod
+    def _auditar_relatorio(ctx_lpu: ContextoLPU, caminho_relatorio: str, colunas_extras: Optional[list],
+                           metricas: MetricasAuditoria, incremental: bool = False,
+                           historico: Optional[HistoricoAuditoria] = None,
+                           gerencial: Optional[ResumoGerencial] = None, aba: Optional[str] = None) -> tuple:
+        """Carrega e audita o relatório (ou uma aba dele). Retorna (df_final, colunas_detectadas, numeros)."""
         # 2. CARREGA RELATÓRIO E DETECTA ESTRUTURA
-        df_rel, colunas_detectadas = ProcessadorAuditoria._carregar_relatorio(caminho_relatorio)
+        df_rel, colunas_detectadas, numeros = ProcessadorAuditoria._carregar_relatorio(
+            caminho_relatorio, colunas_extras, metricas,
+            identificacao=historico is not None or gerencial is not None, aba=aba)
         
         # 3. CRIA AUDITOR COM MAPEAMENTO
         auditor = AuditorFrete(ctx_lpu, colunas_detectadas)
+        auditor.registrar_colunas = gerencial is not None
         
         # 4. AUDITA
-        resultado = df_rel.apply(auditor.auditar_linha, axis=1)
-        resultado.columns = ['PESO_CORRETO', 'PESO_COBRADO', 'VALOR_LPU', 
-                            'DIFERENCA', 'STATUS', 'SUGESTAO']
+        with metricas.etapa('auditoria') as volume:
+            if incremental:
+                resultado = ProcessadorAuditoria._auditar_incremental(
+                    ctx_lpu, auditor, caminho_relatorio, df_rel, colunas_detectadas, numeros, metricas, aba)
+            else:
+                resultado = ProcessadorAuditoria._auditar_em_partes(auditor, df_rel, numeros, metricas)
+            volume['linhas'] = len(df_rel)
+        metricas.registrar_auditoria(auditor, numeros, len(df_rel))
         
         # 5. MONTA RELATÓRIO FINAL
         df_final = pd.concat([df_rel, resultado], axis=1)
         
-        return ProcessadorAuditoria._gerar_relatorio(df_final, colunas_detectadas)
+        if historico is not None:
+            with metricas.etapa('historico') as volume:
+                historico.registrar(caminho_relatorio, df_final, colunas_detectadas, numeros, aba)
+                volume['linhas'] = len(df_final)
+        
+        if gerencial is not None:
+            with metricas.etapa('resumo_gerencial') as volume:
+                gerencial.acumular(ctx_lpu, caminho_relatorio, df_final, colunas_detectadas, numeros,
+                                   auditor.colunas_usadas, aba=aba)
+                volume['linhas'] = len(df_final)
+        
+        return df_final, colunas_detectadas, numeros
     
     @staticmethod
-    def _carregar_lpu(caminho: str) -> ContextoLPU:
-        """Carrega e processa tabela LPU."""
-        df = LeitorArquivo.carregar(caminho)
+    def processar_abas(ctx_lpu: ContextoLPU, caminho_relatorio: str, abas: list,
+                       colunas_extras: Optional[list] = None, metricas: Optional[MetricasAuditoria] = None,
+                       incremental: bool = False, historico: Optional[HistoricoAuditoria] = None,
+                       gerencial: Optional[ResumoGerencial] = None):
+        """
+        Audita cada aba da planilha como um relatório, com cabeçalho e
+        estrutura detectados aba por aba, em paralelo entre processos (um por
+        aba, até processos_abas), e junta tudo com mesclar_abas. Dentro de um
+        worker da auditoria em lote as abas são auditadas em sequência.
+        """
+        import multiprocessing
+        metricas = metricas or MetricasAuditoria()
+        tarefas = [(caminho_relatorio, aba, colunas_extras, incremental, historico, gerencial is not None)
+                   for aba in abas]
+        processos = min(ProcessadorAuditoria.processos_abas or os.cpu_count() or 1, len(tarefas))
+        if multiprocessing.parent_process() is not None:
+            processos = 1
         
-        # Encontra linha com "PESO"
-        idx_peso = 0
-        for i in range(min(20, len(df))):
-            if "PESO" in str(df.iloc[i, 0]).upper():
-                idx_peso = i
-                break
+        with metricas.etapa('abas') as volume:
+            partes = [None] * len(tarefas)
+            if processos > 1:
+                from concurrent.futures import ProcessPoolExecutor, as_completed
+                with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_worker,
+                                         initargs=(ctx_lpu, LeitorArquivo.engine_excel,
+                                                   log.getEffectiveLevel())) as pool:
+                    futuros = {pool.submit(_auditar_aba, *tarefa): i for i, tarefa in enumerate(tarefas)}
+                    try:
+                        for feitas, futuro in enumerate(as_completed(futuros), 1):
+                            partes[futuros[futuro]] = futuro.result()
+                            metricas.progresso('abas', feitas, len(tarefas))
+                    except AuditoriaCancelada:
+                        pool.shutdown(cancel_futures=True)
+                        raise
+            else:
+                for i, tarefa in enumerate(tarefas):
+                    partes[i] = _auditar_aba(*tarefa, ctx_lpu=ctx_lpu)
+                    metricas.progresso('abas', i + 1, len(tarefas))
+            volume['abas'] = len(tarefas)
+        
+        return ProcessadorAuditoria.mesclar_abas(partes, colunas_extras, metricas, gerencial)
+    
+    @staticmethod
+    def mesclar_abas(partes: list, colunas_extras: Optional[list] = None,
+                     metricas: Optional[MetricasAuditoria] = None,
+                     gerencial: Optional[ResumoGerencial] = None):
+        """
+        Junta as abas auditadas (ver _auditar_aba) num relatório só, com a
+        coluna ABA na frente. As colunas de cada aba ficam com os nomes da
+        primeira aba auditada para o mesmo campo; abas sem relatório de fretes
+        ou com erro ficam de fora (e aparecem com o ERRO na aba 'Por aba', que
+        tem os totais de cada aba). Retorna o mesmo que processar_relatorio.
+        """
+        metricas = metricas or MetricasAuditoria()
+        auditadas = [parte for parte in partes if not parte['ERRO']]
+        for parte in partes:
+            if parte['ERRO']:
+                log.warning("Aba %s ignorada: %s", parte['ABA'], parte['ERRO'])
+        if not auditadas:
+            raise Exception("Nenhuma aba pôde ser auditada: " +
+                            "; ".join(f"{parte['ABA']}: {parte['ERRO']}" for parte in partes))
+        
+        with metricas.etapa('mesclar_abas') as volume:
+            base = auditadas[0]['colunas_detectadas']
+            tabelas = []
+            for parte in auditadas:
+                renomear = {col: base[campo] for campo, col in parte['colunas_detectadas'].items() if campo in base}
+                tabela = parte['tabela'].rename(columns=renomear)
+                tabela.insert(0, 'ABA', parte['ABA'])
+                tabelas.append(tabela)
+            # Categóricas com categorias diferentes viram texto no concat
+            df = ProcessadorAuditoria._compactar(pd.concat(tabelas, ignore_index=True))
+            numeros = {'frete_total': (np.concatenate([parte['frete'] for parte in auditadas]), None)}
+            volume['linhas'] = len(df)
+        
+        extras = ['ABA'] + list(colunas_extras or [])
+        relatorio = ProcessadorAuditoria._gerar_relatorio(df, base, numeros, extras, metricas)
+        
+        abas = {'Por aba': ProcessadorAuditoria._tabela_totais(
+            [{c: parte[c] for c in ('ABA', 'LINHAS', 'TOTAL_PAGO', 'TOTAL_LPU', 'DIFERENCA', 'ERRO')}
+             for parte in partes])}
+        if gerencial is not None:
+            for parte in auditadas:
+                gerencial.mesclar(parte['GERENCIAL'])
+            abas.update(gerencial.tabelas())
+        relatorio[0].data.attrs['abas'] = abas
+        return relatorio
+    
+    @staticmethod
+    def _auditar_em_partes(auditor: 'AuditorFrete', df: pd.DataFrame, numeros: dict,
+                           metricas: MetricasAuditoria,
+                           tamanho_parte: int = TAMANHO_PARTE_AUDITORIA) -> pd.DataFrame:
+        """
+        auditar_lote em partes de `tamanho_parte` linhas, informando o
+        progresso (e atendendo ao cancelamento) entre uma parte e outra.
+        """
+        if len(df) <= tamanho_parte:
+            resultado = auditor.auditar_lote(df, numeros)
+            metricas.progresso('auditoria', len(df), len(df))
+            return resultado
+        
+        partes = []
+        for inicio in range(0, len(df), tamanho_parte):
+            fim = min(inicio + tamanho_parte, len(df))
+            numeros_parte = {campo: (valores[inicio:fim], falhas[inicio:fim])
+                             for campo, (valores, falhas) in numeros.items()}
+            partes.append(auditor.auditar_lote(df.iloc[inicio:fim], numeros_parte))
+            metricas.progresso('auditoria', fim, len(df))
+        resultado = pd.concat(partes)
+        # STATUS tem categorias fixas, mas cada parte tem as suas de SUGESTAO: o
+        # concat as deixaria em texto
+        resultado['SUGESTAO'] = pd.api.types.union_categoricals([parte['SUGESTAO'] for parte in partes])
+        return resultado
+    
+    @staticmethod
+    def _auditar_incremental(ctx_lpu: ContextoLPU, auditor: 'AuditorFrete', caminho_relatorio: str,
+                             df: pd.DataFrame, colunas_detectadas: dict, numeros: dict,
+                             metricas: MetricasAuditoria, aba: Optional[str] = None) -> pd.DataFrame:
+        """
+        Audita só as linhas novas, alteradas ou afetadas por mudança de preço
+        na LPU desde a última auditoria do relatório; as demais vêm do
+        CacheAuditoria. O resultado é o mesmo da auditoria completa.
+        """
+        chave = CacheAuditoria.chave(caminho_relatorio, aba)
+        impressoes = CacheAuditoria.impressoes(df, colunas_detectadas, numeros)
+        anterior = CacheAuditoria.carregar(chave)
+        posicoes = CacheAuditoria.posicoes_anteriores(anterior, ctx_lpu, impressoes)
+        
+        recalcular = np.flatnonzero(posicoes < 0)
+        novo = None
+        auditor.registrar_colunas = True
+        if len(recalcular):
+            numeros_recalcular = {campo: (valores[recalcular], falhas[recalcular])
+                                  for campo, (valores, falhas) in numeros.items()}
+            novo = ProcessadorAuditoria._auditar_em_partes(
+                auditor, df.iloc[recalcular], numeros_recalcular, metricas)
         
-        # Remove linhas antes do header
-        df = df.iloc[idx_peso:].reset_index(drop=True)
+        resultado, colunas_usadas = CacheAuditoria.combinar(
+            df.index, anterior, posicoes, novo, auditor.colunas_usadas)
+        CacheAuditoria.salvar(chave, ctx_lpu, impressoes, resultado, colunas_usadas)
+        auditor.colunas_usadas = [colunas_usadas]  # Agora de todas as linhas, na ordem do relatório
+        
+        metricas.contadores['linhas_reaproveitadas'] = len(df) - len(recalcular)
+        metricas.contadores['linhas_recalculadas'] = len(recalcular)
+        log.info("Auditoria incremental %s: %d linha(s) reaproveitada(s), %d recalculada(s)",
+                 nome_relatorio(caminho_relatorio), len(df) - len(recalcular), len(recalcular))
+        return resultado
+    
+    @staticmethod
+    def processar_em_blocos(ctx_lpu: ContextoLPU, caminho_relatorio: str, caminho_saida: str,
+                            tamanho_bloco: int = TAMANHO_BLOCO_PADRAO,
+                            colunas_extras: Optional[list] = None,
+                            metricas: Optional[MetricasAuditoria] = None,
+                            gerencial: Optional[ResumoGerencial] = None) -> tuple:
+        """
+        Audita o relatório em blocos de `tamanho_bloco` linhas, gravando o
+        resultado em CSV à medida que avança.
+        
+        Para relatórios CSV o arquivo também é lido em blocos, então a memória
+        fica limitada a um bloco qualquer que seja o tamanho do arquivo. Com
+        gerencial, acumula nele o resumo gerencial bloco a bloco. Planilhas
+        com várias abas são auditadas aba por aba no mesmo CSV, com a coluna
+        ABA e as colunas da primeira aba (ver mesclar_abas).
+        Retorna (total_pago, total_devido, total_diff, linhas).
+        """
+        metricas = metricas or MetricasAuditoria()
+        total_pago = total_devido = total_diff = 0.0
+        linhas = 0
+        colunas_saida = base = None
+        cabecalho_escrito = False
+        abas = LeitorArquivo.abas(caminho_relatorio)
+        if len(abas) <= 1:
+            abas = [None]
+        
+        with open(caminho_saida, 'w', encoding='utf-8-sig', newline='') as f:
+            for aba in abas:
+                auditor = None
+                linhas_aba = 0
+                # Numa planilha com várias abas, os blocos, totais e resumo de
+                # cada aba só entram no CSV depois que a aba inteira foi auditada:
+                # uma aba que falha no meio não deixa metade das linhas (as abas
+                # já são carregadas inteiras, ver _carregar_relatorio_em_blocos)
+                pendentes = [] if aba is not None else None
+                gerencial_aba = ResumoGerencial(gerencial.top_n) if gerencial is not None and aba is not None \
+                    else gerencial
+                base_aba, colunas_aba = base, colunas_saida
+                totais_aba = [0.0, 0.0, 0.0]
+                try:
+                    for df_rel, colunas_detectadas, numeros in ProcessadorAuditoria._carregar_relatorio_em_blocos(
+                            caminho_relatorio, tamanho_bloco, colunas_extras,
+                            identificacao=gerencial is not None, aba=aba):
+                        if auditor is None:
+                            auditor = AuditorFrete(ctx_lpu, colunas_detectadas)
+                            auditor.registrar_colunas = gerencial is not None
+                            base_aba = base_aba or colunas_detectadas
+                            renomear = {col: base_aba[campo] for campo, col in colunas_detectadas.items()
+                                        if campo in base_aba}
+                        
+                        with metricas.etapa('auditoria') as volume:
+                            resultado = auditor.auditar_lote(df_rel, numeros)
+                            volume['linhas'] = len(df_rel)
+                        metricas.registrar_auditoria(auditor, numeros, len(df_rel))
+                        # Total desconhecido no modo em blocos
+                        metricas.progresso('auditoria', linhas + linhas_aba + len(df_rel), 0)
+                        df_bloco = pd.concat([df_rel, resultado], axis=1)
+                        if gerencial_aba is not None:
+                            with metricas.etapa('resumo_gerencial'):
+                                gerencial_aba.acumular(ctx_lpu, caminho_relatorio, df_bloco, colunas_detectadas,
+                                                       numeros, auditor.colunas_usadas,
+                                                       primeira_linha=linhas_aba + 1, aba=aba)
+                            auditor.colunas_usadas.clear()
+                        df_bloco = df_bloco.rename(columns=renomear)
+                        if aba is not None:
+                            df_bloco.insert(0, 'ABA', aba)
+                        if colunas_aba is None:
+                            extras = ['ABA'] + list(colunas_extras or []) if aba is not None else colunas_extras
+                            colunas_aba = [c for c in ProcessadorAuditoria._colunas_exportar(base_aba, extras)
+                                           if c in df_bloco.columns]
+                        df_bloco = df_bloco.reindex(columns=colunas_aba)
+                        
+                        # Totais acumulados bloco a bloco
+                        if 'frete_total' in numeros:
+                            totais_aba[0] += numeros['frete_total'][0].sum()
+                        totais_aba[1] += resultado['VALOR_LPU'].sum()
+                        totais_aba[2] += resultado['DIFERENCA'].sum()
+                        linhas_aba += len(df_bloco)
+                        
+                        if pendentes is not None:
+                            pendentes.append(df_bloco)
+                        else:
+                            cabecalho_escrito = ProcessadorAuditoria._gravar_bloco(
+                                f, df_bloco, cabecalho_escrito, metricas)
+                except Exception as e:
+                    if aba is None or isinstance(e, AuditoriaCancelada):
+                        raise
+                    log.warning("Aba %s ignorada: %s", aba, e)
+                    continue
+                
+                for df_bloco in pendentes or []:
+                    cabecalho_escrito = ProcessadorAuditoria._gravar_bloco(f, df_bloco, cabecalho_escrito, metricas)
+                if gerencial_aba is not gerencial:
+                    gerencial.mesclar(gerencial_aba)
+                base, colunas_saida = base_aba, colunas_aba
+                total_pago += totais_aba[0]
+                total_devido += totais_aba[1]
+                total_diff += totais_aba[2]
+                linhas += linhas_aba
+            
+            if colunas_saida is None and abas != [None]:
+                raise Exception("Nenhuma aba pôde ser auditada")
+            if colunas_saida is not None:
+                row_total = ProcessadorAuditoria._linha_total(
+                    colunas_saida, base.get('frete_total'), total_pago, total_devido, total_diff
+                )
+                pd.DataFrame([row_total], columns=colunas_saida).to_csv(
+                    f, sep=';', decimal=',', index=False, header=False)
+        
+        return total_pago, total_devido, total_diff, linhas
+    
+    @staticmethod
+    def _gravar_bloco(f, df_bloco: pd.DataFrame, cabecalho_escrito: bool,
+                      metricas: MetricasAuditoria) -> bool:
+        """Grava um bloco no CSV, com cabeçalho se ainda não houver; devolve cabecalho_escrito."""
+        with metricas.etapa('gravacao'):
+            df_bloco.to_csv(f, sep=';', decimal=',', index=False, header=not cabecalho_escrito)
+        return True
+    
+    @staticmethod
+    def _carregar_lpu(caminho: str, usar_cache: bool = True) -> ContextoLPU:
+        """Carrega e processa tabela LPU (do cache em disco, se já compilada)."""
+        if usar_cache:
+            inicio = time.perf_counter()
+            ctx = CacheLPU.carregar(caminho)
+            if ctx is not None:
+                log.info("LPU %s carregada do cache em %.3fs", os.path.basename(caminho),
+                         time.perf_counter() - inicio)
+                return ctx
+        
+        ctx = ProcessadorAuditoria._compilar_lpu(caminho)
+        if usar_cache:
+            CacheLPU.salvar(caminho, ctx)
+        return ctx
+    
+    @staticmethod
+    def _compilar_lpu(caminho: str) -> ContextoLPU:
+        """Lê a planilha LPU e compila tabela de preços e índices."""
+        # Carrega a partir da linha com "PESO"
+        df = LeitorArquivo.carregar_tabela(caminho, LeitorArquivo.encontrar_linha_peso,
+                                           LINHAS_BUSCA_PESO_LPU)
         
         # Define header e deduplica
         df.columns = df.iloc[0]
@@ -569,39 +2770,258 @@ class ProcessadorAuditoria:
         # Extrai kg adicional (última linha)
         kg_adicional = {c: safe_float(df.iloc[-1][c]) for c in df.columns}
         
-        # Encontra coluna redespacho
-        col_red = next((c for c in df.columns[::-1] if "REDESPACHO" in c or "INTERIOR" in c), 
-                        df.columns[-1])
+        # Encontra coluna redespacho
+        col_red = next((c for c in df.columns[::-1] if "REDESPACHO" in c or "INTERIOR" in c), 
+                        df.columns[-1])
+        
+        tabela, adicional = ProcessadorAuditoria._compilar_tabela(df, kg_adicional)
+        indice_colunas = {c: i for i, c in enumerate(df.columns)}
+        indice_cidades = IndiceCidades(list(df.columns), col_red)
+        
+        return ContextoLPU(col_red, tabela, adicional, indice_colunas, indice_cidades)
+    
+    @staticmethod
+    def _compilar_tabela(df: pd.DataFrame, kg_adicional: Dict[str, float]) -> tuple:
+        """
+        Converte a LPU em matriz float64 [peso, coluna] e vetor de kg adicional.
+        
+        Cada peso inteiro de 1 a PESO_MAXIMO_TABELA usa a primeira linha da
+        LPU com esse peso; pesos ausentes na tabela valem 0.0.
+        """
+        tabela = np.zeros((PESO_MAXIMO_TABELA + 1, len(df.columns)))
+        pesos = df.index.to_numpy()
+        for p in range(1, PESO_MAXIMO_TABELA + 1):
+            linhas = np.flatnonzero(pesos == p)
+            if len(linhas):
+                tabela[p] = [safe_float(v) for v in df.iloc[linhas[0]].values]
+        
+        adicional = np.array([kg_adicional.get(c, 0.0) for c in df.columns], dtype=float)
+        return tabela, adicional
+    
+    @staticmethod
+    def _carregar_relatorio(caminho: str, colunas_extras: Optional[list] = None,
+                            metricas: Optional[MetricasAuditoria] = None, identificacao: bool = False,
+                            aba: Optional[str] = None):
+        """
+        Carrega e normaliza relatório de fretes (no Excel, a aba informada ou
+        a primeira). As colunas de identificação do CT-e (número,
+        transportadora, emissão) só são lidas com identificacao ou se
+        estiverem em colunas_extras.
+        """
+        metricas = metricas or MetricasAuditoria()
+        inicio = time.perf_counter()
+        
+        if LeitorCTe.aceita(caminho):
+            # XMLs de CT-e: colunas e mapeamento já vêm prontos
+            with metricas.etapa('carregar_relatorio') as volume:
+                df, colunas_detectadas = LeitorCTe.carregar(caminho, metricas)
+                usadas = ProcessadorAuditoria._colunas_usadas(colunas_detectadas, colunas_extras, identificacao)
+                df = df[[c for c in df.columns if c in usadas]]
+                volume.update(linhas=len(df), colunas=len(df.columns))
+            log.info("Carga %s: %.2fs (%d CT-e(s))", nome_relatorio(caminho),
+                     time.perf_counter() - inicio, len(df))
+        else:
+            # Encontra cabeçalho e DETECTA ESTRUTURA só pelas primeiras linhas
+            idx_header, nomes, colunas_detectadas, posicoes = ProcessadorAuditoria._estrutura_relatorio(
+                caminho, colunas_extras, metricas, identificacao, aba)
+            meio = time.perf_counter()
+            
+            # Carrega só as colunas usadas
+            with metricas.etapa('carregar_relatorio') as volume:
+                df = LeitorArquivo.carregar_dados(caminho, idx_header, posicoes, aba)
+                df.columns = [nomes[i] for i in posicoes]
+                volume.update(linhas=len(df), colunas=len(posicoes))
+            log.info("Carga %s: sondagem %.2fs, dados %.2fs (%d linhas, %d de %d colunas)",
+                     nome_relatorio(caminho, aba), meio - inicio, time.perf_counter() - meio,
+                     len(df), len(posicoes), len(nomes))
+        
+        # CONVERTE PESOS E FRETE UMA ÚNICA VEZ (reaproveitado na auditoria e nos totais)
+        with metricas.etapa('conversao') as volume:
+            numeros = ProcessadorAuditoria._converter_campos(df, colunas_detectadas)
+            df = ProcessadorAuditoria._compactar(df)
+            volume['celulas'] = len(df) * len(numeros)
+        
+        return df, colunas_detectadas, numeros
+    
+    @staticmethod
+    def _estrutura_relatorio(caminho: str, colunas_extras: Optional[list] = None,
+                             metricas: Optional[MetricasAuditoria] = None, identificacao: bool = False,
+                             aba: Optional[str] = None) -> tuple:
+        """
+        Lê só o início do relatório para achar o cabeçalho e detectar a
+        estrutura. Retorna (idx_header, nomes, colunas_detectadas, posicoes),
+        onde posicoes são as colunas da planilha a carregar: as detectadas e
+        as colunas_extras que existirem. Uma aba (de uma planilha com várias)
+        sem coluna de peso nem de frete não é relatório: levanta exceção.
+        """
+        metricas = metricas or MetricasAuditoria()
+        
+        with metricas.etapa('deteccao_cabecalho') as volume:
+            sondagem = LeitorArquivo.sondar(caminho, LINHAS_BUSCA_CABECALHO, aba)
+            volume['linhas'] = len(sondagem)
+            conhecido = RegistroLayouts.reconhecer(sondagem)
+            if conhecido:
+                idx_header, nomes, colunas_detectadas = conhecido
+            else:
+                idx_header = LeitorArquivo.encontrar_cabecalho(sondagem, PALAVRAS_CABECALHO)
+                nomes = LeitorArquivo.nomes_colunas(sondagem.iloc[idx_header].values) if len(sondagem) else []
+        metricas.contadores['layout_conhecido'] = int(conhecido is not None)
+        
+        # DETECTA ESTRUTURA (novo sistema inteligente), só para layouts novos
+        if not conhecido:
+            with metricas.etapa('deteccao_estrutura') as volume:
+                colunas_detectadas = DetectorEstrutura.detectar(nomes)
+                volume['colunas'] = len(nomes)
+            RegistroLayouts.aprender(idx_header, nomes, colunas_detectadas)
+        
+        if aba is not None and not set(colunas_detectadas) & {'peso_real', 'peso_cubado', 'peso_taxado',
+                                                              'frete_total'}:
+            raise Exception("Nenhuma coluna de peso ou de frete encontrada")
+        
+        usadas = ProcessadorAuditoria._colunas_usadas(colunas_detectadas, colunas_extras, identificacao)
+        posicoes = [i for i, nome in enumerate(nomes) if nome in usadas]
+        if not posicoes and nomes:
+            posicoes = [0]  # Mantém a contagem de linhas mesmo sem nada detectado
+        
+        return idx_header, nomes, colunas_detectadas, posicoes
+    
+    @staticmethod
+    def _colunas_usadas(colunas_detectadas: dict, colunas_extras: Optional[list] = None,
+                        identificacao: bool = False) -> set:
+        """Colunas do relatório a carregar: as detectadas (menos as de identificação) e as extras."""
+        usadas = {col for campo, col in colunas_detectadas.items()
+                  if identificacao or campo not in DetectorEstrutura.CAMPOS_IDENTIFICACAO}
+        usadas.update(str(c).upper().strip() for c in colunas_extras or [])
+        return usadas
+    
+    @staticmethod
+    def _carregar_relatorio_em_blocos(caminho: str, tamanho_bloco: int, colunas_extras: Optional[list] = None,
+                                      identificacao: bool = False, aba: Optional[str] = None):
+        """
+        Versão incremental de _carregar_relatorio: gera (df, colunas_detectadas,
+        numeros) por bloco. Sempre gera ao menos um bloco (mesmo vazio).
+        
+        CSV é lido em blocos: cabeçalho e mapeamento de colunas saem das
+        primeiras LINHAS_BUSCA_CABECALHO linhas. Outros formatos são
+        carregados inteiros e depois fatiados.
+        """
+        if not caminho.lower().endswith('.csv'):
+            df, colunas_detectadas, _ = ProcessadorAuditoria._carregar_relatorio(
+                caminho, colunas_extras, identificacao=identificacao, aba=aba)
+            for inicio in range(0, max(len(df), 1), tamanho_bloco):
+                bloco = df.iloc[inicio:inicio + tamanho_bloco]
+                yield bloco, colunas_detectadas, ProcessadorAuditoria._converter_campos(bloco, colunas_detectadas)
+            return
+        
+        # Cabeçalho e estrutura a partir do início do arquivo
+        idx_header, nomes, colunas_detectadas, posicoes = ProcessadorAuditoria._estrutura_relatorio(
+            caminho, colunas_extras, identificacao=identificacao)
+        nomes_usados = [nomes[i] for i in posicoes]
+        pular = idx_header + 1  # Linhas antes dos dados, descartadas do primeiro bloco
+        gerou = False
+        
+        with LeitorArquivo.abrir_csv_em_blocos(caminho, tamanho_bloco, posicoes) as leitor:
+            for bloco in leitor:
+                if pular:
+                    descartar = min(pular, len(bloco))
+                    bloco, pular = bloco.iloc[descartar:], pular - descartar
+                    if bloco.empty:
+                        continue
+                bloco.columns = nomes_usados
+                gerou = True
+                numeros = ProcessadorAuditoria._converter_campos(bloco, colunas_detectadas)
+                yield ProcessadorAuditoria._compactar(bloco), colunas_detectadas, numeros
         
-        return ContextoLPU(df, kg_adicional, col_red)
+        if not gerou:
+            bloco = pd.DataFrame(columns=nomes_usados, dtype=object)
+            yield bloco, colunas_detectadas, ProcessadorAuditoria._converter_campos(bloco, colunas_detectadas)
     
     @staticmethod
-    def _carregar_relatorio(caminho: str):
-        """Carrega e normaliza relatório de fretes."""
-        df = LeitorArquivo.carregar(caminho)
-        
-        # Encontra cabeçalho
-        palavras = ['PESO', 'CIDADE', 'FRETE', 'ORIGEM', 'DESTINO', 'REMETENTE', 'DESTINATARIO']
-        idx_header = LeitorArquivo.encontrar_cabecalho(df, palavras)
-        
-        # Remove linhas antes do header
-        df = df.iloc[idx_header:].reset_index(drop=True)
-        df.columns = df.iloc[0]
-        df = df.iloc[1:]
+    def _compactar(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Troca colunas de texto da planilha que repetem valores (cidade, UF,
+        datas, pesos...) por categóricas. Os valores continuam os que vieram
+        na planilha: pesos e frete em texto ("R$ 1.234,56") são exportados
+        como a transportadora mandou; a auditoria usa os números convertidos
+        por _converter_campos.
+        """
+        df = df.copy(deep=False)
+        for col in df.columns:
+            if df[col].dtype == object:
+                categorica = df[col].astype('category')
+                if len(categorica.cat.categories) <= len(df) // 2:
+                    df[col] = categorica
+        return df
+    
+    @staticmethod
+    def _converter_campos(df: pd.DataFrame, colunas_detectadas: dict) -> dict:
+        """Converte pesos e frete: {campo: (numeros, falhas)}."""
+        return {
+            campo: converter_numeros(df[colunas_detectadas[campo]])
+            for campo in ('peso_real', 'peso_cubado', 'peso_taxado', 'frete_total')
+            if campo in colunas_detectadas
+        }
+    
+    @staticmethod
+    def _gerar_relatorio(df: pd.DataFrame, colunas_detectadas: dict, numeros: Optional[dict] = None,
+                         colunas_extras: Optional[list] = None, metricas: Optional[MetricasAuditoria] = None):
+        """Gera relatório formatado com totais."""
+        metricas = metricas or MetricasAuditoria()
         
-        # Deduplica colunas
-        df = LeitorArquivo.deduplica_colunas(df)
+        with metricas.etapa('totais') as volume:
+            cols_exportar = ProcessadorAuditoria._colunas_exportar(colunas_detectadas, colunas_extras)
+            
+            # Filtra apenas colunas que existem no DataFrame
+            cols_existentes = [c for c in cols_exportar if c in df.columns]
+            df_export = df[cols_existentes].copy()
+            
+            # Calcula totais
+            frete_col = colunas_detectadas.get('frete_total')
+            if numeros and 'frete_total' in numeros:
+                total_pago = numeros['frete_total'][0].sum()
+            elif frete_col and frete_col in df_export.columns:
+                total_pago = converter_numeros(df_export[frete_col])[0].sum()
+            else:
+                total_pago = 0.0
+            
+            total_devido = df_export['VALOR_LPU'].sum()
+            total_diff = df_export['DIFERENCA'].sum()
+            
+            # Adiciona linha de total
+            row_total = ProcessadorAuditoria._linha_total(
+                df_export.columns, frete_col, total_pago, total_devido, total_diff
+            )
+            df_export = ProcessadorAuditoria._anexar_linha(df_export, row_total)
+            
+            # Colunas monetárias, usadas pelo ExportadorRelatorio
+            df_export.attrs['colunas_moeda'] = [
+                c for c in (frete_col, 'VALOR_LPU', 'DIFERENCA') if c and c in df_export.columns
+            ]
+            
+            volume['linhas'] = len(df_export) - 1
         
-        # DETECTA ESTRUTURA (novo sistema inteligente)
-        colunas_detectadas = DetectorEstrutura.detectar(df.columns.tolist())
+        with metricas.etapa('formatacao'):
+            # Aplica formatação
+            def highlight(row):
+                primeira_col_val = str(row.iloc[0]) if len(row) > 0 else ""
+                if primeira_col_val == 'TOTAL GERAL':
+                    return ['background-color: #D3D3D3; font-weight: bold'] * len(row)
+                if str(row.get('STATUS')) == 'DIVERGENCIA_CRITICA':
+                    return ['background-color: #FF5733; color: white'] * len(row)
+                return [''] * len(row)
+            
+            # Styler.apply é preguiçoso. O formato monetário fica com o
+            # ExportadorRelatorio (attrs['colunas_moeda']): Styler.format monta
+            # um dicionário por célula, ~2 KB por linha só para isso.
+            styled = df_export.style.apply(highlight, axis=1)
         
-        return df, colunas_detectadas
+        return styled, total_pago, total_devido, total_diff
     
     @staticmethod
-    def _gerar_relatorio(df: pd.DataFrame, colunas_detectadas: dict):
-        """Gera relatório formatado com totais."""
-        # Monta lista de colunas para exportar (usa os nomes originais da planilha)
-        cols_exportar = []
+    def _colunas_exportar(colunas_detectadas: dict, colunas_extras: Optional[list] = None) -> list:
+        """Colunas do relatório final (usa os nomes originais da planilha)."""
+        # Colunas extras pedidas pelo usuário vêm primeiro (ex.: número do CT-e)
+        cols_exportar = [str(c).upper().strip() for c in colunas_extras or []]
         
         # Adiciona colunas originais da planilha que foram detectadas
         if 'peso_real' in colunas_detectadas:
@@ -625,71 +3045,1306 @@ class ProcessadorAuditoria:
         cols_exportar.extend(['PESO_CORRETO', 'PESO_COBRADO', 'VALOR_LPU', 
                             'DIFERENCA', 'STATUS', 'SUGESTAO'])
         
-        # Filtra apenas colunas que existem no DataFrame
-        cols_existentes = [c for c in cols_exportar if c in df.columns]
-        df_export = df[cols_existentes].copy()
-        
-        # Calcula totais
-        frete_col = colunas_detectadas.get('frete_total')
-        if frete_col and frete_col in df_export.columns:
-            total_pago = df_export[frete_col].apply(safe_float).sum()
-        else:
-            total_pago = 0.0
-        
-        total_devido = df_export['VALOR_LPU'].sum()
-        total_diff = df_export['DIFERENCA'].sum()
-        
-        # Adiciona linha de total
-        row_total = {col: np.nan for col in df_export.columns}
+        # Uma coluna pedida em --keep-columns que também foi detectada sai uma vez só
+        return list(dict.fromkeys(cols_exportar))
+    
+    @staticmethod
+    def _linha_total(colunas, frete_col, total_pago, total_devido, total_diff) -> dict:
+        """Linha de TOTAL GERAL do relatório."""
+        row_total = {col: np.nan for col in colunas}
         
         # Preenche primeira coluna visível com "TOTAL GERAL"
-        primeira_col = df_export.columns[0]
+        primeira_col = colunas[0]
         row_total[primeira_col] = 'TOTAL GERAL'
         
-        if frete_col and frete_col in df_export.columns:
+        if frete_col and frete_col in row_total:
             row_total[frete_col] = total_pago
         row_total['VALOR_LPU'] = total_devido
         row_total['DIFERENCA'] = total_diff
         
-        df_export = pd.concat([df_export, pd.DataFrame([row_total])], ignore_index=True)
-        
-        # Aplica formatação
-        def highlight(row):
-            primeira_col_val = str(row.iloc[0]) if len(row) > 0 else ""
-            if primeira_col_val == 'TOTAL GERAL':
-                return ['background-color: #D3D3D3; font-weight: bold'] * len(row)
-            if str(row.get('STATUS')) == 'DIVERGENCIA_CRITICA':
-                return ['background-color: #FF5733; color: white'] * len(row)
-            return [''] * len(row)
+        return row_total
+    
+    @staticmethod
+    def _tabela_totais(linhas: list) -> pd.DataFrame:
+        """
+        Uma linha por relatório (ou aba), com LINHAS, TOTAL_PAGO, TOTAL_LPU,
+        DIFERENCA e ERRO, mais a de TOTAL GERAL com a soma dos sem erro.
+        """
+        df = pd.DataFrame(linhas)
+        ok = df['ERRO'] == ''
+        total = {col: np.nan for col in df.columns}
+        total[df.columns[0]] = 'TOTAL GERAL'
+        total['LINHAS'] = df.loc[ok, 'LINHAS'].sum()
+        for col in ('TOTAL_PAGO', 'TOTAL_LPU', 'DIFERENCA'):
+            total[col] = df.loc[ok, col].sum()
+        df = pd.concat([df, pd.DataFrame([total])], ignore_index=True)
+        df.attrs['colunas_moeda'] = ['TOTAL_PAGO', 'TOTAL_LPU', 'DIFERENCA']
+        return df
+    
+    @staticmethod
+    def _anexar_linha(df: pd.DataFrame, linha: dict) -> pd.DataFrame:
+        """
+        Acrescenta uma linha (a de TOTAL GERAL) sem que as colunas
+        categóricas virem texto linha a linha no concat.
+        """
+        nova = pd.DataFrame([linha], columns=df.columns)
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                valor = linha.get(col)
+                if not pd.isna(valor) and valor not in df[col].cat.categories:
+                    df[col] = df[col].cat.add_categories([valor])
+                nova[col] = pd.Categorical([valor], dtype=df[col].dtype)
+        return pd.concat([df, nova], ignore_index=True)
+
+# ================================================================
+# EXPORTAÇÃO
+# ================================================================
+
+class ExportadorRelatorio:
+    """
+    Grava o relatório final em Excel (.xlsx), CSV compactado (.csv.gz) ou
+    Parquet (.parquet), conforme a extensão do arquivo.
+    
+    O Excel é escrito com xlsxwriter em modo constant_memory: linha a linha,
+    com o destaque de DIVERGENCIA_CRITICA como uma única formatação
+    condicional e as colunas monetárias com formato numérico nativo. As
+    tabelas de attrs['abas'] ({nome: DataFrame}) vão em abas depois da
+    principal (só no Excel).
+    """
+    
+    FORMATOS = ('xlsx', 'csv.gz', 'parquet')
+    
+    @staticmethod
+    def formato(caminho: str) -> str:
+        nome = caminho.lower()
+        if nome.endswith('.csv.gz'):
+            return 'csv.gz'
+        if nome.endswith('.parquet'):
+            return 'parquet'
+        return 'xlsx'
+    
+    @staticmethod
+    def exportar(relatorio, caminho: str):
+        """Grava o relatório (DataFrame ou o Styler de _gerar_relatorio)."""
+        df = relatorio.data if hasattr(relatorio, 'data') else relatorio
+        formato = ExportadorRelatorio.formato(caminho)
         
-        styled = df_export.style.apply(highlight, axis=1)
+        if formato == 'csv.gz':
+            df.to_csv(caminho, sep=';', decimal=',', index=False, encoding='utf-8', compression='gzip')
+        elif formato == 'parquet':
+            ExportadorRelatorio._exportar_parquet(df, caminho)
+        else:
+            ExportadorRelatorio._exportar_excel(df, caminho)
+    
+    @staticmethod
+    def _exportar_excel(df: pd.DataFrame, caminho: str):
+        import xlsxwriter
         
-        # Formata colunas monetárias
-        format_dict = {
-            'VALOR_LPU': formatar_moeda,
-            'DIFERENCA': formatar_moeda
+        wb = xlsxwriter.Workbook(caminho, {
+            'constant_memory': True,
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+            'strings_to_numbers': False,
+            'default_date_format': 'dd/mm/yyyy'
+        })
+        formato_moeda = '"R$" #,##0.00'
+        fmt = {
+            'cabecalho': wb.add_format({'bold': True, 'bg_color': '#1E3A8A', 'font_color': 'white'}),
+            'moeda': wb.add_format({'num_format': formato_moeda}),
+            'total': wb.add_format({'bold': True, 'bg_color': '#D3D3D3'}),
+            'total_moeda': wb.add_format({'bold': True, 'bg_color': '#D3D3D3', 'num_format': formato_moeda}),
+            'critico': wb.add_format({'bg_color': '#FF5733', 'font_color': 'white'})
         }
-        if frete_col and frete_col in df_export.columns:
-            format_dict[frete_col] = formatar_moeda
         
-        styled = styled.format(format_dict, na_rep="-")
+        # Abas extras (ex.: o resumo gerencial) depois da principal
+        ExportadorRelatorio._escrever_aba(wb, 'Auditoria', df, fmt)
+        for nome, tabela in df.attrs.get('abas', {}).items():
+            ExportadorRelatorio._escrever_aba(wb, nome, tabela, fmt)
+        wb.close()
+    
+    @staticmethod
+    def _escrever_aba(wb, nome: str, df: pd.DataFrame, fmt: dict):
+        from xlsxwriter.utility import xl_col_to_name
+        
+        ws = wb.add_worksheet(nome)
+        colunas = list(df.columns)
+        moeda = set(df.attrs.get('colunas_moeda', ['VALOR_LPU', 'DIFERENCA']))
         
-        return styled, total_pago, total_devido, total_diff
+        # Células vazias (NaN/None/NaT) viram None e não são gravadas
+        valores = []
+        for col in colunas:
+            serie = df[col]
+            vals = serie.to_numpy(dtype=object, copy=True)
+            vals[serie.isna().to_numpy()] = None
+            valores.append(vals)
+        
+        ultima = len(df)
+        tem_total = ultima > 0 and str(df.iloc[-1, 0]) == 'TOTAL GERAL'
+        
+        for c, col in enumerate(colunas):
+            ws.set_column(c, c, max(12, min(len(str(col)) + 2, 45)))
+            ws.write_string(0, c, str(col), fmt['cabecalho'])
+        
+        formatos = [fmt['moeda'] if col in moeda else None for col in colunas]
+        formatos_total = [fmt['total_moeda'] if col in moeda else fmt['total'] for col in colunas]
+        
+        for r, linha in enumerate(zip(*valores), start=1):
+            fmts = formatos_total if (tem_total and r == ultima) else formatos
+            for c, v in enumerate(linha):
+                if v is not None:
+                    ws.write(r, c, v, fmts[c])
+                elif fmts[c] is fmt['total']:
+                    ws.write_blank(r, c, None, fmt['total'])
+        
+        # Destaque das divergências críticas: uma regra para todas as linhas
+        linhas_dados = ultima - 1 if tem_total else ultima
+        if 'STATUS' in colunas and linhas_dados > 0:
+            letra = xl_col_to_name(colunas.index('STATUS'))
+            ws.conditional_format(1, 0, linhas_dados, len(colunas) - 1, {
+                'type': 'formula',
+                'criteria': f'=${letra}2="DIVERGENCIA_CRITICA"',
+                'format': fmt['critico']
+            })
+        
+        ws.freeze_panes(1, 0)
+    
+    @staticmethod
+    def _exportar_parquet(df: pd.DataFrame, caminho: str):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise Exception("Exportação Parquet requer o pacote pyarrow (pip install pyarrow)")
+        
+        # Colunas originais da planilha misturam texto e número: grava como texto
+        df = df.copy()
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and not all(
+                    isinstance(c, str) for c in df[col].cat.categories):
+                df[col] = df[col].astype(object)
+            if df[col].dtype == object:
+                nulos = df[col].isna()
+                df[col] = df[col].astype(str).where(~nulos, None)
+        df.to_parquet(caminho, index=False)
+
+# ================================================================
+# AUDITORIA EM LOTE (LINHA DE COMANDO)
+# ================================================================
+
+# LPU carregada uma vez por processo worker (ver _iniciar_worker)
+_ctx_worker: Optional[ContextoLPU] = None
+
+def _iniciar_worker(ctx_lpu: ContextoLPU, engine_excel: str = 'openpyxl', nivel_log: int = logging.WARNING):
+    global _ctx_worker
+    _ctx_worker = ctx_lpu
+    LeitorArquivo.engine_excel = engine_excel
+    logging.basicConfig(level=nivel_log, format="%(message)s")
+
+def _auditar_arquivo(caminho: str, caminho_saida: str, tamanho_bloco: Optional[int] = None,
+                     colunas_extras: Optional[list] = None, pasta_perfil: Optional[str] = None,
+                     incremental: bool = False, ctx_lpu: Optional[ContextoLPU] = None,
+                     historico: Optional[HistoricoAuditoria] = None,
+                     resumo_gerencial: bool = False, partes: Optional[list] = None) -> dict:
+    """
+    Audita um relatório com a LPU do worker (ou ctx_lpu, se informada) e
+    grava o resultado no formato da extensão de caminho_saida, ou em CSV,
+    bloco a bloco, quando tamanho_bloco é informado. Com pasta_perfil, grava
+    lá o cProfile e as métricas da auditoria; com incremental, reaproveita a
+    auditoria anterior do relatório e com historico, grava as linhas no
+    histórico (nenhum dos dois vale para o modo em blocos). Com
+    resumo_gerencial, o resumo volta em resumo['GERENCIAL']. Com partes (as
+    abas da planilha já auditadas por _auditar_aba), só junta e grava.
+    """
+    ctx = ctx_lpu if ctx_lpu is not None else _ctx_worker
+    resumo = {
+        'ARQUIVO': nome_relatorio(caminho),
+        'SAIDA': '',
+        'LINHAS': 0,
+        'TOTAL_PAGO': 0.0,
+        'TOTAL_LPU': 0.0,
+        'DIFERENCA': 0.0,
+        'ERRO': ''
+    }
+    metricas = MetricasAuditoria()
+    gerencial = ResumoGerencial() if resumo_gerencial else None
+    try:
+        with MetricasAuditoria.perfil(pasta_perfil, caminho, metricas):
+            if tamanho_bloco:
+                pago, devido, diff, linhas = ProcessadorAuditoria.processar_em_blocos(
+                    ctx, caminho, caminho_saida, tamanho_bloco, colunas_extras, metricas, gerencial)
+            else:
+                if partes is not None:
+                    styled, pago, devido, diff = ProcessadorAuditoria.mesclar_abas(
+                        partes, colunas_extras, metricas, gerencial)
+                else:
+                    styled, pago, devido, diff = ProcessadorAuditoria.processar_relatorio(
+                        ctx, caminho, colunas_extras, metricas, incremental, historico, gerencial)
+                with metricas.etapa('exportacao'):
+                    ExportadorRelatorio.exportar(styled, caminho_saida)
+                linhas = len(styled.data) - 1  # Desconta a linha de TOTAL GERAL
+            metricas.finalizar()  # Depois da exportação: o resumo já tem todas as etapas
+        resumo.update({
+            'SAIDA': os.path.basename(caminho_saida),
+            'LINHAS': linhas,
+            'TOTAL_PAGO': float(pago),
+            'TOTAL_LPU': float(devido),
+            'DIFERENCA': float(diff)
+        })
+        if gerencial is not None:
+            resumo['GERENCIAL'] = gerencial
+    except Exception as e:
+        resumo['ERRO'] = str(e)
+    return resumo
+
+def _auditar_aba(caminho: str, aba: str, colunas_extras: Optional[list] = None, incremental: bool = False,
+                 historico: Optional[HistoricoAuditoria] = None, resumo_gerencial: bool = False,
+                 ctx_lpu: Optional[ContextoLPU] = None) -> dict:
+    """
+    Audita uma aba da planilha com a LPU do worker (ou ctx_lpu). Retorna os
+    totais da aba (ABA, LINHAS, TOTAL_PAGO, TOTAL_LPU, DIFERENCA, ERRO) e,
+    para ProcessadorAuditoria.mesclar_abas, as colunas do relatório final
+    (tabela), o mapeamento, o frete convertido e o resumo gerencial.
+    """
+    ctx = ctx_lpu if ctx_lpu is not None else _ctx_worker
+    parte = {
+        'ABA': aba,
+        'LINHAS': 0,
+        'TOTAL_PAGO': 0.0,
+        'TOTAL_LPU': 0.0,
+        'DIFERENCA': 0.0,
+        'ERRO': ''
+    }
+    gerencial = ResumoGerencial() if resumo_gerencial else None
+    try:
+        df, colunas_detectadas, numeros = ProcessadorAuditoria._auditar_relatorio(
+            ctx, caminho, colunas_extras, MetricasAuditoria(), incremental, historico, gerencial, aba)
+        frete = numeros['frete_total'][0] if 'frete_total' in numeros else np.zeros(len(df))
+        colunas = ProcessadorAuditoria._colunas_exportar(colunas_detectadas, colunas_extras)
+        parte.update({
+            'LINHAS': len(df),
+            'TOTAL_PAGO': float(frete.sum()),
+            'TOTAL_LPU': float(df['VALOR_LPU'].sum()),
+            'DIFERENCA': float(df['DIFERENCA'].sum()),
+            'tabela': df[[c for c in colunas if c in df.columns]],
+            'colunas_detectadas': colunas_detectadas,
+            'frete': frete,
+            'GERENCIAL': gerencial
+        })
+    except Exception as e:
+        parte['ERRO'] = str(e)
+    return parte
+
+class AuditoriaLote:
+    """Audita vários relatórios contra uma única LPU, em paralelo."""
+    
+    @staticmethod
+    def executar(caminho_lpu: str, relatorios: list, pasta_saida: str, workers: int = 1,
+                 tamanho_bloco: Optional[int] = None, colunas_extras: Optional[list] = None,
+                 usar_cache: bool = True, formato: str = 'xlsx',
+                 pasta_perfil: Optional[str] = None, incremental: bool = False,
+                 historico: Optional[HistoricoAuditoria] = None, resumo_gerencial: bool = True,
+                 ctx_lpu: Optional[ContextoLPU] = None) -> list:
+        """
+        Carrega a LPU uma vez (ou usa ctx_lpu, já carregada) e distribui os relatórios entre `workers`
+        processos. Grava um arquivo por relatório (no `formato` pedido, ou CSV
+        em blocos se tamanho_bloco for informado) e o resumo consolidado em
+        pasta_saida, com o resumo gerencial de todos os relatórios em abas
+        extras. Retorna a lista de resumos (um dict por relatório).
+        
+        Nas planilhas com várias abas, cada aba é uma tarefa do pool e o
+        relatório da planilha é montado quando a última aba termina.
+        """
+        if ctx_lpu is None:
+            ctx_lpu = ProcessadorAuditoria._carregar_lpu(caminho_lpu, usar_cache)
+        os.makedirs(pasta_saida, exist_ok=True)
+        extensao = '.csv' if tamanho_bloco else '.' + formato
+        saidas = AuditoriaLote._nomes_saida(relatorios, pasta_saida, extensao)
+        
+        if workers <= 1:
+            _iniciar_worker(ctx_lpu, LeitorArquivo.engine_excel, log.getEffectiveLevel())
+            resumos = []
+            for caminho, saida in zip(relatorios, saidas):
+                resumos.append(_auditar_arquivo(caminho, saida, tamanho_bloco, colunas_extras, pasta_perfil,
+                                                incremental, historico=historico,
+                                                resumo_gerencial=resumo_gerencial))
+                AuditoriaLote._log(resumos[-1])
+        else:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker,
+                                     initargs=(ctx_lpu, LeitorArquivo.engine_excel,
+                                               log.getEffectiveLevel())) as pool:
+                futuros = {}
+                partes = {}
+                for i, (c, s) in enumerate(zip(relatorios, saidas)):
+                    abas = [] if tamanho_bloco else AuditoriaLote._abas(c)
+                    if len(abas) > 1:
+                        partes[i] = [None] * len(abas)
+                        for j, aba in enumerate(abas):
+                            futuros[pool.submit(_auditar_aba, c, aba, colunas_extras, incremental,
+                                                historico, resumo_gerencial)] = (i, j)
+                    else:
+                        futuros[pool.submit(_auditar_arquivo, c, s, tamanho_bloco, colunas_extras, pasta_perfil,
+                                            incremental, historico=historico,
+                                            resumo_gerencial=resumo_gerencial)] = (i, None)
+                
+                resumos = [None] * len(relatorios)
+                for futuro in as_completed(futuros):
+                    i, j = futuros[futuro]
+                    if j is None:
+                        resumos[i] = futuro.result()
+                    else:
+                        partes[i][j] = futuro.result()
+                        if any(parte is None for parte in partes[i]):
+                            continue
+                        resumos[i] = _auditar_arquivo(relatorios[i], saidas[i], None, colunas_extras,
+                                                      pasta_perfil, resumo_gerencial=resumo_gerencial,
+                                                      partes=partes.pop(i))
+                    AuditoriaLote._log(resumos[i])
+        
+        gerencial = None
+        if resumo_gerencial:
+            gerencial = ResumoGerencial()
+            for resumo in resumos:
+                if 'GERENCIAL' in resumo:
+                    gerencial.mesclar(resumo.pop('GERENCIAL'))
+        AuditoriaLote._gravar_resumo(resumos, os.path.join(pasta_saida, 'resumo_auditoria.xlsx'), gerencial)
+        return resumos
+    
+    @staticmethod
+    def _abas(caminho: str) -> list:
+        # Planilha ilegível: o erro aparece na auditoria do arquivo inteiro
+        try:
+            return LeitorArquivo.abas(caminho)
+        except Exception:
+            return []
+    
+    @staticmethod
+    def _nomes_saida(relatorios: list, pasta_saida: str, extensao: str = '.xlsx') -> list:
+        """Um arquivo de saída por relatório, sem colisão entre nomes iguais."""
+        saidas = []
+        usados = {}
+        for caminho in relatorios:
+            base = os.path.splitext(nome_relatorio(caminho))[0]
+            usados[base] = usados.get(base, 0) + 1
+            sufixo = f"_{usados[base]}" if usados[base] > 1 else ""
+            saidas.append(os.path.join(pasta_saida, f"{base}{sufixo}_auditado{extensao}"))
+        return saidas
+    
+    @staticmethod
+    def _gravar_resumo(resumos: list, caminho: str, gerencial: Optional[ResumoGerencial] = None):
+        df = ProcessadorAuditoria._tabela_totais(resumos)
+        if gerencial is not None:
+            df.attrs['abas'] = gerencial.tabelas()
+        ExportadorRelatorio.exportar(df, caminho)
+    
+    @staticmethod
+    def _log(resumo: dict):
+        if resumo['ERRO']:
+            print(f"✗ {resumo['ARQUIVO']}: {resumo['ERRO']}", flush=True)
+        else:
+            print(f"✓ {resumo['ARQUIVO']}: {resumo['LINHAS']} linhas | "
+                  f"Diferença {formatar_moeda(resumo['DIFERENCA'])}", flush=True)
+
+# ================================================================
+# COMPARAÇÃO DE LPUs (SIMULAÇÃO)
+# ================================================================
+
+# Pesos e rotas do relatório, preparados uma vez e compartilhados com os
+# workers da comparação (ver _iniciar_worker_comparacao)
+_rotas_worker: Optional[dict] = None
+
+def _iniciar_worker_comparacao(rotas: dict, engine_excel: str = 'openpyxl', nivel_log: int = logging.WARNING):
+    global _rotas_worker
+    _rotas_worker = rotas
+    LeitorArquivo.engine_excel = engine_excel
+    logging.basicConfig(level=nivel_log, format="%(message)s")
+
+def _precificar_lpu(caminho_lpu: str, usar_cache: bool = True) -> np.ndarray:
+    """Valor LPU (sem arredondar) de cada linha das rotas do worker, com a tabela informada."""
+    ctx = ProcessadorAuditoria._carregar_lpu(caminho_lpu, usar_cache)
+    r = _rotas_worker
+    return AuditorFrete(ctx, {})._calcular_valor_rota_lote(
+        r['origem_cidade'], r['origem_uf'], r['destino_cidade'], r['destino_uf'], r['peso_correto'])
+
+class ComparadorLPU:
+    """
+    Simula o mesmo relatório contra várias LPUs candidatas.
+    
+    O relatório é lido, detectado e normalizado uma vez (pesos, frete e
+    rotas); cada LPU só precifica as rotas, em paralelo entre `workers`
+    processos. VALOR_LPU e DIFERENCA de cada tabela são os mesmos que a
+    auditoria completa com essa tabela daria.
+    """
+    
+    @staticmethod
+    def executar(caminhos_lpu: list, caminho_relatorio: str, workers: int = 1,
+                 colunas_extras: Optional[list] = None, usar_cache: bool = True) -> tuple:
+        """
+        Retorna (comparacao, ranking): o relatório com VALOR_LPU_<tabela> e
+        DIFERENCA_<tabela> lado a lado (mais a linha de TOTAL GERAL) e as
+        tabelas ordenadas pelo custo total.
+        """
+        df, colunas_detectadas, numeros = ProcessadorAuditoria._carregar_relatorio(
+            caminho_relatorio, colunas_extras)
+        rotas = ComparadorLPU._preparar_rotas(df, colunas_detectadas, numeros)
+        nomes = ComparadorLPU._nomes_tabelas(caminhos_lpu)
+        
+        if workers <= 1 or len(caminhos_lpu) == 1:
+            _iniciar_worker_comparacao(rotas, LeitorArquivo.engine_excel, log.getEffectiveLevel())
+            valores = [_precificar_lpu(c, usar_cache) for c in caminhos_lpu]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(workers, len(caminhos_lpu)),
+                                     initializer=_iniciar_worker_comparacao,
+                                     initargs=(rotas, LeitorArquivo.engine_excel,
+                                               log.getEffectiveLevel())) as pool:
+                valores = list(pool.map(_precificar_lpu, caminhos_lpu, [usar_cache] * len(caminhos_lpu)))
+        
+        cols_relatorio = [c for c in ProcessadorAuditoria._colunas_exportar(colunas_detectadas, colunas_extras)
+                          if c in df.columns]
+        comparacao = df[cols_relatorio].reset_index(drop=True)
+        comparacao['PESO_CORRETO'] = rotas['peso_correto']
+        
+        frete_col = colunas_detectadas.get('frete_total')
+        total_pago = rotas['valor_cobrado'].sum()
+        ranking = []
+        for nome, caminho, valor_lpu in zip(nomes, caminhos_lpu, valores):
+            comparacao[f'VALOR_LPU_{nome}'] = arredondar(valor_lpu, 2)
+            comparacao[f'DIFERENCA_{nome}'] = arredondar(rotas['valor_cobrado'] - valor_lpu, 2)
+            ranking.append({
+                'TABELA': nome,
+                'ARQUIVO': os.path.basename(caminho),
+                'TOTAL_LPU': comparacao[f'VALOR_LPU_{nome}'].sum(),
+                'TOTAL_PAGO': total_pago,
+                'DIFERENCA': comparacao[f'DIFERENCA_{nome}'].sum()
+            })
+        
+        # Linha de TOTAL GERAL com a soma de cada tabela
+        total = {col: np.nan for col in comparacao.columns}
+        total[comparacao.columns[0]] = 'TOTAL GERAL'
+        if frete_col in total:
+            total[frete_col] = total_pago
+        for r in ranking:
+            total[f"VALOR_LPU_{r['TABELA']}"] = r['TOTAL_LPU']
+            total[f"DIFERENCA_{r['TABELA']}"] = r['DIFERENCA']
+        comparacao = ProcessadorAuditoria._anexar_linha(comparacao, total)
+        comparacao.attrs['colunas_moeda'] = [c for c in comparacao.columns
+                                             if c == frete_col or c.startswith(('VALOR_LPU_', 'DIFERENCA_'))]
+        
+        ranking = pd.DataFrame(ranking).sort_values('TOTAL_LPU', kind='stable').reset_index(drop=True)
+        ranking.insert(0, 'POSICAO', range(1, len(ranking) + 1))
+        ranking.attrs['colunas_moeda'] = ['TOTAL_LPU', 'TOTAL_PAGO', 'DIFERENCA']
+        
+        return comparacao, ranking
+    
+    @staticmethod
+    def _preparar_rotas(df: pd.DataFrame, colunas_detectadas: dict, numeros: dict) -> dict:
+        """Pesos, frete cobrado e rotas normalizadas: tudo de que a precificação depende."""
+        def coluna(campo):
+            # Campo não detectado vale 0.0, como em AuditorFrete._coluna_float
+            return numeros[campo][0] if campo in numeros else np.zeros(len(df))
+        
+        peso_correto, _, _ = CalculadoraPeso.processar_lote(
+            coluna('peso_real'), coluna('peso_cubado'), coluna('peso_taxado'))
+        rotas = ExtratorLocalizacao.processar_lote(df, colunas_detectadas)
+        rotas['peso_correto'] = peso_correto
+        rotas['valor_cobrado'] = coluna('frete_total')
+        return rotas
+    
+    @staticmethod
+    def _nomes_tabelas(caminhos_lpu: list) -> list:
+        """Nome de cada LPU nas colunas (nome do arquivo, sem repetir)."""
+        nomes = []
+        usados = {}
+        for caminho in caminhos_lpu:
+            base = os.path.splitext(os.path.basename(caminho))[0].upper()
+            usados[base] = usados.get(base, 0) + 1
+            nomes.append(f"{base}_{usados[base]}" if usados[base] > 1 else base)
+        return nomes
+
+# ================================================================
+# SERVIÇO LOCAL DE AUDITORIA (HTTP)
+# ================================================================
+
+class ServicoOcupado(Exception):
+    """Todas as vagas de auditoria do serviço estão em uso."""
+
+class RegistroLPU:
+    """
+    LPUs compiladas mantidas em memória pelo serviço, por nome (nome do
+    arquivo, como na comparação). Cada consulta confere a data e o tamanho
+    do arquivo e só recompila a tabela quando ela mudou.
+    """
+    
+    def __init__(self, caminhos_lpu: list, usar_cache: bool = True):
+        self.caminhos = dict(zip(ComparadorLPU._nomes_tabelas(caminhos_lpu), caminhos_lpu))
+        self.usar_cache = usar_cache
+        self._carregadas: Dict[str, tuple] = {}  # nome -> (assinatura do arquivo, ContextoLPU)
+        self._trava = threading.Lock()
+    
+    def nome(self, pedido: Optional[str]) -> str:
+        """Nome registrado da LPU pedida (sem nome, vale a única registrada)."""
+        if not pedido and len(self.caminhos) == 1:
+            return next(iter(self.caminhos))
+        nome = (pedido or '').upper()
+        if nome not in self.caminhos:
+            raise KeyError(f"LPU '{pedido or ''}' não registrada (disponíveis: {', '.join(self.caminhos)})")
+        return nome
+    
+    @staticmethod
+    def assinatura(caminho: str) -> tuple:
+        info = os.stat(caminho)
+        return info.st_mtime_ns, info.st_size
+    
+    def obter(self, nome: str) -> ContextoLPU:
+        caminho = self.caminhos[nome]
+        assinatura = RegistroLPU.assinatura(caminho)
+        with self._trava:
+            atual = self._carregadas.get(nome)
+            if atual is not None and atual[0] == assinatura:
+                return atual[1]
+            ctx = ProcessadorAuditoria._carregar_lpu(caminho, self.usar_cache)
+            self._carregadas[nome] = (assinatura, ctx)
+            log.info("LPU %s %s", nome, "recarregada (arquivo alterado)" if atual else "carregada")
+            return ctx
+    
+    def situacao(self) -> list:
+        return [{'nome': nome, 'arquivo': caminho, 'carregada': nome in self._carregadas}
+                for nome, caminho in self.caminhos.items()]
+
+class ServicoAuditoria:
+    """
+    Serviço local que audita os relatórios enviados por HTTP num pool de
+    `workers` processos já aquecidos: pandas importado e as LPUs compiladas
+    carregadas uma vez em cada worker (ver _iniciar_worker_servico). Cada
+    pedido leva ao worker só o caminho da LPU e o relatório.
+    
+    Aceita no máximo `max_pendentes` auditorias ao mesmo tempo (em execução
+    ou na fila do pool); acima disso responde 503 para o cliente tentar de
+    novo, em vez de acumular uploads em memória.
+    """
+    
+    EXTENSOES = ('.xlsx', '.xlsm', '.xls', '.csv', '.xml', '.zip')
+    TIPOS_CONTEUDO = {
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'csv.gz': 'application/gzip',
+        'parquet': 'application/vnd.apache.parquet'
+    }
+    
+    def __init__(self, caminhos_lpu: list, workers: int = 1, usar_cache: bool = True,
+                 max_pendentes: Optional[int] = None):
+        self.registro = RegistroLPU(caminhos_lpu, usar_cache)
+        self.usar_cache = usar_cache
+        self.workers = max(1, workers)
+        self.max_pendentes = max_pendentes or 2 * self.workers
+        self._vagas = threading.BoundedSemaphore(self.max_pendentes)
+        self._trava_pool = threading.Lock()
+        self._pool = None
+        # Compila já na partida (e grava o cache em disco, que os workers leem)
+        for nome in self.registro.caminhos:
+            self.registro.obter(nome)
+        self._iniciar_pool()
+    
+    def _iniciar_pool(self):
+        """Cria os workers, que importam pandas e carregam as LPUs antes da primeira auditoria."""
+        from concurrent.futures import ProcessPoolExecutor, wait
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_iniciar_worker_servico,
+                                         initargs=(list(self.registro.caminhos.values()), self.usar_cache,
+                                                   LeitorArquivo.engine_excel, log.getEffectiveLevel()))
+        wait([self._pool.submit(precarregar_dependencias) for _ in range(self.workers)])
+    
+    @contextmanager
+    def vaga(self):
+        """
+        Reserva uma das max_pendentes vagas até o fim do bloco, ou levanta
+        ServicoOcupado. Quem chama reserva antes de ler o upload, para os
+        pedidos recusados não ocuparem memória.
+        """
+        if not self._vagas.acquire(blocking=False):
+            raise ServicoOcupado(f"{self.max_pendentes} auditorias em andamento; tente novamente")
+        try:
+            yield
+        finally:
+            self._vagas.release()
+    
+    def auditar(self, conteudo: bytes, nome_arquivo: str, nome_lpu: Optional[str] = None,
+                formato: str = 'xlsx', colunas_extras: Optional[list] = None) -> tuple:
+        """
+        Audita o relatório enviado (conteudo, com a extensão de nome_arquivo)
+        contra a LPU pedida, dentro de uma vaga já reservada (ver vaga).
+        Retorna (resumo, dados do arquivo de resultado); sem resultado (None)
+        se a auditoria falhou, com o motivo em resumo['ERRO'].
+        """
+        import tempfile
+        from concurrent.futures.process import BrokenProcessPool
+        
+        nome_arquivo = os.path.basename(nome_arquivo or '')
+        if not nome_arquivo.lower().endswith(self.EXTENSOES):
+            raise ValueError(f"Extensão não suportada: '{nome_arquivo}' (use {', '.join(self.EXTENSOES)})")
+        nome_lpu = self.registro.nome(nome_lpu)
+        # Confere a LPU (recompila e atualiza o cache em disco se o arquivo mudou);
+        # o worker recarrega a dele pela assinatura
+        self.registro.obter(nome_lpu)
+        caminho_lpu = self.registro.caminhos[nome_lpu]
+        with tempfile.TemporaryDirectory(prefix='auditoria_') as pasta:
+            entrada = os.path.join(pasta, nome_arquivo)
+            with open(entrada, 'wb') as f:
+                f.write(conteudo)
+            base = os.path.splitext(nome_arquivo)[0]
+            saida = os.path.join(pasta, f"{base}_auditado.{formato}")
+            try:
+                resumo = self._pool.submit(_auditar_servico, entrada, saida, colunas_extras, caminho_lpu,
+                                           RegistroLPU.assinatura(caminho_lpu), self.usar_cache).result()
+            except BrokenProcessPool:
+                # Um worker morreu (ex.: falta de memória): recria o pool para os próximos pedidos
+                with self._trava_pool:
+                    self._pool.shutdown(wait=False)
+                    self._iniciar_pool()
+                raise
+            if resumo['ERRO']:
+                return resumo, None
+            with open(saida, 'rb') as f:
+                return resumo, f.read()
+    
+    def servir(self, host: str = '127.0.0.1', porta: int = PORTA_SERVICO):
+        """Atende até Ctrl+C (cada pedido numa thread; a auditoria roda no pool)."""
+        from http.server import ThreadingHTTPServer
+        servidor = ThreadingHTTPServer((host, porta), _criar_manipulador(self))
+        print(f"Serviço de auditoria em http://{host}:{servidor.server_address[1]} "
+              f"({self.workers} worker(s), LPUs: {', '.join(self.registro.caminhos)})", flush=True)
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+            self._pool.shutdown(cancel_futures=True)
+
+# LPUs carregadas em cada worker do serviço: caminho -> (assinatura, ContextoLPU)
+_lpus_worker: Dict[str, tuple] = {}
+
+def _lpu_worker(caminho: str, assinatura: tuple, usar_cache: bool = True) -> ContextoLPU:
+    """LPU já carregada neste worker, recarregada só quando a assinatura do arquivo muda."""
+    atual = _lpus_worker.get(caminho)
+    if atual is None or atual[0] != assinatura:
+        atual = _lpus_worker[caminho] = (assinatura, ProcessadorAuditoria._carregar_lpu(caminho, usar_cache))
+    return atual[1]
+
+def _iniciar_worker_servico(caminhos_lpu: list, usar_cache: bool = True, engine_excel: str = 'openpyxl',
+                            nivel_log: int = logging.WARNING):
+    _iniciar_worker(None, engine_excel, nivel_log)
+    for caminho in caminhos_lpu:
+        _lpu_worker(caminho, RegistroLPU.assinatura(caminho), usar_cache)
+
+def _auditar_servico(entrada: str, saida: str, colunas_extras: Optional[list], caminho_lpu: str,
+                     assinatura: tuple, usar_cache: bool = True) -> dict:
+    """_auditar_arquivo com a LPU do worker (o pedido não leva a tabela compilada)."""
+    return _auditar_arquivo(entrada, saida, None, colunas_extras,
+                            ctx_lpu=_lpu_worker(caminho_lpu, assinatura, usar_cache))
+
+def _criar_manipulador(servico: ServicoAuditoria):
+    """
+    Manipulador HTTP do serviço (http.server só é importado por ele):
+    
+    - GET  /status: LPUs registradas, workers e limite de auditorias.
+    - POST /audit?lpu=<nome>&nome=<relatorio.xlsx>[&format=csv.gz][&keep=CTE,EMISSAO][&totais=1]:
+      corpo = arquivo do relatório. Responde o arquivo auditado com os totais
+      nos cabeçalhos X-Auditoria-*, ou só os totais em JSON com totais=1.
+    """
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+    
+    class ManipuladorAuditoria(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def do_GET(self):
+            if urlparse(self.path).path != '/status':
+                return self._json(404, {'erro': 'Rota não encontrada'})
+            self._json(200, {
+                'lpus': servico.registro.situacao(),
+                'workers': servico.workers,
+                'max_pendentes': servico.max_pendentes
+            })
+        
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/audit':
+                return self._json(404, {'erro': 'Rota não encontrada'})
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            formato = params.get('format', 'xlsx')
+            if formato not in ExportadorRelatorio.FORMATOS:
+                return self._json(400, {'erro': f"Formato inválido: {formato}"})
+            tamanho = int(self.headers.get('Content-Length') or 0)
+            if tamanho <= 0:
+                return self._json(400, {'erro': 'Envie o relatório no corpo do pedido'})
+            if tamanho > TAMANHO_MAXIMO_UPLOAD:
+                self.close_connection = True
+                return self._json(413, {'erro': f"Relatório maior que {TAMANHO_MAXIMO_UPLOAD // (1024 * 1024)} MB"})
+            colunas_extras = [c for c in params.get('keep', '').split(',') if c.strip()]
+            
+            inicio = time.perf_counter()
+            try:
+                # O upload só é lido com a vaga reservada
+                with servico.vaga():
+                    conteudo = self.rfile.read(tamanho)
+                    resumo, dados = servico.auditar(conteudo, params.get('nome', 'relatorio.xlsx'),
+                                                    params.get('lpu'), formato, colunas_extras)
+            except ServicoOcupado as e:
+                self.close_connection = True  # O corpo não lido ainda está na conexão
+                return self._json(503, {'erro': str(e)}, {'Retry-After': '5'})
+            except KeyError as e:
+                return self._json(404, {'erro': e.args[0]})
+            except ValueError as e:
+                return self._json(400, {'erro': str(e)})
+            except Exception as e:
+                log.exception("Falha no pedido de auditoria")
+                return self._json(500, {'erro': str(e)})
+            log.info("%s: %d linhas em %.2fs", resumo['ARQUIVO'], resumo['LINHAS'], time.perf_counter() - inicio)
+            
+            if dados is None:
+                return self._json(422, resumo)
+            if params.get('totais') == '1':
+                return self._json(200, resumo)
+            self._responder(200, dados, ServicoAuditoria.TIPOS_CONTEUDO[formato], {
+                'Content-Disposition': f'attachment; filename="{resumo["SAIDA"]}"',
+                'X-Auditoria-Linhas': str(resumo['LINHAS']),
+                'X-Auditoria-Total-Pago': f"{resumo['TOTAL_PAGO']:.2f}",
+                'X-Auditoria-Total-Lpu': f"{resumo['TOTAL_LPU']:.2f}",
+                'X-Auditoria-Diferenca': f"{resumo['DIFERENCA']:.2f}"
+            })
+        
+        def _json(self, status: int, corpo: dict, cabecalhos: Optional[dict] = None):
+            self._responder(status, json.dumps(corpo, ensure_ascii=False).encode('utf-8'),
+                            'application/json; charset=utf-8', cabecalhos)
+        
+        def _responder(self, status: int, corpo: bytes, tipo: str, cabecalhos: Optional[dict] = None):
+            self.send_response(status)
+            self.send_header('Content-Type', tipo)
+            self.send_header('Content-Length', str(len(corpo)))
+            for nome, valor in (cabecalhos or {}).items():
+                # Cabeçalhos HTTP são latin-1: troca o que não couber (ex.: emoji no nome do arquivo)
+                self.send_header(nome, valor.encode('latin-1', 'replace').decode('latin-1'))
+            self.end_headers()
+            self.wfile.write(corpo)
+        
+        def log_message(self, formato, *args):
+            log.debug("%s - %s", self.address_string(), formato % args)
+    
+    return ManipuladorAuditoria
+
+# ================================================================
+# MONITORAMENTO DE PASTA (DAEMON)
+# ================================================================
+
+def _auditar_monitorado(caminho: str, caminho_saida: str, colunas_extras: Optional[list],
+                        ctx_lpu: ContextoLPU, historico: Optional[HistoricoAuditoria] = None) -> dict:
+    """_auditar_arquivo com o horário de início e de fim no worker (para a latência)."""
+    inicio = time.time()
+    resumo = _auditar_arquivo(caminho, caminho_saida, None, colunas_extras, ctx_lpu=ctx_lpu, historico=historico)
+    resumo.update(INICIO=inicio, FIM=time.time())
+    return resumo
+
+class MonitorPasta:
+    """
+    Audita os relatórios que as transportadoras deixam numa pasta de entrada.
+    
+    Um arquivo só entra na fila depois de ficar `espera_estavel` segundos sem
+    mudar de tamanho/data (ainda pode estar sendo copiado). No máximo
+    `max_pendentes` relatórios ficam em auditoria ao mesmo tempo; os demais
+    esperam na própria pasta, sem ocupar memória. Ao terminar, o relatório
+    vai para pasta_ok ou pasta_falha e a latência de cada arquivo é anotada
+    em latencia_monitor.csv na pasta de saída.
+    """
+    
+    EXTENSOES = ServicoAuditoria.EXTENSOES
+    COLUNAS_LATENCIA = ['ARQUIVO', 'DETECTADO', 'ESPERA_FILA_S', 'AUDITORIA_S', 'TOTAL_S',
+                        'LINHAS', 'DIFERENCA', 'SAIDA', 'ERRO']
+    
+    def __init__(self, caminho_lpu: str, pasta_entrada: str, pasta_saida: str,
+                 pasta_ok: Optional[str] = None, pasta_falha: Optional[str] = None,
+                 workers: int = 1, max_pendentes: Optional[int] = None, formato: str = 'xlsx',
+                 colunas_extras: Optional[list] = None, usar_cache: bool = True,
+                 espera_estavel: float = ESPERA_ARQUIVO_ESTAVEL_S,
+                 historico: Optional[HistoricoAuditoria] = None):
+        self.registro = RegistroLPU([caminho_lpu], usar_cache)
+        self.pasta_entrada = pasta_entrada
+        self.pasta_saida = pasta_saida
+        self.pasta_ok = pasta_ok or os.path.join(pasta_entrada, 'processados')
+        self.pasta_falha = pasta_falha or os.path.join(pasta_entrada, 'falhas')
+        self.workers = max(1, workers)
+        self.max_pendentes = max_pendentes or 2 * self.workers
+        self.formato = formato
+        self.colunas_extras = colunas_extras
+        self.espera_estavel = espera_estavel
+        self.historico = historico
+        self._vistos: Dict[str, tuple] = {}  # caminho -> (assinatura, desde quando está estável)
+        self._pendentes: Dict[object, tuple] = {}  # futuro -> (caminho, detectado, enviado)
+        for pasta in (pasta_entrada, pasta_saida, self.pasta_ok, self.pasta_falha):
+            os.makedirs(pasta, exist_ok=True)
+    
+    def executar(self, uma_vez: bool = False) -> list:
+        """
+        Monitora a pasta até Ctrl+C (ou, com uma_vez, até auditar o que já
+        estava nela). Retorna os resumos dos relatórios auditados.
+        """
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        resumos = []
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_iniciar_worker,
+                                   initargs=(None, LeitorArquivo.engine_excel, log.getEffectiveLevel()))
+        print(f"Monitorando {os.path.abspath(self.pasta_entrada)} "
+              f"({self.workers} worker(s), até {self.max_pendentes} relatório(s) por vez)", flush=True)
+        try:
+            while True:
+                prontos = self._arquivos_prontos()
+                while prontos and len(self._pendentes) < self.max_pendentes:
+                    self._enviar(pool, prontos.pop(0))
+                
+                # Arquivos vazios contam como cópia que ainda não começou
+                if uma_vez and not self._pendentes and not any(a[0] for a, _ in self._vistos.values()):
+                    break
+                if self._pendentes:
+                    concluidos, _ = wait(list(self._pendentes), timeout=INTERVALO_MONITOR_S,
+                                         return_when=FIRST_COMPLETED)
+                    for futuro in concluidos:
+                        resumos.append(self._concluir(futuro))
+                else:
+                    time.sleep(INTERVALO_MONITOR_S)
+        except KeyboardInterrupt:
+            # Os relatórios em andamento ficam na pasta de entrada e são auditados na próxima execução
+            print(f"Interrompido: {len(self._pendentes)} relatório(s) em andamento continuam na pasta de entrada.",
+                  flush=True)
+        finally:
+            pool.shutdown(wait=not self._pendentes, cancel_futures=True)
+        return resumos
+    
+    def _arquivos_prontos(self) -> list:
+        """Relatórios da pasta de entrada que pararam de mudar, do mais antigo ao mais novo."""
+        agora = time.time()
+        em_andamento = {caminho for caminho, _, _ in self._pendentes.values()}
+        atuais = {}
+        for entrada in os.scandir(self.pasta_entrada):
+            nome = entrada.name
+            # Ignora temporários do Excel/cópias em andamento e arquivos ocultos
+            if (not entrada.is_file() or nome.startswith(('~$', '.'))
+                    or not nome.lower().endswith(self.EXTENSOES) or entrada.path in em_andamento):
+                continue
+            info = entrada.stat()
+            assinatura = (info.st_size, info.st_mtime_ns)
+            anterior = self._vistos.get(entrada.path)
+            atuais[entrada.path] = anterior if anterior and anterior[0] == assinatura else (assinatura, agora)
+        self._vistos = atuais
+        prontos = [(desde, caminho) for caminho, (assinatura, desde) in atuais.items()
+                   if assinatura[0] > 0 and agora - desde >= self.espera_estavel]
+        return [caminho for _, caminho in sorted(prontos)]
+    
+    def _enviar(self, pool, caminho: str):
+        detectado = self._vistos.pop(caminho)[1]
+        base = os.path.splitext(nome_relatorio(caminho))[0]
+        saida = self._destino_livre(os.path.join(self.pasta_saida, f"{base}_auditado.{self.formato}"))
+        # Confere a LPU a cada relatório: se o arquivo dela mudou, os próximos já usam a nova
+        ctx = self.registro.obter(next(iter(self.registro.caminhos)))
+        futuro = pool.submit(_auditar_monitorado, caminho, saida, self.colunas_extras, ctx, self.historico)
+        self._pendentes[futuro] = (caminho, detectado, time.time())
+    
+    def _concluir(self, futuro) -> dict:
+        caminho, detectado, enviado = self._pendentes.pop(futuro)
+        try:
+            resumo = futuro.result()
+        except Exception as e:  # Worker morreu (ex.: falta de memória)
+            resumo = {'ARQUIVO': nome_relatorio(caminho), 'SAIDA': '', 'LINHAS': 0,
+                      'DIFERENCA': 0.0, 'ERRO': str(e) or type(e).__name__}
+        fim = resumo.get('FIM', time.time())
+        inicio = resumo.get('INICIO', fim)
+        
+        destino = self.pasta_falha if resumo['ERRO'] else self.pasta_ok
+        try:
+            os.replace(caminho, self._destino_livre(os.path.join(destino, nome_relatorio(caminho))))
+        except OSError as e:
+            log.warning("Não foi possível mover %s: %s", caminho, e)
+        
+        self._anotar_latencia({
+            'ARQUIVO': resumo['ARQUIVO'],
+            'DETECTADO': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(detectado)),
+            'ESPERA_FILA_S': round(inicio - enviado, 3),
+            'AUDITORIA_S': round(fim - inicio, 3),
+            'TOTAL_S': round(fim - detectado, 3),
+            'LINHAS': resumo['LINHAS'],
+            'DIFERENCA': round(resumo['DIFERENCA'], 2),
+            'SAIDA': resumo['SAIDA'],
+            'ERRO': resumo['ERRO']
+        })
+        AuditoriaLote._log(resumo)
+        return resumo
+    
+    def _anotar_latencia(self, registro: dict):
+        caminho = os.path.join(self.pasta_saida, 'latencia_monitor.csv')
+        novo = not os.path.exists(caminho)
+        with open(caminho, 'a', newline='', encoding='utf-8') as f:
+            escritor = csv.DictWriter(f, fieldnames=self.COLUNAS_LATENCIA, delimiter=';')
+            if novo:
+                escritor.writeheader()
+            escritor.writerow(registro)
+    
+    @staticmethod
+    def _destino_livre(caminho: str) -> str:
+        """caminho, ou com sufixo de data/hora se já existir (um relatório reenviado com o mesmo nome)."""
+        if not os.path.exists(caminho):
+            return caminho
+        if caminho.endswith('.csv.gz'):
+            base, extensao = caminho[:-len('.csv.gz')], '.csv.gz'
+        else:
+            base, extensao = os.path.splitext(caminho)
+        carimbo = time.strftime('%Y%m%d-%H%M%S')
+        candidato, n = f"{base}_{carimbo}{extensao}", 1
+        while os.path.exists(candidato):
+            n += 1
+            candidato = f"{base}_{carimbo}_{n}{extensao}"
+        return candidato
+
+def _expandir_relatorios(padroes: list) -> list:
+    """Expande curingas (o shell do Windows não faz isso) mantendo a ordem."""
+    arquivos = []
+    for padrao in padroes:
+        encontrados = sorted(glob.glob(padrao))
+        arquivos.extend(encontrados if encontrados else [padrao])
+    return arquivos
+
+def _historico_cli(args) -> Optional[HistoricoAuditoria]:
+    if not args.history:
+        return None
+    return HistoricoAuditoria(args.history, args.carrier, os.path.basename(args.lpu))
+
+def _cli_audit(args) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    LeitorArquivo.engine_excel = args.excel_engine
+    ProcessadorAuditoria.processos_abas = args.workers
+    relatorios = _expandir_relatorios(args.relatorios)
+    try:
+        ctx_lpu = ProcessadorAuditoria._carregar_lpu(args.lpu, not args.no_lpu_cache)
+    except Exception as e:
+        print(f"Erro ao carregar LPU: {e}", file=sys.stderr)
+        return 2
+    try:
+        colunas_extras = [c for c in (args.keep_columns or '').split(',') if c.strip()]
+        resumos = AuditoriaLote.executar(args.lpu, relatorios, args.out, args.workers,
+                                         args.chunk_size, colunas_extras, not args.no_lpu_cache,
+                                         args.format, args.profile, args.incremental, _historico_cli(args),
+                                         not args.no_summary, ctx_lpu)
+    except Exception as e:
+        # Falhas de um relatório já vêm no resumo dele; aqui é o lote (pasta de saída, resumo...)
+        print(f"Erro na auditoria: {e}", file=sys.stderr)
+        return 2
+    
+    falhas = [r for r in resumos if r['ERRO']]
+    ok = [r for r in resumos if not r['ERRO']]
+    print(f"\n{len(ok)} relatório(s) auditado(s), {len(falhas)} com erro.")
+    print(f"💰 Total Pago: {formatar_moeda(sum(r['TOTAL_PAGO'] for r in ok))}")
+    print(f"📋 Valor LPU: {formatar_moeda(sum(r['TOTAL_LPU'] for r in ok))}")
+    print(f"📊 Diferença: {formatar_moeda(sum(r['DIFERENCA'] for r in ok))}")
+    return 1 if falhas else 0
+
+def _cli_compare(args) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    LeitorArquivo.engine_excel = args.excel_engine
+    tabelas = _expandir_relatorios(args.lpu)
+    try:
+        colunas_extras = [c for c in (args.keep_columns or '').split(',') if c.strip()]
+        comparacao, ranking = ComparadorLPU.executar(tabelas, args.relatorio, args.workers,
+                                                     colunas_extras, not args.no_lpu_cache)
+        os.makedirs(args.out, exist_ok=True)
+        base = os.path.splitext(nome_relatorio(args.relatorio))[0]
+        ExportadorRelatorio.exportar(comparacao, os.path.join(args.out, f"{base}_comparacao.{args.format}"))
+        ExportadorRelatorio.exportar(ranking, os.path.join(args.out, "ranking_lpu.xlsx"))
+    except Exception as e:
+        print(f"Erro na comparação: {e}", file=sys.stderr)
+        return 2
+    
+    print(f"\nRanking de {len(ranking)} LPU(s) por custo total ({len(comparacao) - 1} CT-es):")
+    for r in ranking.itertuples():
+        print(f"{r.POSICAO:>3}. {r.TABELA}: {formatar_moeda(r.TOTAL_LPU)} "
+              f"(diferença para o pago: {formatar_moeda(r.DIFERENCA)})")
+    return 0
+
+def _cli_serve(args) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    LeitorArquivo.engine_excel = args.excel_engine
+    tabelas = _expandir_relatorios(args.lpu)
+    try:
+        servico = ServicoAuditoria(tabelas, args.workers, not args.no_lpu_cache, args.max_pending)
+        servico.servir(args.host, args.port)
+    except Exception as e:
+        print(f"Erro no serviço: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+def _cli_watch(args) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    LeitorArquivo.engine_excel = args.excel_engine
+    try:
+        colunas_extras = [c for c in (args.keep_columns or '').split(',') if c.strip()]
+        monitor = MonitorPasta(args.lpu, args.inbox, args.out, args.done, args.failed, args.workers,
+                               args.max_pending, args.format, colunas_extras, not args.no_lpu_cache,
+                               args.settle, _historico_cli(args))
+        monitor.registro.obter(next(iter(monitor.registro.caminhos)))  # Falha já na partida se a LPU não abrir
+        resumos = monitor.executar(args.once)
+    except Exception as e:
+        print(f"Erro no monitoramento: {e}", file=sys.stderr)
+        return 2
+    return 1 if any(r['ERRO'] for r in resumos) else 0
+
+def _cli_history(args) -> int:
+    historico = HistoricoAuditoria(args.db)
+    try:
+        if args.cte:
+            resultado = historico.buscar_cte(args.cte)
+        else:
+            filtros = {dimensao: valor for dimensao, valor in (
+                ('transportadora', args.carrier), ('status', args.status),
+                ('origem_uf', args.origin_uf), ('destino_uf', args.dest_uf)) if valor}
+            resultado = historico.consultar(args.by, getattr(args, 'from'), args.to, **filtros)
+        if args.out:
+            ExportadorRelatorio.exportar(resultado, args.out)
+    except Exception as e:
+        print(f"Erro na consulta: {e}", file=sys.stderr)
+        return 2
+    print(resultado.to_string(index=False) if len(resultado) else "Nenhum resultado.")
+    return 0
+
+def _cli_layout(args) -> int:
+    RegistroLayouts.caminho = args.file
+    if args.forget:
+        try:
+            removido = RegistroLayouts.esquecer(args.forget)
+        except OSError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        if not removido:
+            print(f"Layout {args.forget} não registrado", file=sys.stderr)
+            return 2
+        print(f"Layout {args.forget} removido")
+        return 0
+    
+    if not args.relatorio:
+        layouts = RegistroLayouts.carregar()
+        if not layouts:
+            print("Nenhum layout registrado.")
+            return 0
+        tabela = pd.DataFrame([{
+            'IMPRESSAO': chave,
+            'TRANSPORTADORA': layout['transportadora'] or '',
+            'FIXADO': 'sim' if layout['fixado'] else 'não',
+            'LINHA_CABECALHO': layout['cabecalho'] + 1,
+            'CAMPOS': len(layout['mapa']),
+            'ATUALIZADO_EM': layout['atualizado_em']
+        } for chave, layout in layouts.items()])
+        print(tabela.to_string(index=False))
+        return 0
+    
+    if LeitorCTe.aceita(args.relatorio):
+        print("XMLs de CT-e não têm layout de colunas", file=sys.stderr)
+        return 2
+    try:
+        sondagem = LeitorArquivo.sondar(args.relatorio, LINHAS_BUSCA_CABECALHO)
+    except Exception as e:
+        print(f"Erro ao ler o relatório: {e}", file=sys.stderr)
+        return 2
+    conhecido = RegistroLayouts.reconhecer(sondagem)
+    if args.header_row:
+        idx_header = args.header_row - 1
+        if not 0 <= idx_header < len(sondagem):
+            print(f"--header-row fora das {len(sondagem)} primeiras linhas", file=sys.stderr)
+            return 2
+        nomes = LeitorArquivo.nomes_colunas(sondagem.iloc[idx_header].values)
+        conhecido = conhecido if conhecido and conhecido[0] == idx_header else None
+        mapa = conhecido[2] if conhecido else DetectorEstrutura.detectar(nomes)
+    elif conhecido:
+        idx_header, nomes, mapa = conhecido
+    else:
+        idx_header = LeitorArquivo.encontrar_cabecalho(sondagem, PALAVRAS_CABECALHO)
+        nomes = LeitorArquivo.nomes_colunas(sondagem.iloc[idx_header].values) if len(sondagem) else []
+        mapa = DetectorEstrutura.detectar(nomes)
+    
+    chave = RegistroLayouts.impressao(idx_header, nomes)
+    if args.set or args.pin or args.carrier or args.header_row:
+        for item in args.set or []:
+            campo, _, coluna = item.partition('=')
+            campo, coluna = campo.strip().lower(), coluna.strip().upper()
+            if campo not in DetectorEstrutura.CAMPOS:
+                print(f"Campo desconhecido: {campo} (use {', '.join(DetectorEstrutura.CAMPOS)})", file=sys.stderr)
+                return 2
+            if coluna:
+                mapa[campo] = coluna
+            else:
+                mapa.pop(campo, None)
+        try:
+            RegistroLayouts.fixar(idx_header, nomes, mapa, args.carrier)
+        except (ValueError, OSError) as e:
+            print(str(e), file=sys.stderr)
+            return 2
+    
+    layout = RegistroLayouts.carregar().get(chave)
+    if layout is None:
+        situacao = "novo"
+    elif layout['fixado']:
+        situacao = "fixado" + (f", {layout['transportadora']}" if layout['transportadora'] else "")
+    else:
+        situacao = "aprendido"
+    print(f"Layout {chave} ({situacao}) - cabeçalho na linha {idx_header + 1}")
+    for campo in DetectorEstrutura.CAMPOS:
+        print(f"  {campo:<16}{mapa.get(campo, '-')}")
+    outras = [n for n in nomes if n not in mapa.values()]
+    if outras:
+        print(f"Outras colunas: {', '.join(outras)}")
+    return 0
+
+def criar_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Auditoria de Frete (LPU vs CT-e). Sem argumentos abre a interface gráfica.")
+    sub = parser.add_subparsers(dest="comando")
+    
+    audit = sub.add_parser("audit", help="Audita vários relatórios contra uma LPU, sem interface gráfica")
+    audit.add_argument("--lpu", required=True, help="Tabela LPU (xlsx/xls/csv)")
+    audit.add_argument("relatorios", nargs="+",
+                       help="Relatórios de frete: planilhas, XMLs de CT-e, zips ou pastas de XMLs (aceita curingas)")
+    audit.add_argument("--out", required=True, help="Pasta de saída dos resultados")
+    audit.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos em paralelo")
+    audit.add_argument("--chunk-size", type=int, default=None,
+                       help="Processa em blocos de N linhas com memória limitada (saída em CSV)")
+    audit.add_argument("--keep-columns", default=None,
+                       help="Colunas extras do relatório a manter no resultado, separadas por vírgula (ex.: CTE,EMISSAO)")
+    audit.add_argument("--format", choices=list(ExportadorRelatorio.FORMATOS), default="xlsx",
+                       help="Formato dos resultados (parquet requer pyarrow)")
+    audit.add_argument("--no-lpu-cache", action="store_true",
+                       help="Ignora o cache em disco da LPU compilada e relê a planilha")
+    audit.add_argument("--incremental", action="store_true",
+                       help="Reaproveita a última auditoria de cada relatório: só audita linhas novas/alteradas "
+                            "ou afetadas por mudança de preço na LPU (não vale com --chunk-size)")
+    audit.add_argument("--history", nargs="?", const=CAMINHO_HISTORICO, default=None, metavar="BANCO",
+                       help="Grava as linhas auditadas no histórico SQLite (sem BANCO, usa o padrão)")
+    audit.add_argument("--carrier", default=None,
+                       help="Transportadora gravada no histórico quando o relatório não tem essa coluna")
+    audit.add_argument("--no-summary", action="store_true",
+                       help="Não gera o resumo gerencial (abas por UF, coluna LPU, STATUS, faixa de peso "
+                            f"e os {TOP_N_DIVERGENCIAS} CT-es mais cobrados acima da LPU)")
+    audit.add_argument("--profile", default=None, metavar="PASTA",
+                       help="Grava nessa pasta o cProfile (.prof) e as métricas por etapa (.json) de cada relatório")
+    audit.add_argument("--excel-engine", choices=["openpyxl", "calamine"], default="openpyxl",
+                       help="Leitor de planilhas Excel (calamine é mais rápido; requer python-calamine)")
+    audit.set_defaults(func=_cli_audit)
+    
+    compare = sub.add_parser("compare", help="Simula um relatório contra várias LPUs candidatas e ordena pelo custo")
+    compare.add_argument("--lpu", required=True, nargs="+", help="Tabelas LPU candidatas (aceita curingas)")
+    compare.add_argument("relatorio", help="Relatório de frete (histórico de CT-es)")
+    compare.add_argument("--out", required=True, help="Pasta de saída da comparação")
+    compare.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos em paralelo")
+    compare.add_argument("--keep-columns", default=None,
+                         help="Colunas extras do relatório a manter no resultado, separadas por vírgula")
+    compare.add_argument("--format", choices=list(ExportadorRelatorio.FORMATOS), default="xlsx",
+                         help="Formato da comparação linha a linha (parquet requer pyarrow)")
+    compare.add_argument("--no-lpu-cache", action="store_true",
+                         help="Ignora o cache em disco das LPUs compiladas e relê as planilhas")
+    compare.add_argument("--excel-engine", choices=["openpyxl", "calamine"], default="openpyxl",
+                         help="Leitor de planilhas Excel (calamine é mais rápido; requer python-calamine)")
+    compare.set_defaults(func=_cli_compare)
+    
+    serve = sub.add_parser("serve", help="Serviço local (HTTP) que mantém as LPUs em memória e audita relatórios enviados")
+    serve.add_argument("--lpu", required=True, nargs="+", help="Tabelas LPU atendidas (aceita curingas)")
+    serve.add_argument("--host", default="127.0.0.1", help="Endereço de escuta (padrão: só esta máquina)")
+    serve.add_argument("--port", type=int, default=PORTA_SERVICO, help="Porta HTTP")
+    serve.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos de auditoria")
+    serve.add_argument("--max-pending", type=int, default=None,
+                       help="Auditorias aceitas ao mesmo tempo, contando as na fila (padrão: 2x workers); "
+                            "acima disso responde 503")
+    serve.add_argument("--no-lpu-cache", action="store_true",
+                       help="Ignora o cache em disco das LPUs compiladas e relê as planilhas")
+    serve.add_argument("--excel-engine", choices=["openpyxl", "calamine"], default="openpyxl",
+                       help="Leitor de planilhas Excel (calamine é mais rápido; requer python-calamine)")
+    serve.set_defaults(func=_cli_serve)
+    
+    watch = sub.add_parser("watch", help="Monitora uma pasta de entrada e audita cada relatório que chegar")
+    watch.add_argument("--lpu", required=True, help="Tabela LPU (recarregada quando o arquivo muda)")
+    watch.add_argument("--inbox", required=True, help="Pasta onde as transportadoras deixam os relatórios")
+    watch.add_argument("--out", required=True, help="Pasta dos resultados e do latencia_monitor.csv")
+    watch.add_argument("--done", default=None, help="Para onde vão os relatórios auditados (padrão: <inbox>/processados)")
+    watch.add_argument("--failed", default=None, help="Para onde vão os relatórios com erro (padrão: <inbox>/falhas)")
+    watch.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processos em paralelo")
+    watch.add_argument("--max-pending", type=int, default=None,
+                       help="Relatórios em auditoria ao mesmo tempo (padrão: 2x workers); o resto espera na pasta")
+    watch.add_argument("--settle", type=float, default=ESPERA_ARQUIVO_ESTAVEL_S, metavar="SEGUNDOS",
+                       help="Tempo sem mudar de tamanho para considerar a cópia do arquivo terminada")
+    watch.add_argument("--once", action="store_true", help="Audita o que já está na pasta e sai")
+    watch.add_argument("--history", nargs="?", const=CAMINHO_HISTORICO, default=None, metavar="BANCO",
+                       help="Grava as linhas auditadas no histórico SQLite (sem BANCO, usa o padrão)")
+    watch.add_argument("--carrier", default=None,
+                       help="Transportadora gravada no histórico quando o relatório não tem essa coluna")
+    watch.add_argument("--keep-columns", default=None,
+                       help="Colunas extras do relatório a manter no resultado, separadas por vírgula")
+    watch.add_argument("--format", choices=list(ExportadorRelatorio.FORMATOS), default="xlsx",
+                       help="Formato dos resultados (parquet requer pyarrow)")
+    watch.add_argument("--no-lpu-cache", action="store_true",
+                       help="Ignora o cache em disco da LPU compilada e relê a planilha")
+    watch.add_argument("--excel-engine", choices=["openpyxl", "calamine"], default="openpyxl",
+                       help="Leitor de planilhas Excel (calamine é mais rápido; requer python-calamine)")
+    watch.set_defaults(func=_cli_watch)
+    
+    history = sub.add_parser("history", help="Consulta o histórico de auditorias (totais por mês, transportadora, rota...)")
+    history.add_argument("--db", default=CAMINHO_HISTORICO, help="Banco do histórico")
+    history.add_argument("--by", nargs="*", default=["mes"], choices=list(HistoricoAuditoria.DIMENSOES),
+                         help="Dimensões do agrupamento (padrão: mes; sem nenhuma, o total geral)")
+    history.add_argument("--from", default=None, metavar="AAAA-MM[-DD]", help="Início do período (inclusivo)")
+    history.add_argument("--to", default=None, metavar="AAAA-MM[-DD]", help="Fim do período (inclusivo)")
+    history.add_argument("--carrier", default=None, help="Só esta transportadora")
+    history.add_argument("--status", default=None, help="Só este STATUS (ex.: DIVERGENCIA_CRITICA)")
+    history.add_argument("--origin-uf", default=None, help="Só esta UF de origem")
+    history.add_argument("--dest-uf", default=None, help="Só esta UF de destino")
+    history.add_argument("--cte", default=None, help="Lista as auditorias de um CT-e em vez de totais")
+    history.add_argument("--out", default=None, help="Também grava o resultado (xlsx, csv.gz ou parquet)")
+    history.set_defaults(func=_cli_history)
+    
+    layout = sub.add_parser("layout", help="Mostra, corrige (fixa) ou esquece o mapeamento de colunas de um layout")
+    layout.add_argument("relatorio", nargs="?", default=None,
+                        help="Relatório com o layout (sem relatório, lista os layouts registrados)")
+    layout.add_argument("--set", nargs="+", default=None, metavar="CAMPO=COLUNA",
+                        help="Corrige o mapeamento e fixa o layout (CAMPO= remove o campo)")
+    layout.add_argument("--header-row", type=int, default=None,
+                        help="Linha do cabeçalho (a partir de 1), quando a detecção errar")
+    layout.add_argument("--carrier", default=None, help="Transportadora do layout (só informativo)")
+    layout.add_argument("--pin", action="store_true", help="Fixa o mapeamento atual sem alterá-lo")
+    layout.add_argument("--forget", default=None, metavar="IMPRESSAO", help="Remove um layout do registro")
+    layout.add_argument("--file", default=CAMINHO_LAYOUTS, help="Arquivo do registro de layouts")
+    layout.set_defaults(func=_cli_layout)
+    
+    return parser
 
 # ================================================================
 # INTERFACE GRÁFICA
 # ================================================================
 
 class AuditoriaFreteGUI:
+    NOMES_ETAPAS = {
+        'carregar_lpu': "Carregando LPU",
+        'deteccao_cabecalho': "Localizando cabeçalho",
+        'deteccao_estrutura': "Detectando colunas",
+        'carregar_relatorio': "Carregando relatório",
+        'conversao': "Convertendo valores",
+        'auditoria': "Auditando",
+        'abas': "Auditando as abas",
+        'mesclar_abas': "Juntando as abas",
+        'totais': "Calculando totais",
+        'formatacao': "Formatando relatório"
+    }
+    
     def __init__(self, root):
         self.root = root
         self.root.title("Auditoria de Frete v3.0")
-        self.root.geometry("750x650")
+        self.root.geometry("750x700")
         
         self.lpu_path = tk.StringVar()
         self.rel_path = tk.StringVar()
+        self.incremental = tk.BooleanVar(value=False)
         self.resultado = None
         
+        # Eventos da thread de auditoria, lidos no loop do Tk (ver _ler_fila)
+        self.fila = queue.Queue()
+        self.cancelamento = None
+        self.inicio_etapa = 0.0
+        
         self._criar_interface()
     
     def _criar_interface(self):
@@ -711,10 +4366,20 @@ class AuditoriaFreteGUI:
         rel_frame.pack(fill=tk.X, pady=5)
         ttk.Entry(rel_frame, textvariable=self.rel_path, state="readonly", width=65).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(rel_frame, text="📁 Selecionar", command=self._selecionar_rel).pack(side=tk.LEFT)
+        ttk.Checkbutton(main, text="Reaproveitar a auditoria anterior deste relatório (só audita linhas alteradas)",
+                        variable=self.incremental).pack(anchor="w", pady=(5, 0))
         
         # Botão processar
         self.btn_processar = tk.Button(main, text="⚙️ AUDITAR", font=("Arial", 13, "bold"), bg="#2563eb", fg="white", pady=12, command=self._processar)
-        self.btn_processar.pack(fill=tk.X, pady=15)
+        self.btn_processar.pack(fill=tk.X, pady=(15, 5))
+        
+        # Progresso e cancelamento
+        prog_frame = ttk.Frame(main)
+        prog_frame.pack(fill=tk.X, pady=(0, 10))
+        self.barra_progresso = ttk.Progressbar(prog_frame, mode="determinate", maximum=100)
+        self.barra_progresso.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+        self.btn_cancelar = tk.Button(prog_frame, text="✖ Cancelar", font=("Arial", 10, "bold"), bg="#dc2626", fg="white", state=tk.DISABLED, command=self._cancelar)
+        self.btn_cancelar.pack(side=tk.LEFT)
         
         # Resultados
         result_frame = ttk.LabelFrame(main, text="📊 Resultados", padding="15")
@@ -744,7 +4409,8 @@ class AuditoriaFreteGUI:
             self.status.config(text=f"✓ LPU: {os.path.basename(f)}", fg="green")
     
     def _selecionar_rel(self):
-        f = filedialog.askopenfilename(filetypes=[("Excel/CSV", "*.xlsx *.xls *.csv")])
+        f = filedialog.askopenfilename(filetypes=[("Excel/CSV", "*.xlsx *.xls *.csv"),
+                                                  ("CT-e (XML/zip)", "*.xml *.zip")])
         if f:
             self.rel_path.set(f)
             self.status.config(text=f"✓ Relatório: {os.path.basename(f)}", fg="green")
@@ -754,21 +4420,103 @@ class AuditoriaFreteGUI:
             messagebox.showwarning("Atenção", "Selecione os dois arquivos!")
             return
         
+        self.resultado = None
+        self.btn_download.config(state=tk.DISABLED)
         self.btn_processar.config(state=tk.DISABLED, text="⏳ Processando...")
+        self.btn_cancelar.config(state=tk.NORMAL)
         self.status.config(text="⏳ Processando...", fg="#ea580c")
-        threading.Thread(target=self._processar_thread, daemon=True).start()
+        
+        self.cancelamento = threading.Event()
+        threading.Thread(target=self._processar_thread, daemon=True,
+                         args=(self.lpu_path.get(), self.rel_path.get(), self.cancelamento,
+                               self.incremental.get())).start()
+        self.root.after(INTERVALO_FILA_GUI_MS, self._ler_fila)
     
-    def _processar_thread(self):
+    def _processar_thread(self, caminho_lpu: str, caminho_relatorio: str, cancelamento: threading.Event,
+                          incremental: bool = False):
+        """Roda fora do loop do Tk: só se comunica com a interface pela fila."""
         try:
             resultado = ProcessadorAuditoria.processar(
-                self.lpu_path.get(),
-                self.rel_path.get()
+                caminho_lpu,
+                caminho_relatorio,
+                ganchos=[self.fila.put],
+                pasta_perfil=os.environ.get('AUDITORIA_PERFIL'),
+                cancelamento=cancelamento,
+                incremental=incremental
             )
-            self.resultado = resultado
-            self.root.after(0, self._atualizar_resultados)
+            self.fila.put({'tipo': 'concluido', 'resultado': resultado})
+        except AuditoriaCancelada:
+            self.fila.put({'tipo': 'cancelado'})
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Erro", str(e)))
-            self.root.after(0, self._reset_botao)
+            self.fila.put({'tipo': 'erro', 'mensagem': str(e)})
+    
+    def _ler_fila(self):
+        """Aplica os eventos pendentes da auditoria; reagenda até o evento final."""
+        try:
+            while True:
+                if not self._tratar_evento(self.fila.get_nowait()):
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(INTERVALO_FILA_GUI_MS, self._ler_fila)
+    
+    def _tratar_evento(self, evento: dict) -> bool:
+        """Atualiza a tela com um evento; False quando a auditoria terminou."""
+        tipo = evento['tipo']
+        
+        if tipo == 'inicio':
+            self.inicio_etapa = time.perf_counter()
+            nome = self.NOMES_ETAPAS.get(evento['etapa'], evento['etapa'])
+            if not self.cancelamento.is_set():
+                self.status.config(text=f"⏳ {nome}...", fg="#ea580c")
+            if evento['etapa'] != 'auditoria':
+                self.barra_progresso.config(mode="indeterminate")
+                self.barra_progresso.start(15)
+        
+        elif tipo == 'progresso' and evento['total']:
+            feitas, total = evento['feitas'], evento['total']
+            decorrido = time.perf_counter() - self.inicio_etapa
+            restante = decorrido / feitas * (total - feitas) if feitas else 0.0
+            self.barra_progresso.stop()
+            self.barra_progresso.config(mode="determinate", value=100 * feitas / total)
+            if not self.cancelamento.is_set():
+                self.status.config(text=f"⏳ Auditando: {feitas:,} de {total:,} linhas "
+                                        f"(~{restante:.0f}s restantes)".replace(',', '.'), fg="#ea580c")
+        
+        elif tipo == 'concluido':
+            self.resultado = evento['resultado']
+            self._fim_processamento(100)
+            self._atualizar_resultados()
+            return False
+        
+        elif tipo == 'cancelado':
+            self._fim_processamento(0)
+            self.status.config(text="✖ Auditoria cancelada", fg="#dc2626")
+            return False
+        
+        elif tipo == 'erro':
+            self._fim_processamento(0)
+            self.status.config(text="❌ Erro na auditoria", fg="#dc2626")
+            messagebox.showerror("Erro", evento['mensagem'])
+            return False
+        
+        return True
+    
+    def _cancelar(self):
+        if self.cancelamento is not None:
+            self.cancelamento.set()
+            self.btn_cancelar.config(state=tk.DISABLED)
+            self.status.config(text="⏳ Cancelando...", fg="#dc2626")
+    
+    def _fim_processamento(self, progresso: int):
+        self.barra_progresso.stop()
+        self.barra_progresso.config(mode="determinate", value=progresso)
+        self.btn_cancelar.config(state=tk.DISABLED)
+        self.cancelamento = None
+        self._reset_botao()
+        # Devolve ao sistema a memória da auditoria interrompida ou falha
+        if self.resultado is None:
+            gc.collect()
     
     def _atualizar_resultados(self):
         _, pago, devido, diff = self.resultado
@@ -787,16 +4535,17 @@ class AuditoriaFreteGUI:
         
         self.btn_download.config(state=tk.NORMAL)
         self.status.config(text="✅ Concluído!", fg="green")
-        self._reset_botao()
     
     def _reset_botao(self):
         self.btn_processar.config(state=tk.NORMAL, text="⚙️ AUDITAR")
     
     def _baixar(self):
         f = filedialog.asksaveasfilename(defaultextension=".xlsx",
-                                        filetypes=[("Excel", "*.xlsx")])
+                                        filetypes=[("Excel", "*.xlsx"),
+                                                   ("CSV compactado", "*.csv.gz"),
+                                                   ("Parquet", "*.parquet")])
         if f:
-            self.resultado[0].to_excel(f, index=False, engine='openpyxl')
+            ExportadorRelatorio.exportar(self.resultado[0], f)
             messagebox.showinfo("Sucesso", "Relatório salvo com sucesso!")
             try:
                 os.startfile(os.path.dirname(f))
@@ -806,7 +4555,28 @@ class AuditoriaFreteGUI:
 # ================================================================
 # MAIN
 # ================================================================
-if __name__ == "__main__":
+def main(argv=None) -> int:
+    args = criar_parser().parse_args(argv)
+    if args.comando:
+        return args.func(args)
+    
+    # Na interface as abas de uma planilha e os XMLs de CT-e são lidos em
+    # sequência: o pool de processos ainda não foi validado no executável empacotado
+    ProcessadorAuditoria.processos_abas = 1
+    LeitorCTe.processos = 1
+    
+    _importar_tkinter()
     root = tk.Tk()
     app = AuditoriaFreteGUI(root)
-    root.mainloop()
\ No newline at end of file
+    
+    # pandas/numpy carregam enquanto o usuário escolhe os arquivos
+    threading.Thread(target=precarregar_dependencias, daemon=True).start()
+    root.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    # No executável (PyInstaller) cada processo filho do pool roda este
+    # arquivo de novo: sem isso, abre outra janela em vez de rodar a tarefa
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
\ No newline at end of file
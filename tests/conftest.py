@@ -0,0 +1,65 @@
+"""
+Fixtures dos testes: LPU e relatórios pequenos gerados em tmp_path, com o
+registro de layouts e o cache das auditorias isolados do usuário.
+"""
+import functools
+
+import pandas as pd
+import pytest
+
+import main
+
+COLUNAS_LPU = ["PESO (KG)", "SP CAPITAL", "RIO DE JANEIRO", "CURITIBA", "CAMPINAS", "REDESPACHO INTERIOR"]
+COLUNAS_RELATORIO = ["CTE", "REMETENTE", "CIDADE ORIGEM", "UF ORIGEM", "DESTINATARIO", "CIDADE DESTINO",
+                     "UF DESTINO", "PESO REAL", "PESO CUBADO", "PESO TAXADO", "FRETE TOTAL"]
+
+
+def gravar_lpu(caminho, reajuste: dict = None):
+    """
+    LPU com título, preços de 1 a 30 kg (parte em texto "R$ 1.234,56") e a
+    linha de kg adicional. reajuste multiplica os preços de algumas colunas.
+    """
+    reajuste = reajuste or {}
+    linhas = [["TABELA LPU TESTE"] + [None] * (len(COLUNAS_LPU) - 1), [None] * len(COLUNAS_LPU), COLUNAS_LPU]
+    for peso in range(1, 31):
+        linha = [peso]
+        for j, coluna in enumerate(COLUNAS_LPU[1:], 1):
+            preco = round((10 + peso * 1.5 * j) * reajuste.get(coluna, 1.0), 2)
+            linha.append(f"R$ {preco:.2f}".replace('.', ',') if j % 2 else preco)
+        linhas.append(linha)
+    linhas.append(["KG ADICIONAL"] + [f"{0.5 * j:.2f}".replace('.', ',') for j in range(1, len(COLUNAS_LPU))])
+    pd.DataFrame(linhas).to_excel(caminho, header=False, index=False)
+    return str(caminho)
+
+
+def gravar_relatorio(caminho, linhas: list):
+    """
+    Relatório CSV (;) no layout das transportadoras, com uma linha de título
+    antes do cabeçalho. Cada linha: CT-e, cidade e UF de origem, cidade e UF
+    de destino, pesos real, cubado e taxado e frete.
+    """
+    titulo = ["RELATORIO TRANSPORTADORA"] + [""] * (len(COLUNAS_RELATORIO) - 1)
+    corpo = [[cte, "REM", oc, ou, "DEST", dc, du] + resto for cte, oc, ou, dc, du, *resto in linhas]
+    pd.DataFrame([titulo, COLUNAS_RELATORIO] + corpo).to_csv(caminho, sep=';', header=False, index=False)
+    return str(caminho)
+
+
+@pytest.fixture(autouse=True)
+def caches_isolados(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.RegistroLayouts, 'caminho', str(tmp_path / 'layouts.json'))
+    monkeypatch.setattr(main.RegistroLayouts, '_layouts', {})
+    monkeypatch.setattr(main.RegistroLayouts, '_assinatura', None)
+    pasta = str(tmp_path / 'auditorias')
+    for nome in ('carregar', 'salvar'):
+        original = getattr(main.CacheAuditoria, nome)
+        monkeypatch.setattr(main.CacheAuditoria, nome, staticmethod(functools.partial(original, pasta=pasta)))
+
+
+@pytest.fixture
+def caminho_lpu(tmp_path):
+    return gravar_lpu(tmp_path / 'lpu.xlsx')
+
+
+@pytest.fixture
+def ctx(caminho_lpu):
+    return main.ProcessadorAuditoria._carregar_lpu(caminho_lpu, usar_cache=False)
@@ -0,0 +1,103 @@
+"""
+Auditoria de referência (oráculo dos testes e do benchmark).
+
+É o auditar_linha da versão original: lê a LPU da planilha e busca cada
+preço com df.loc + safe_float, e a coluna de cada cidade varrendo as
+colunas da LPU. Não usa ContextoLPU.tabela, ContextoLPU.preco nem
+IndiceCidades, então um erro neles não passa como "idêntico".
+"""
+import numpy as np
+import pandas as pd
+
+from main import (
+    AuditorFrete, LeitorArquivo, HUB_CENTRAL, MAPA_UF_CAPITAL, PESO_MAXIMO_TABELA, limpar_texto, safe_float
+)
+
+COLUNAS_AUDITORIA = ['PESO_CORRETO', 'PESO_COBRADO', 'VALOR_LPU', 'DIFERENCA', 'STATUS', 'SUGESTAO']
+
+
+def carregar_lpu(caminho: str) -> tuple:
+    """Planilha LPU como na versão original: (df indexado por peso, kg_adicional, col_redespacho)."""
+    df = LeitorArquivo.carregar(caminho)
+    
+    # Encontra linha com "PESO"
+    idx_peso = 0
+    for i in range(min(20, len(df))):
+        if "PESO" in str(df.iloc[i, 0]).upper():
+            idx_peso = i
+            break
+    
+    df = df.iloc[idx_peso:].reset_index(drop=True)
+    df.columns = df.iloc[0]
+    df = df.iloc[1:]
+    df = LeitorArquivo.deduplica_colunas(df)
+    
+    col_peso = next((c for c in df.columns if 'PESO' in c and 'DUP' not in c), df.columns[0])
+    df = df.set_index(col_peso)
+    df.index = pd.to_numeric(df.index, errors='coerce')
+    df = df.dropna(how='all')
+    
+    kg_adicional = {c: safe_float(df.iloc[-1][c]) for c in df.columns}
+    col_red = next((c for c in df.columns[::-1] if "REDESPACHO" in c or "INTERIOR" in c),
+                   df.columns[-1])
+    return df, kg_adicional, col_red
+
+
+class AuditorReferencia(AuditorFrete):
+    """AuditorFrete.auditar_linha com a busca de preço e de coluna da versão original."""
+    
+    def __init__(self, caminho_lpu: str, colunas_detectadas: dict):
+        self.df, self.kg_adicional, self.col_redespacho = carregar_lpu(caminho_lpu)
+        self.colunas = list(self.df.columns)
+        self.colunas_detectadas = colunas_detectadas
+    
+    def auditar(self, df: pd.DataFrame) -> pd.DataFrame:
+        """auditar_linha em cada linha, com as colunas do AuditorFrete."""
+        resultado = df.apply(self.auditar_linha, axis=1)
+        resultado.columns = COLUNAS_AUDITORIA
+        return resultado
+    
+    def _calcular_valor_rota(self, orig_cid, orig_uf, dest_cid, dest_uf, peso):
+        custo = 0.0
+        for cidade, uf in ((orig_cid, orig_uf), (dest_cid, dest_uf)):
+            if cidade and cidade not in HUB_CENTRAL:
+                col, eh_interior = self._encontrar_coluna_destino(cidade, uf)
+                if col:
+                    custo += self._calcular_valor(peso, col)
+                    if eh_interior:
+                        custo += self._calcular_valor(peso, self.col_redespacho)
+        
+        # Se ambos são hub (SP local)
+        if custo == 0:
+            col_sp = next((c for c in self.colunas if "SP" in c and "CAPITAL" in c), self.colunas[0])
+            custo = self._calcular_valor(peso, col_sp)
+        return custo
+    
+    def _encontrar_coluna_destino(self, cidade, uf):
+        cidade_limpa = limpar_texto(cidade)
+        for col in self.colunas:
+            if cidade_limpa in limpar_texto(col):
+                return (col, False)
+        
+        capital = MAPA_UF_CAPITAL.get(uf)
+        if capital:
+            for col in self.colunas:
+                if capital in limpar_texto(col):
+                    return (col, True)
+        
+        return (self.col_redespacho, False)
+    
+    def _calcular_valor(self, peso, coluna):
+        if not coluna:
+            return 0.0
+        
+        p_int = max(1, int(np.ceil(peso)))
+        p_tab = min(p_int, PESO_MAXIMO_TABELA)
+        
+        base = 0.0
+        if p_tab in self.df.index:
+            base = safe_float(self.df.loc[p_tab, coluna])
+        
+        if p_int > PESO_MAXIMO_TABELA:
+            return base + (p_int - PESO_MAXIMO_TABELA) * self.kg_adicional.get(coluna, 0.0)
+        return base
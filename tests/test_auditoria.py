@@ -0,0 +1,81 @@
+import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+from main import IndiceCidades, LeitorArquivo, ProcessadorAuditoria, converter_numeros, safe_float
+from tests.conftest import gravar_relatorio
+from tests.referencia import AuditorReferencia, COLUNAS_AUDITORIA
+
+# CTE, origem, UF, destino, UF, peso real, cubado, taxado, frete
+LINHAS_BORDA = [
+    [1, "SAO PAULO", "SP", "BARUERI", "SP", 10, 12, 12, 50],           # hub -> hub: SP local
+    [2, "BARUERI", "SP", "RIO DE JANEIRO", "RJ", 5, 0, 5, 80],         # hub -> capital
+    [3, "SAO PAULO", "SP", "NITEROI", "RJ", 7.5, 3, 8, 200],           # hub -> interior: capital + redespacho
+    [4, "LONDRINA", "PR", "SAO PAULO", "SP", 20, 18, 20, 120],         # interior -> hub
+    [5, "LONDRINA", "PR", "CURITIBA", "PR", 2, 2, 2, 60],              # interior -> capital
+    [6, "BARUERI", "SP", "CAMPINAS", "SP", 3, 0, 3, "R$ 45,00"],       # polo com coluna própria
+    [7, "SAO PAULO", "SP", "MANAUS", "AM", 4, 4, 4, 90],               # sem coluna nem capital: redespacho
+    [8, "SAO PAULO", "SP", "CURITIBA", "PR", 45, 50, 50, 300],         # acima de 30 kg: kg adicional
+    [9, "são paulo", "sp", "Curitíba", "pr", "1.234,5", "", "abc", ""],  # texto, acento, minúsculas
+    [10, "", "", "", "", 0, 0, 0, 10],                                  # sem cidades
+    [11, "SOROCABA", "SP", "SAO PAULO", "SP", "12,5", 0, 13, "R$ 1.234,56"],
+]
+
+
+def auditar_referencia(caminho_lpu, caminho):
+    """Auditoria linha a linha sobre o relatório como lido."""
+    idx_header, nomes, colunas_detectadas, posicoes = ProcessadorAuditoria._estrutura_relatorio(caminho)
+    bruto = LeitorArquivo.carregar_dados(caminho, idx_header, posicoes)
+    bruto.columns = [nomes[i] for i in posicoes]
+    return AuditorReferencia(caminho_lpu, colunas_detectadas).auditar(bruto.reset_index(drop=True))
+
+
+def test_auditar_lote_igual_a_referencia(tmp_path, caminho_lpu, ctx):
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS_BORDA)
+    styled = ProcessadorAuditoria.processar_relatorio(ctx, caminho)[0]
+    obtido = styled.data[COLUNAS_AUDITORIA].iloc[:-1].reset_index(drop=True)  # Sem a linha de total
+    pd.testing.assert_frame_equal(obtido.astype(object), auditar_referencia(caminho_lpu, caminho).astype(object),
+                                  check_dtype=False)
+
+
+def test_rota_interior_para_hub_soma_capital_e_redespacho(tmp_path, ctx):
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', [LINHAS_BORDA[3]])
+    valor = ProcessadorAuditoria.processar_relatorio(ctx, caminho)[0].data['VALOR_LPU'].iloc[0]
+    curitiba, redespacho = ctx.indice_colunas['CURITIBA'], ctx.indice_colunas['REDESPACHO INTERIOR']
+    assert valor == pytest.approx(ctx.tabela[20, curitiba] + ctx.tabela[20, redespacho])
+
+
+def test_converter_numeros_igual_a_safe_float():
+    valores = ["R$ 1.234,56", "1234,56", "12.5", " 7 ", "", None, np.nan, "abc", 3, 2.5, True,
+               Decimal("7.25"), datetime.datetime(2025, 1, 31), "1e3"]
+    numeros, falhas = converter_numeros(pd.Series(valores, dtype=object))
+    assert numeros.tolist() == [safe_float(v) for v in valores]
+    assert np.flatnonzero(falhas).tolist() == [7, 12]  # "abc" e a data
+
+
+def test_converter_numeros_coluna_numerica():
+    numeros, falhas = converter_numeros(pd.Series([1.5, np.nan, 3]))
+    assert numeros.tolist() == [1.5, 0.0, 3.0]
+    assert not falhas.any()
+
+
+def test_indice_cidades_resolve_capital_interior_e_redespacho(ctx):
+    indice = ctx.indice_cidades
+    assert indice.resolver("CURITIBA", "PR") == ("CURITIBA", False)
+    assert indice.resolver("LONDRINA", "PR") == ("CURITIBA", True)
+    assert indice.resolver("MANAUS", "AM") == ("REDESPACHO INTERIOR", False)
+    assert indice.eh_redespacho("MANAUS", "AM") and not indice.eh_redespacho("LONDRINA", "PR")
+    assert indice.col_sp == "SP CAPITAL"
+
+
+def test_indice_cidades_cache_limitado(ctx, monkeypatch):
+    monkeypatch.setattr(main, 'TAMANHO_CACHE_LOCALIZACAO', 3)
+    indice = IndiceCidades(list(ctx.indice_colunas), ctx.col_redespacho)
+    for i in range(10):
+        indice.resolver(f"CIDADE {i}", "PR")
+    assert list(indice._cache) == [(f"CIDADE {i}", "PR") for i in (7, 8, 9)]
+    assert indice.resolver("CIDADE 0", "PR") == ("CURITIBA", True)
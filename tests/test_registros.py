@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+import main
+from main import HistoricoAuditoria, LeitorArquivo, MetricasAuditoria, ProcessadorAuditoria, RegistroLayouts
+from tests.conftest import COLUNAS_RELATORIO, gravar_lpu, gravar_relatorio
+from tests.referencia import COLUNAS_AUDITORIA
+
+LINHAS = [
+    [1, "BARUERI", "SP", "RIO DE JANEIRO", "RJ", 5, 0, 5, 80],
+    [2, "SAO PAULO", "SP", "CURITIBA", "PR", 12, 10, 12, 150],
+    [3, "LONDRINA", "PR", "SAO PAULO", "SP", 20, 18, 20, 120],
+    [4, "BARUERI", "SP", "CAMPINAS", "SP", 3, 0, 3, 45],
+    [5, "SAO PAULO", "SP", "MANAUS", "AM", 4, 4, 4, 90],
+]
+
+
+def auditar(ctx, caminho, **opcoes):
+    metricas = MetricasAuditoria()
+    styled = ProcessadorAuditoria.processar_relatorio(ctx, caminho, metricas=metricas, **opcoes)[0]
+    return styled.data[COLUNAS_AUDITORIA].iloc[:-1], metricas.contadores
+
+
+def test_cache_auditoria_recalcula_so_linhas_com_preco_alterado(tmp_path, ctx):
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS)
+    auditar(ctx, caminho, incremental=True)
+    _, contadores = auditar(ctx, caminho, incremental=True)
+    assert (contadores['linhas_reaproveitadas'], contadores['linhas_recalculadas']) == (5, 0)
+
+    # Reajuste só de CURITIBA: linhas 2 (destino) e 3 (origem interior do PR)
+    ctx_nova = ProcessadorAuditoria._carregar_lpu(
+        gravar_lpu(tmp_path / 'lpu_reajustada.xlsx', {"CURITIBA": 1.1}), usar_cache=False)
+    resultado, contadores = auditar(ctx_nova, caminho, incremental=True)
+    assert (contadores['linhas_reaproveitadas'], contadores['linhas_recalculadas']) == (3, 2)
+    pd.testing.assert_frame_equal(resultado.astype(object), auditar(ctx_nova, caminho)[0].astype(object))
+
+
+def test_cache_auditoria_separa_relatorios_de_mesmo_nome(tmp_path, ctx):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    auditar(ctx, gravar_relatorio(tmp_path / 'a' / 'relatorio.csv', LINHAS), incremental=True)
+    _, contadores = auditar(ctx, gravar_relatorio(tmp_path / 'b' / 'relatorio.csv', LINHAS), incremental=True)
+    assert contadores['linhas_recalculadas'] == len(LINHAS)
+
+
+def test_historico_substitui_relatorio_reauditado(tmp_path, ctx):
+    historico = HistoricoAuditoria(str(tmp_path / 'historico.sqlite'))
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS)
+    totais = []
+    for _ in range(2):
+        devido = ProcessadorAuditoria.processar_relatorio(ctx, caminho, historico=historico)[2]
+        totais.append(historico.consultar(()))
+    pd.testing.assert_frame_equal(totais[0], totais[1])
+    assert totais[1].loc[0, 'linhas'] == len(LINHAS)
+    assert totais[1].loc[0, 'total_lpu'] == pytest.approx(devido)
+
+    # Mesmo nome, outras linhas: outra auditoria, somada à primeira
+    gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS[:2])
+    ProcessadorAuditoria.processar_relatorio(ctx, caminho, historico=historico)
+    assert historico.consultar(()).loc[0, 'linhas'] == len(LINHAS) + 2
+    # O resumo mensal bate com as linhas gravadas (cidade só existe nos resultados)
+    resumo = historico.consultar(())
+    por_cidade = historico.consultar(('destino_cidade',))
+    for medida in HistoricoAuditoria.COLUNAS_MOEDA:
+        assert por_cidade[medida].sum() == pytest.approx(resumo.loc[0, medida])
+
+
+def test_registro_layouts_fixar_e_esquecer(tmp_path, ctx):
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS)
+    ProcessadorAuditoria.processar_relatorio(ctx, caminho)
+    sondagem = LeitorArquivo.sondar(caminho, main.LINHAS_BUSCA_CABECALHO)
+    idx_header, nomes, aprendido = RegistroLayouts.reconhecer(sondagem)
+    assert (idx_header, nomes) == (1, COLUNAS_RELATORIO)
+    assert aprendido['frete_total'] == "FRETE TOTAL"
+
+    # Sem peso cubado: o mapeamento fixado vale e a detecção não o desfaz
+    fixado = {campo: col for campo, col in aprendido.items() if campo != 'peso_cubado'}
+    chave = RegistroLayouts.fixar(idx_header, nomes, fixado, "TRANSPORTADORA X")
+    RegistroLayouts.aprender(idx_header, nomes, aprendido)
+    assert RegistroLayouts.reconhecer(sondagem)[2] == fixado
+
+    assert RegistroLayouts.esquecer(chave)
+    assert not RegistroLayouts.esquecer(chave)
+    assert RegistroLayouts.reconhecer(sondagem) is None
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from main import ProcessadorAuditoria, ResumoGerencial
+from tests.conftest import gravar_relatorio
+from tests.test_auditoria import LINHAS_BORDA
+
+
+def test_resumo_gerencial_soma_os_totais_da_auditoria(tmp_path, ctx):
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS_BORDA)
+    gerencial = ResumoGerencial(top_n=3)
+    _, pago, devido, diferenca = ProcessadorAuditoria.processar_relatorio(ctx, caminho, gerencial=gerencial)
+    tabelas = gerencial.tabelas()
+    for _, titulo in ResumoGerencial.DIMENSOES:
+        tabela = tabelas[titulo]
+        assert tabela['LINHAS'].sum() == len(LINHAS_BORDA)
+        assert tabela['TOTAL_PAGO'].sum() == pytest.approx(pago)
+        assert tabela['TOTAL_LPU'].sum() == pytest.approx(devido)
+        assert tabela['DIFERENCA'].sum() == pytest.approx(diferenca)
+    
+    piores = tabelas['Maiores divergências']
+    assert len(piores) == 3
+    assert piores['DIFERENCA'].is_monotonic_decreasing and (piores['DIFERENCA'] > 0).all()
+
+
+def test_resumo_gerencial_coluna_que_precificou(tmp_path, ctx):
+    # Interior -> hub sai da coluna da origem; hub -> hub, da de SP
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', [LINHAS_BORDA[3], LINHAS_BORDA[0]])
+    gerencial = ResumoGerencial()
+    ProcessadorAuditoria.processar_relatorio(ctx, caminho, gerencial=gerencial)
+    por_coluna = gerencial.tabelas()['Por coluna LPU'].set_index('COLUNA_LPU')['LINHAS']
+    assert por_coluna.to_dict() == {"CURITIBA": 1, "SP CAPITAL": 1}
+
+
+def test_resumo_gerencial_em_blocos_igual_ao_inteiro(tmp_path, ctx):
+    caminho = gravar_relatorio(tmp_path / 'relatorio.csv', LINHAS_BORDA)
+    inteiro, em_blocos = ResumoGerencial(), ResumoGerencial()
+    ProcessadorAuditoria.processar_relatorio(ctx, caminho, gerencial=inteiro)
+    ProcessadorAuditoria.processar_em_blocos(ctx, caminho, str(tmp_path / 'saida.csv'), 4, gerencial=em_blocos)
+    for titulo, tabela in inteiro.tabelas().items():
+        pd.testing.assert_frame_equal(em_blocos.tabelas()[titulo], tabela, check_dtype=False)